@@ -0,0 +1,209 @@
+import os
+import time
+import logging
+import datetime
+import sqlite3
+import threading
+
+# Almacén en disco (SQLite en modo WAL) de los correos de Netflix ya clasificados y de la marca de agua
+# de cada buzón (ver estado_buzones.py). Sobrevive a los reinicios del proceso: al despertar, el estado
+# incremental de cada buzón se restaura desde aquí y la primera consulta solo pide lo que llegó después,
+# usando el enlace ya extraído si el correo más reciente ya se había procesado.
+
+ALMACEN_RUTA = os.getenv("ALMACEN_RUTA", "correos.db")  # vacío = sin almacén en disco
+ALMACEN_DIAS_RETENCION = float(os.getenv("ALMACEN_DIAS_RETENCION", os.getenv("DIAS_BUSQUEDA_IMAP", "2")))
+ALMACEN_INTERVALO_PODA = float(os.getenv("ALMACEN_INTERVALO_PODA", "3600"))  # segundos entre podas
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS correos (
+    buzon TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    uid INTEGER NOT NULL,
+    destinatario TEXT NOT NULL,
+    accion TEXT NOT NULL,
+    fecha REAL NOT NULL,
+    link TEXT,
+    PRIMARY KEY (buzon, uidvalidity, uid, destinatario)
+);
+CREATE INDEX IF NOT EXISTS correos_destinatario_accion_fecha ON correos (destinatario, accion, fecha);
+CREATE TABLE IF NOT EXISTS marcas (
+    buzon TEXT PRIMARY KEY,
+    uidvalidity INTEGER NOT NULL,
+    ultimo_uid INTEGER NOT NULL,
+    modseq INTEGER
+);
+CREATE TABLE IF NOT EXISTS avisos (
+    buzon TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    uid INTEGER NOT NULL,
+    destinatario TEXT NOT NULL,
+    accion TEXT NOT NULL,
+    fecha REAL NOT NULL,
+    PRIMARY KEY (buzon, uidvalidity, uid, destinatario, accion)
+);
+CREATE TABLE IF NOT EXISTS actualizaciones (
+    update_id INTEGER PRIMARY KEY,
+    fecha REAL NOT NULL
+);
+"""
+
+
+class AlmacenCorreos:
+    """
+    Acceso thread-safe al archivo SQLite: una conexión por hilo (y por proceso, para sobrevivir a un fork).
+    Los errores de SQLite se registran y no interrumpen la consulta: el almacén es solo una optimización.
+    """
+
+    def __init__(self, ruta=ALMACEN_RUTA, dias_retencion=ALMACEN_DIAS_RETENCION, intervalo_poda=ALMACEN_INTERVALO_PODA):
+        self.ruta = ruta
+        self.dias_retencion = dias_retencion
+        self.intervalo_poda = intervalo_poda
+        self._local = threading.local()
+        self._lock_esquema = threading.Lock()
+        self._esquema_listo = False
+        self._ultima_poda = 0.0
+
+    def activo(self):
+        return bool(self.ruta)
+
+    def _conexion(self):
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is not None and self._local.pid == os.getpid():
+            return conexion
+        conexion = sqlite3.connect(self.ruta, timeout=5)
+        conexion.execute("PRAGMA journal_mode=WAL")
+        conexion.execute("PRAGMA synchronous=NORMAL")  # con WAL es seguro ante caídas del proceso
+        with self._lock_esquema:
+            if not self._esquema_listo:
+                conexion.executescript(_ESQUEMA)
+                self._esquema_listo = True
+        self._local.conexion, self._local.pid = conexion, os.getpid()
+        return conexion
+
+    def _ejecutar(self, descripcion, funcion):
+        if not self.activo():
+            return None
+        try:
+            return funcion(self._conexion())
+        except sqlite3.Error as e:
+            logging.error(f"ALMACEN: Error al {descripcion}: {e}")
+            return None
+
+    def guardar_correos(self, buzon, uidvalidity, correos):
+        """
+        Guarda correos clasificados: lista de (uid, accion, destinatarios, fecha_datetime, link_o_None).
+        """
+        filas = [(buzon, uidvalidity, int(uid), destinatario, accion, fecha.timestamp(), link)
+                 for uid, accion, destinatarios, fecha, link in correos for destinatario in destinatarios]
+        if not filas:
+            return
+
+        def escribir(conexion):
+            with conexion:
+                conexion.executemany(
+                    "INSERT INTO correos (buzon, uidvalidity, uid, destinatario, accion, fecha, link) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (buzon, uidvalidity, uid, destinatario) DO UPDATE SET link = COALESCE(excluded.link, correos.link)",
+                    filas,
+                )
+        self._ejecutar("guardar correos", escribir)
+        self._podar_si_corresponde()
+
+    def guardar_link(self, buzon, uidvalidity, uid, link):
+        def escribir(conexion):
+            with conexion:
+                conexion.execute("UPDATE correos SET link = ? WHERE buzon = ? AND uidvalidity = ? AND uid = ?", (link, buzon, uidvalidity, int(uid)))
+        self._ejecutar("guardar el enlace", escribir)
+
+    def guardar_marca(self, buzon, uidvalidity, ultimo_uid, modseq):
+        def escribir(conexion):
+            with conexion:
+                conexion.execute(
+                    "INSERT INTO marcas (buzon, uidvalidity, ultimo_uid, modseq) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (buzon) DO UPDATE SET uidvalidity = excluded.uidvalidity, ultimo_uid = excluded.ultimo_uid, modseq = excluded.modseq",
+                    (buzon, uidvalidity, int(ultimo_uid), modseq),
+                )
+        self._ejecutar("guardar la marca del buzón", escribir)
+
+    def reclamar_aviso(self, buzon, uidvalidity, uid, destinatario, accion):
+        """
+        Registra que este proceso avisa al dueño del correo (ver aviso_proactivo.py). Retorna False si otro
+        proceso (otro worker del servidor) ya lo había reclamado; sin almacén siempre retorna True.
+        """
+        def insertar(conexion):
+            with conexion:
+                return conexion.execute(
+                    "INSERT OR IGNORE INTO avisos (buzon, uidvalidity, uid, destinatario, accion, fecha) VALUES (?, ?, ?, ?, ?, ?)",
+                    (buzon, uidvalidity, int(uid), destinatario, accion, time.time()),
+                ).rowcount == 1
+        return self._ejecutar("reclamar el aviso", insertar) is not False
+
+    def reclamar_actualizacion(self, update_id):
+        """
+        Registra que este proceso atiende la actualización update_id del webhook de Telegram. Retorna False si
+        otro proceso ya la había reclamado (Telegram la reintentó y cayó en otro worker); sin almacén siempre
+        retorna True.
+        """
+        def insertar(conexion):
+            with conexion:
+                return conexion.execute(
+                    "INSERT OR IGNORE INTO actualizaciones (update_id, fecha) VALUES (?, ?)", (int(update_id), time.time()),
+                ).rowcount == 1
+        return self._ejecutar("reclamar la actualización", insertar) is not False
+
+    def olvidar_buzon(self, buzon):
+        """
+        Borra todo lo guardado de un buzón (al cambiar su UIDVALIDITY).
+        """
+        def borrar(conexion):
+            with conexion:
+                conexion.execute("DELETE FROM correos WHERE buzon = ?", (buzon,))
+                conexion.execute("DELETE FROM marcas WHERE buzon = ?", (buzon,))
+        self._ejecutar("olvidar el buzón", borrar)
+
+    def restaurar(self, buzon, estado_buzon):
+        """
+        Carga en estado_buzon (estado_buzones.EstadoBuzon) la marca y los correos guardados del buzón.
+        Retorna True si había algo guardado.
+        """
+        def leer(conexion):
+            marca = conexion.execute("SELECT uidvalidity, ultimo_uid, modseq FROM marcas WHERE buzon = ?", (buzon,)).fetchone()
+            if marca is None:
+                return False
+            uidvalidity, ultimo_uid, modseq = marca
+            filas = conexion.execute(
+                "SELECT uid, accion, destinatario, fecha, link FROM correos WHERE buzon = ? AND uidvalidity = ? AND fecha >= ?",
+                (buzon, uidvalidity, time.time() - self.dias_retencion * 86400),
+            ).fetchall()
+            correos = {}
+            for uid, accion, destinatario, fecha, link in filas:
+                correo = correos.setdefault(uid, [accion, set(), fecha, link])
+                correo[1].add(destinatario)
+            with estado_buzon.lock:
+                estado_buzon.reiniciar(uidvalidity)
+                for uid, (accion, destinatarios, fecha, link) in correos.items():
+                    estado_buzon.agregar(uid, accion, destinatarios, datetime.datetime.fromtimestamp(fecha, datetime.timezone.utc))
+                    if link:
+                        estado_buzon.guardar_link(uid, link)
+                estado_buzon.avanzar(ultimo_uid, modseq)
+            logging.info(f"ALMACEN: Estado de {buzon} restaurado ({len(correos)} correos hasta el UID {ultimo_uid}).")
+            return True
+        return bool(self._ejecutar("restaurar el buzón", leer))
+
+    def _podar_si_corresponde(self):
+        ahora = time.monotonic()
+        if ahora - self._ultima_poda < self.intervalo_poda:
+            return
+        self._ultima_poda = ahora
+
+        def podar(conexion):
+            with conexion:
+                limite = time.time() - self.dias_retencion * 86400
+                borrados = conexion.execute("DELETE FROM correos WHERE fecha < ?", (limite,)).rowcount
+                conexion.execute("DELETE FROM avisos WHERE fecha < ?", (limite,))
+                conexion.execute("DELETE FROM actualizaciones WHERE fecha < ?", (limite,))
+            if borrados:
+                logging.info(f"ALMACEN: {borrados} correos antiguos eliminados.")
+        self._ejecutar("podar correos antiguos", podar)
+
+
+almacen_correos = AlmacenCorreos()
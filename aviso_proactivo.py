@@ -0,0 +1,128 @@
+import os
+import logging
+import datetime
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from funciones import obtener_codigo_de_pagina, obtener_enlace_confirmacion_final_hogar
+from cache_resultados import cache_resultados, CACHE_TTL
+from cola_telegram import cola_telegram
+from registro_cuentas import registro_cuentas
+from almacen_correos import almacen_correos
+from reglas import regla
+from metricas import contexto_consulta, AVISO_LATENCIA_SEGUNDOS, AVISOS
+
+# Aviso proactivo (opcional): cuando el vigilante IMAP ve llegar un correo de código o de hogar, se visita
+# enseguida la página de Netflix y el resultado se envía por Telegram a los dueños de esa cuenta en
+# cuentas.json, sin esperar a que pregunten. El resultado también queda (hasta CACHE_TTL) en la caché de
+# resultados, así una consulta posterior por la web o el bot lo recibe al instante. Cada correo nuevo borra
+# de la caché de cada proceso el resultado anterior de esa cuenta, aunque el aviso lo mande otro proceso.
+
+AVISO_PROACTIVO = os.getenv("AVISO_PROACTIVO", "0") == "1"
+AVISO_HILOS = int(os.getenv("AVISO_HILOS", "2"))  # páginas de Netflix visitadas a la vez para avisos
+AVISO_INTERVALO_SONDEO = float(os.getenv("AVISO_INTERVALO_SONDEO", "10"))  # segundos entre sondeos si el servidor no tiene IDLE
+AVISO_MAX_RECORDADOS = 2000
+
+
+def _chat_id(dueno):
+    # Las claves de cuentas.json son texto; Telegram (y la cola, que limita por chat) usan el número
+    return int(dueno) if dueno.lstrip("-").isdigit() else dueno
+
+
+def _texto_aviso(correo, accion, valor):
+    if accion == "hogar":
+        return (f"🏠 Llegó una solicitud de Hogar de Netflix para {correo}. Si fuiste tú, HAZ CLIC INMEDIATAMENTE en este "
+                f"enlace para confirmar la actualización:\n{valor}\n\n⚠️ Este enlace vence muy rápido.")
+    return f"🔔 Llegó un código de Netflix para {correo}: `{valor}`"
+
+
+class AvisoProactivo:
+    """
+    Resuelve en segundo plano los correos nuevos que le pasa el vigilante y avisa a sus dueños.
+    Con varios workers cada uno tiene su vigilante: almacen_correos decide cuál avisa, así llega un solo mensaje.
+    """
+
+    def __init__(self, activo=AVISO_PROACTIVO, hilos=AVISO_HILOS):
+        self.activo = activo
+        self.hilos = hilos
+        self._ejecutor = None
+        self._lock = threading.Lock()
+        self._recordados = OrderedDict()  # correos ya avisados por este proceso (por si no hay almacén)
+        self._mas_recientes = {}  # (correo, accion) -> fecha del correo más nuevo visto
+
+    def _obtener_ejecutor(self):
+        # Se crea con el primer aviso (y no al importar), así sobrevive a un fork del servidor
+        with self._lock:
+            if self._ejecutor is None:
+                self._ejecutor = ThreadPoolExecutor(max_workers=self.hilos, thread_name_prefix="aviso")
+            return self._ejecutor
+
+    def _ya_recordado(self, clave):
+        with self._lock:
+            if clave in self._recordados:
+                return True
+            self._recordados[clave] = None
+            while len(self._recordados) > AVISO_MAX_RECORDADOS:
+                self._recordados.popitem(last=False)
+            return False
+
+    def correo_nuevo(self, buzon, uidvalidity, uid, correo, accion, link, fecha):
+        """
+        El vigilante lo llama por cada correo nuevo con su enlace ya extraído. fecha es la de la cabecera Date,
+        desde la que se mide la latencia del aviso.
+        """
+        with self._lock:
+            anterior = self._mas_recientes.get((correo, accion))
+            mas_reciente = anterior is None or fecha > anterior
+            if mas_reciente:
+                self._mas_recientes[(correo, accion)] = fecha
+        if mas_reciente:
+            # El código o enlace que esté en la caché ya es el del correo anterior
+            cache_resultados.invalidar((correo, accion))
+        if not self.activo or not registro_cuentas.es_autorizado(correo):
+            return
+        if self._ya_recordado((buzon, uidvalidity, str(uid), correo, accion)):
+            return
+        if not almacen_correos.reclamar_aviso(buzon, uidvalidity, uid, correo, accion):
+            AVISOS.inc(accion=accion, resultado="otro_proceso")
+            return
+        self._obtener_ejecutor().submit(contextvars.copy_context().run, self._resolver, correo, accion, link, fecha)
+
+    def _resolver(self, correo, accion, link, fecha):
+        try:
+            with contexto_consulta("aviso", accion):
+                valor = obtener_enlace_confirmacion_final_hogar(link) if accion == "hogar" else obtener_codigo_de_pagina(link)
+        except Exception:
+            logging.exception(f"AVISO: Error visitando la página de Netflix para {correo}")
+            valor = None
+        resultado = ("ok", valor) if valor else ("sin_resultado", None)
+
+        edad = (datetime.datetime.now(datetime.timezone.utc) - fecha).total_seconds()
+        restante = min(regla(accion).vigencia - edad, CACHE_TTL)
+        with self._lock:
+            reemplazado = self._mas_recientes.get((correo, accion), fecha) > fecha
+        if valor and restante > 0 and not reemplazado:
+            # Como cualquier otro acierto, y sin pasar la vigencia del enlace del correo
+            cache_resultados.guardar((correo, accion), resultado, lambda _: restante)
+
+        duenos = registro_cuentas.duenos_de(correo)
+        if valor:
+            for dueno in duenos:
+                cola_telegram.enviar(_chat_id(dueno), _texto_aviso(correo, accion, valor))
+        AVISO_LATENCIA_SEGUNDOS.observar(max(0.0, edad), accion=accion, estado=resultado[0])
+        AVISOS.inc(accion=accion, resultado=resultado[0] if not valor else "enviado" if duenos else "sin_duenos")
+        logging.info(f"AVISO: '{accion}' de {correo} resuelto ({resultado[0]}) {edad:.1f} s después de la llegada del correo; {len(duenos) if valor else 0} aviso(s) encolado(s).")
+
+    def detener(self, esperar=True):
+        """
+        Deja terminar los avisos en curso (sus mensajes se encolan antes de que se detenga la cola de Telegram).
+        """
+        with self._lock:
+            ejecutor, self._ejecutor = self._ejecutor, None
+        if ejecutor is not None:
+            ejecutor.shutdown(wait=esperar)
+
+
+aviso_proactivo = AvisoProactivo()
@@ -0,0 +1,121 @@
+"""
+Benchmark del aviso proactivo (aviso_proactivo.py): levanta el servidor IMAP y el HTTP locales (Netflix y API
+de Telegram), arranca los servicios de main con AVISO_PROACTIVO=1 y va dejando correos de código y de hogar
+en el buzón. Mide el tiempo desde que cada correo llega al buzón hasta que su dueño recibe el mensaje con el
+código o el enlace en Telegram, sin que nadie lo pida.
+
+Uso (desde la raíz del repo):
+    python benchmarks/bench_aviso.py [--correos 10] [--intervalo 1.2] [--sin-idle]
+
+Con --sin-idle el servidor IMAP no anuncia IDLE y el vigilante sondea cada AVISO_INTERVALO_SONDEO segundos.
+Termina con código 1 si algún aviso no llega o trae un resultado equivocado, o si se avisó de los correos
+que ya estaban en el buzón al arrancar.
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import datetime
+import tempfile
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from servidor_imap_local import Buzon, iniciar_servidor_imap  # noqa: E402
+from servidor_http_local import iniciar_servidor_http, codigo_para  # noqa: E402
+from correos_sinteticos import sembrar_buzon, correo_codigo, correo_hogar  # noqa: E402
+
+BOT_TOKEN = "123456:bench"
+DUENO = "1000"
+
+
+def _percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, max(0, int(round(p / 100 * len(ordenados) + 0.5)) - 1))] if ordenados else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--correos", type=int, default=10, help="correos de Netflix que llegan durante la medición")
+    parser.add_argument("--intervalo", type=float, default=1.2, help="segundos entre llegadas")
+    parser.add_argument("--cuentas", type=int, default=5)
+    parser.add_argument("--sin-idle", action="store_true")
+    parser.add_argument("--timeout", type=float, default=30.0, help="segundos máximos de espera por aviso")
+    parser.add_argument("--semilla", type=int, default=1)
+    args = parser.parse_args()
+    azar = random.Random(args.semilla)
+
+    servidor_http, puerto_http, estado_http = iniciar_servidor_http()
+    url_base = f"http://127.0.0.1:{puerto_http}"
+    buzon = Buzon()
+    cuentas = [f"cliente{i}@bench.local" for i in range(args.cuentas)]
+    sembrar_buzon(buzon, cuentas, url_base, 60, 0.0, 0, args.semilla)
+    capacidades = "IMAP4rev1 UIDPLUS CONDSTORE" if args.sin_idle else None
+    servidor_imap, puerto_imap, _ = iniciar_servidor_imap(buzon, capacidades=capacidades)
+
+    directorio = tempfile.mkdtemp(prefix="bench_aviso_")
+    ruta_cuentas = os.path.join(directorio, "cuentas.json")
+    with open(ruta_cuentas, "w", encoding="utf-8") as f:
+        json.dump({DUENO: cuentas}, f)
+    # La configuración de los módulos se lee al importarlos: hay que fijarla antes de importar main
+    os.environ.update({
+        "BOT_TOKEN": BOT_TOKEN, "E-MAIL_USER": "bench@bench.local", "EMAIL_PASS": "bench",
+        "IMAP_HOST": "127.0.0.1", "IMAP_PUERTO": str(puerto_imap), "IMAP_SSL": "0",
+        "CUENTAS_RUTA": ruta_cuentas, "ALMACEN_RUTA": os.path.join(directorio, "correos.db"),
+        "VIGILANTE_IMAP": "1", "AVISO_PROACTIVO": "1", "AVISO_INTERVALO_SONDEO": os.getenv("AVISO_INTERVALO_SONDEO", "1"),
+    })
+    os.environ.pop("ADMIN_TELEGRAM_ID", None)
+    import telebot
+    import main as app_main
+    from indice_correos import indice_correos
+
+    logging.disable(logging.INFO)
+    telebot.apihelper.API_URL = f"{url_base}/bot{{0}}/{{1}}"
+    app_main.iniciar_servicios()
+    limite = time.time() + 30
+    while not indice_correos.activo() and time.time() < limite:
+        time.sleep(0.1)
+    time.sleep(1)  # margen para que un aviso indebido del barrido inicial llegue a la API de Telegram
+
+    fallos = []
+    if estado_http.mensajes.get(DUENO):
+        fallos.append(f"se avisaron {len(estado_http.mensajes[DUENO])} correos que ya estaban en el buzón al arrancar")
+
+    latencias = {"code": [], "hogar": []}
+    for n in range(args.correos):
+        cuenta, accion = azar.choice(cuentas), azar.choice(("code", "hogar"))
+        token = f"aviso{n}x{azar.randint(0, 10**9)}"
+        fecha = datetime.datetime.now(datetime.timezone.utc)
+        construir = correo_codigo if accion == "code" else correo_hogar
+        esperado = codigo_para(token) if accion == "code" else "/hogar/"
+        llegada = time.perf_counter()
+        buzon.agregar(construir(cuenta, url_base, token, fecha, azar), fecha.replace(tzinfo=None))
+        recibido = estado_http.esperar_mensaje(DUENO, lambda texto: cuenta in texto and esperado in texto, args.timeout)
+        if recibido is None:
+            fallos.append(f"correo {n} ({accion} para {cuenta}): sin aviso en {args.timeout} s")
+        else:
+            latencias[accion].append(recibido[0] - llegada)
+        # Los avisos ya recibidos no deben cumplir la condición del siguiente
+        estado_http.mensajes.pop(DUENO, None)
+        time.sleep(max(0.0, args.intervalo - (time.perf_counter() - llegada)))
+
+    print(f"{'acción':<8} {'n':>4} {'p50 ms':>9} {'p95 ms':>9} {'máx ms':>9}")
+    for accion, valores in latencias.items():
+        if valores:
+            print(f"{accion:<8} {len(valores):>4} {_percentil(valores, 50) * 1000:>9.1f} {_percentil(valores, 95) * 1000:>9.1f} {max(valores) * 1000:>9.1f}")
+    print(f"IDLE: {'no (sondeo)' if args.sin_idle else 'sí'}")
+
+    app_main.detener_servicios(timeout=5)
+    servidor_imap.shutdown()
+    servidor_http.shutdown()
+    for fallo in fallos:
+        print(f"FALLO: {fallo}")
+    return 1 if fallos else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
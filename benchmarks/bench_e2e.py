@@ -0,0 +1,292 @@
+"""
+Benchmark de extremo a extremo: levanta un servidor IMAP local sembrado con un buzón sintético y un servidor
+HTTP local que hace de Netflix y de la API de Telegram, y carga la app Flask real (main.app) con peticiones
+concurrentes a /consultar_accion y al webhook (/code, /hogar). Reporta latencias p50/p95/p99, rendimiento
+y bytes transferidos, y puede guardar o comparar contra una línea base JSON.
+
+Uso (desde la raíz del repo):
+    python benchmarks/bench_e2e.py --mensajes 2000 --peticiones 200 --concurrencia 8 --guardar base.json
+    python benchmarks/bench_e2e.py --mensajes 2000 --peticiones 200 --concurrencia 8 --comparar base.json
+
+Por defecto la caché de resultados está desactivada (CACHE_TTL=0) para medir la búsqueda completa en
+cada petición; --con-cache la deja con sus valores normales. --vigilante arranca el vigilante IDLE.
+--motor-async resuelve las consultas con el motor asyncio (MOTOR_ASYNC=1).
+Con --comparar termina con código 1 si el p95 de algún grupo empeora más que --tolerancia.
+"""
+import os
+import sys
+import re
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from servidor_imap_local import Buzon, iniciar_servidor_imap  # noqa: E402
+from servidor_http_local import iniciar_servidor_http, codigo_para  # noqa: E402
+from correos_sinteticos import sembrar_buzon  # noqa: E402
+
+BOT_TOKEN = "123456:bench"
+DUENO = "1000"
+
+
+def _argumentos():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mensajes", type=int, default=500, help="correos en el buzón sintético")
+    parser.add_argument("--cuentas", type=int, default=20, help="correos de Netflix autorizados")
+    parser.add_argument("--proporcion-adjuntos", type=float, default=0.1)
+    parser.add_argument("--adjunto-kb", type=int, default=512)
+    parser.add_argument("--peticiones", type=int, default=100)
+    parser.add_argument("--concurrencia", type=int, default=8)
+    parser.add_argument("--proporcion-webhook", type=float, default=0.3, help="fracción de peticiones que van por Telegram")
+    parser.add_argument("--latencia-imap", type=float, default=0.0, help="ms añadidos a cada comando IMAP")
+    parser.add_argument("--latencia-http", type=float, default=0.0, help="ms añadidos a cada página de Netflix")
+    parser.add_argument("--timeout", type=float, default=60.0, help="segundos máximos por petición")
+    parser.add_argument("--con-cache", action="store_true")
+    parser.add_argument("--vigilante", action="store_true")
+    parser.add_argument("--motor-async", action="store_true")
+    parser.add_argument("--sin-condstore", action="store_true", help="el servidor IMAP local no anuncia CONDSTORE")
+    parser.add_argument("--almacen", help="archivo SQLite de almacen_correos (por defecto uno nuevo y vacío); "
+                        "repetir con el mismo archivo (y el mismo --puerto-http) mide un arranque en caliente")
+    parser.add_argument("--puerto-http", type=int, default=0, help="puerto fijo para las páginas de Netflix (0 = libre)")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--guardar", help="guarda el resultado como línea base en este JSON")
+    parser.add_argument("--comparar", help="compara contra una línea base guardada con --guardar")
+    parser.add_argument("--tolerancia", type=float, default=0.2, help="empeoramiento de p95 aceptado al comparar (0.2 = 20%%)")
+    return parser.parse_args()
+
+
+def _preparar_entorno(args, puerto_imap, cuentas):
+    directorio = tempfile.mkdtemp(prefix="bench_e2e_")
+    ruta_cuentas = os.path.join(directorio, "cuentas.json")
+    with open(ruta_cuentas, "w", encoding="utf-8") as f:
+        json.dump({DUENO: cuentas}, f)
+    # La configuración de los módulos se lee al importarlos: hay que fijarla antes de importar main
+    os.environ.update({
+        "BOT_TOKEN": BOT_TOKEN,
+        "E-MAIL_USER": "bench@bench.local",
+        "EMAIL_PASS": "bench",
+        "IMAP_HOST": "127.0.0.1",
+        "IMAP_PUERTO": str(puerto_imap),
+        "IMAP_SSL": "0",
+        "CUENTAS_RUTA": ruta_cuentas,
+        "VIGILANTE_IMAP": "1" if args.vigilante else "0",
+        "MOTOR_ASYNC": "1" if args.motor_async else "0",
+        "WEB_TIMEOUT_CONSULTA": str(args.timeout),
+        "ALMACEN_RUTA": args.almacen or os.path.join(directorio, "correos.db"),
+    })
+    os.environ.pop("ADMIN_TELEGRAM_ID", None)
+    if not args.con_cache:
+        os.environ["CACHE_TTL"] = "0"
+        os.environ["CACHE_TTL_NEGATIVO"] = "0"
+
+
+def _percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, max(0, int(round(p / 100 * len(ordenados) + 0.5)) - 1))]
+
+
+class Carga:
+    def __init__(self, args, url_app, estado_http, vigentes):
+        self.args = args
+        self.url_app = url_app
+        self.estado_http = estado_http
+        self.vigentes = vigentes
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.muestras = {}  # (canal, accion) -> [(segundos, ok)]
+        # Como los de Telegram, los update_id crecen de una corrida a otra (el almacén recuerda los ya atendidos)
+        self.primer_update_id = int(time.time() * 1000)
+
+    def _sesion(self):
+        import requests
+        if not hasattr(self.local, "sesion"):
+            self.local.sesion = requests.Session()
+        return self.local.sesion
+
+    def _es_correcto(self, texto, cuenta, accion):
+        if accion == "code":
+            return codigo_para(self.vigentes[cuenta]) in texto
+        return "/hogar/" in texto
+
+    def web(self, n, cuenta, accion):
+        inicio = time.perf_counter()
+        respuesta = self._sesion().post(f"{self.url_app}/consultar_accion", data={"email": cuenta, "action": accion}, timeout=self.args.timeout)
+        return time.perf_counter() - inicio, respuesta.ok and self._es_correcto(respuesta.text, cuenta, accion)
+
+    def webhook(self, n, cuenta, accion):
+        chat_id = 100000 + n
+        comando = "/code" if accion == "code" else "/hogar"
+        update = {
+            "update_id": self.primer_update_id + n,
+            "message": {
+                "message_id": n, "date": int(time.time()), "text": f"{comando} {cuenta}",
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(comando)}],
+            },
+        }
+        inicio = time.perf_counter()
+        self._sesion().post(f"{self.url_app}/{BOT_TOKEN}", json=update, timeout=self.args.timeout)
+        # Fin = el mensaje con el resultado llega a la API de Telegram (no el "Buscando..." inicial)
+        llegada = self.estado_http.esperar_mensaje(chat_id, lambda texto: "Buscando" not in texto, self.args.timeout)
+        if llegada is None:
+            return self.args.timeout, False
+        instante, texto = llegada
+        return instante - inicio, self._es_correcto(texto, cuenta, accion)
+
+    def ejecutar_una(self, n, canal, cuenta, accion):
+        try:
+            segundos, ok = getattr(self, canal)(n, cuenta, accion)
+        except Exception as e:
+            print(f"Petición {n} ({canal} {accion}) falló: {e}", file=sys.stderr)
+            segundos, ok = self.args.timeout, False
+        with self.lock:
+            self.muestras.setdefault((canal, accion), []).append((segundos, ok))
+
+
+def _resumen(muestras, duracion):
+    grupos = {}
+    for (canal, accion), lista in sorted(muestras.items()):
+        tiempos = [s * 1000 for s, _ in lista]
+        grupos[f"{canal}/{accion}"] = {
+            "n": len(lista),
+            "ok": sum(1 for _, ok in lista if ok),
+            "p50_ms": _percentil(tiempos, 50),
+            "p95_ms": _percentil(tiempos, 95),
+            "p99_ms": _percentil(tiempos, 99),
+            "media_ms": sum(tiempos) / len(tiempos),
+        }
+    total = sum(len(lista) for lista in muestras.values())
+    return {"grupos": grupos, "duracion_s": duracion, "peticiones_por_s": total / duracion if duracion else 0.0}
+
+
+_RE_ETAPA = re.compile(r'^netflix_etapa_segundos_(sum|count)\{.*etapa="([^"]+)"\} (\S+)$', re.MULTILINE)
+
+
+def _etapas_desde_metricas(texto):
+    """
+    Suma por etapa (de todos los canales y acciones) el tiempo y la cantidad expuestos en /metrics.
+    """
+    etapas = {}
+    for tipo, etapa, valor in _RE_ETAPA.findall(texto):
+        etapas.setdefault(etapa, {"sum": 0.0, "count": 0.0})[tipo] += float(valor)
+    return {etapa: {"n": int(v["count"]), "media_ms": v["sum"] / v["count"] * 1000 if v["count"] else 0.0}
+            for etapa, v in sorted(etapas.items())}
+
+
+def _imprimir(resultado):
+    print(f"{'grupo':<14} {'n':>5} {'ok':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'media ms':>9}")
+    for nombre, g in resultado["grupos"].items():
+        print(f"{nombre:<14} {g['n']:>5} {g['ok']:>5} {g['p50_ms']:>9.1f} {g['p95_ms']:>9.1f} {g['p99_ms']:>9.1f} {g['media_ms']:>9.1f}")
+    print(f"\nRendimiento: {resultado['peticiones_por_s']:.2f} peticiones/s en {resultado['duracion_s']:.2f} s")
+    imap, http = resultado["imap"], resultado["http"]
+    print(f"IMAP: {imap['bytes_enviados'] / 1024:.1f} KB servidos, {imap['bytes_recibidos'] / 1024:.1f} KB recibidos, "
+          f"{imap['comandos']} comandos, {imap['conexiones']} conexiones")
+    print(f"HTTP: {http['bytes_enviados'] / 1024:.1f} KB servidos, {http['peticiones_codigo']} páginas de código, "
+          f"{http['peticiones_hogar']} de hogar, {http['peticiones_telegram']} llamadas a Telegram")
+    if resultado.get("etapas"):
+        print("\nEtapas (según /metrics):")
+        for etapa, e in resultado["etapas"].items():
+            print(f"  {etapa:<20} {e['n']:>6} {e['media_ms']:>9.2f} ms de media")
+
+
+def _comparar(resultado, ruta, tolerancia):
+    with open(ruta, encoding="utf-8") as f:
+        base = json.load(f)
+    regresiones = []
+    print(f"\nComparación con {ruta}:")
+    for nombre, g in resultado["grupos"].items():
+        anterior = base["grupos"].get(nombre)
+        if not anterior:
+            continue
+        for medida in ("p50_ms", "p95_ms", "p99_ms"):
+            cambio = (g[medida] - anterior[medida]) / anterior[medida] if anterior[medida] else 0.0
+            print(f"  {nombre:<14} {medida:<7} {anterior[medida]:>9.1f} -> {g[medida]:>9.1f} ({cambio:+.0%})")
+        if anterior["p95_ms"] and (g["p95_ms"] - anterior["p95_ms"]) / anterior["p95_ms"] > tolerancia:
+            regresiones.append(nombre)
+    for medida in ("bytes_enviados", "comandos"):
+        print(f"  imap {medida:<15} {base['imap'][medida]:>12} -> {resultado['imap'][medida]:>12}")
+    for nombre in regresiones:
+        print(f"REGRESIÓN: el p95 de {nombre} empeoró más de {tolerancia:.0%}")
+    return 1 if regresiones else 0
+
+
+def main():
+    args = _argumentos()
+    azar = random.Random(args.semilla)
+
+    servidor_http, puerto_http, estado_http = iniciar_servidor_http(latencia=args.latencia_http / 1000, puerto=args.puerto_http)
+    buzon = Buzon()
+    cuentas = [f"cliente{i}@bench.local" for i in range(args.cuentas)]
+    inicio = time.perf_counter()
+    vigentes = sembrar_buzon(buzon, cuentas, f"http://127.0.0.1:{puerto_http}", args.mensajes,
+                             args.proporcion_adjuntos, args.adjunto_kb, args.semilla)
+    print(f"Buzón sembrado con {len(buzon.mensajes)} correos en {time.perf_counter() - inicio:.1f} s")
+    capacidades = "IMAP4rev1 IDLE UIDPLUS" if args.sin_condstore else None
+    servidor_imap, puerto_imap, estadisticas_imap = iniciar_servidor_imap(buzon, latencia=args.latencia_imap / 1000, capacidades=capacidades)
+
+    _preparar_entorno(args, puerto_imap, cuentas)
+    import telebot
+    from werkzeug.serving import make_server
+    import main as app_main
+
+    logging.disable(logging.INFO)  # los logs por petición distorsionan las mediciones
+    telebot.apihelper.API_URL = f"http://127.0.0.1:{puerto_http}/bot{{0}}/{{1}}"
+    app_main.iniciar_servicios()
+    if args.vigilante:
+        from indice_correos import indice_correos
+        limite = time.time() + 30
+        while not indice_correos.activo() and time.time() < limite:
+            time.sleep(0.1)
+
+    servidor_app = make_server("127.0.0.1", 0, app_main.app, threaded=True)
+    threading.Thread(target=servidor_app.serve_forever, name="app", daemon=True).start()
+    carga = Carga(args, f"http://127.0.0.1:{servidor_app.server_port}", estado_http, vigentes)
+
+    plan = [
+        (n, "webhook" if azar.random() < args.proporcion_webhook else "web", azar.choice(cuentas), azar.choice(("code", "hogar")))
+        for n in range(1, args.peticiones + 1)
+    ]
+    # Los contadores de bytes arrancan de cero para la carga (sin el barrido inicial del vigilante)
+    estadisticas_imap.bytes_enviados = estadisticas_imap.bytes_recibidos = estadisticas_imap.comandos = estadisticas_imap.conexiones = 0
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrencia) as ejecutor:
+        for tarea in plan:
+            ejecutor.submit(carga.ejecutar_una, *tarea)
+    duracion = time.perf_counter() - inicio
+
+    resultado = _resumen(carga.muestras, duracion)
+    resultado["imap"] = estadisticas_imap.como_dict()
+    resultado["http"] = estado_http.como_dict()
+    resultado["etapas"] = _etapas_desde_metricas(carga._sesion().get(f"{carga.url_app}/metrics", timeout=args.timeout).text)
+    resultado["parametros"] = {k: v for k, v in vars(args).items() if k not in ("guardar", "comparar")}
+    _imprimir(resultado)
+
+    servidor_app.shutdown()
+    servidor_imap.shutdown()
+    servidor_http.shutdown()
+
+    if args.guardar:
+        with open(args.guardar, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+        print(f"\nLínea base guardada en {args.guardar}")
+    fallidas = sum(g["n"] - g["ok"] for g in resultado["grupos"].values())
+    codigo = _comparar(resultado, args.comparar, args.tolerancia) if args.comparar else 0
+    if fallidas:
+        print(f"ATENCIÓN: {fallidas} peticiones no devolvieron el código o enlace esperado")
+        codigo = 1
+    return codigo
+
+
+if __name__ == "__main__":
+    sys.exit(main())
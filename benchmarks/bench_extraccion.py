@@ -0,0 +1,81 @@
+"""
+Micro-benchmark de la extracción de enlaces y códigos: extracción rápida (expresiones regulares)
+contra el árbol completo de BeautifulSoup, sobre los HTML guardados en benchmarks/fixtures.
+
+Uso (desde la raíz del repo):
+    python benchmarks/bench_extraccion.py [--repeticiones 200]
+
+Termina con código 1 si la extracción rápida da un resultado distinto al de BeautifulSoup
+o si deja de ser más rápida, para detectar regresiones del parser.
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from bs4 import BeautifulSoup  # noqa: E402
+from extraccion_rapida import extraer_link_rapido, hay_boton_confirmar_rapido, RE_CODIGO  # noqa: E402
+from funciones import _extraer_link_con_soup, _buscar_confirmacion_con_soup  # noqa: E402
+
+FIXTURES = os.path.join(RAIZ, "benchmarks", "fixtures")
+
+
+def _codigo_con_soup(contenido):
+    div = BeautifulSoup(contenido, "html.parser").find("div", class_="challenge-code")
+    return div.get_text(strip=True) if div else None
+
+
+def _codigo_rapido(contenido):
+    encontrado = RE_CODIGO.search(contenido)
+    return encontrado.group(1) if encontrado else None
+
+
+# (fixture, descripción, extracción rápida, extracción con BeautifulSoup)
+CASOS = [
+    ("correo_codigo.html", "enlace nftoken", lambda h: extraer_link_rapido(h), lambda h: _extraer_link_con_soup(h)),
+    ("correo_hogar.html", "botón 'Sí, la envié yo'", lambda h: extraer_link_rapido(h, es_hogar=True), lambda h: _extraer_link_con_soup(h, es_hogar=True)),
+    ("correo_hogar_entidades.html", "botón hogar con entidades", lambda h: extraer_link_rapido(h, es_hogar=True), lambda h: _extraer_link_con_soup(h, es_hogar=True)),
+    ("correo_sin_enlace.html", "correo sin enlace", lambda h: extraer_link_rapido(h), lambda h: _extraer_link_con_soup(h)),
+    ("pagina_hogar.html", "botón 'Confirmar actualización'", hay_boton_confirmar_rapido, lambda h: _buscar_confirmacion_con_soup(h) == "boton"),
+    ("pagina_codigo.html", "código de 4 dígitos", _codigo_rapido, _codigo_con_soup),
+]
+
+
+def _medir(funcion, contenido, repeticiones):
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        resultado = funcion(contenido)
+    return (time.perf_counter() - inicio) / repeticiones * 1000, resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticiones", type=int, default=200)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)  # los logs de cada extracción distorsionan las mediciones
+
+    fallos = []
+    print(f"{'fixture':<30} {'caso':<32} {'KB':>6} {'rápida ms':>10} {'soup ms':>10} {'x':>7}")
+    for archivo, descripcion, rapida, completa in CASOS:
+        with open(os.path.join(FIXTURES, archivo), encoding="utf-8") as f:
+            contenido = f.read()
+        ms_rapida, res_rapida = _medir(rapida, contenido, args.repeticiones)
+        ms_soup, res_soup = _medir(completa, contenido, max(1, args.repeticiones // 10))
+        # Un fallo de la vía rápida (None/False) es válido: en producción se usa BeautifulSoup como respaldo
+        if res_rapida and res_rapida != res_soup:
+            fallos.append(f"{archivo}: la extracción rápida dio {res_rapida!r} y BeautifulSoup {res_soup!r}")
+        if ms_rapida >= ms_soup:
+            fallos.append(f"{archivo}: la extracción rápida ({ms_rapida:.3f} ms) no es más rápida que BeautifulSoup ({ms_soup:.3f} ms)")
+        print(f"{archivo:<30} {descripcion:<32} {len(contenido) / 1024:>6.1f} {ms_rapida:>10.3f} {ms_soup:>10.3f} {ms_soup / ms_rapida:>6.0f}x")
+
+    for fallo in fallos:
+        print(f"REGRESIÓN: {fallo}")
+    return 1 if fallos else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
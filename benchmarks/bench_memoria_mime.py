@@ -0,0 +1,100 @@
+"""
+Micro-benchmark de memoria de la lectura del HTML de un correo crudo: árbol completo (email.message_from_bytes
+y walk(), como se hacía al descargar el mensaje entero) contra la lectura por bloques de mime_incremental,
+con correos sintéticos de Netflix con adjuntos de varios tamaños (antes y después de la parte HTML).
+
+Uso (desde la raíz del repo):
+    python benchmarks/bench_memoria_mime.py [--adjuntos-kb 0 512 4096 16384] [--repeticiones 5]
+
+El pico de memoria se mide con tracemalloc e incluye los bytes descargados: el mensaje entero para el
+árbol completo y un bloque de MIME_TAMANO_BLOQUE por vez (FETCH parcial) para la lectura por bloques.
+Termina con código 1 si los dos caminos dan un HTML distinto (salvo que la lectura por bloques se haya
+detenido en MIME_MAX_BYTES, que es lo esperado con un adjunto enorme antes del HTML).
+"""
+import os
+import sys
+import time
+import email
+import email.policy
+import random
+import logging
+import argparse
+import datetime
+import tracemalloc
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from correos_sinteticos import correo_codigo  # noqa: E402
+from mime_incremental import LectorHTML, MIME_TAMANO_BLOQUE  # noqa: E402
+
+
+def _html_con_arbol(crudo):
+    # Camino anterior: el mensaje completo descargado y parseado a un árbol
+    mensaje = email.message_from_bytes(bytes(crudo))
+    for parte in mensaje.walk():
+        if parte.get_content_type() == "text/html" and "attachment" not in str(parte.get("Content-Disposition")):
+            return parte.get_payload(decode=True).decode(parte.get_content_charset() or "utf-8", errors="ignore")
+    return None
+
+
+def _html_por_bloques(crudo):
+    lector = LectorHTML()
+    for inicio in range(0, len(crudo), MIME_TAMANO_BLOQUE):
+        if lector.alimentar(crudo[inicio:inicio + MIME_TAMANO_BLOQUE]):  # cada bloque es un FETCH parcial
+            break
+    lector.cerrar()
+    return lector.html, lector.excedido
+
+
+def _adjunto_primero(crudo):
+    # Mueve el adjunto delante de la parte multipart/alternative: el peor caso para la lectura por bloques
+    mensaje = email.message_from_bytes(crudo)
+    mensaje.set_payload(list(reversed(mensaje.get_payload())))
+    return mensaje.as_bytes(policy=email.policy.compat32.clone(linesep="\r\n"))
+
+
+def _medir(funcion, crudo, repeticiones):
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        resultado = funcion(crudo)
+    segundos = (time.perf_counter() - inicio) / repeticiones
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return pico / 1024, segundos * 1000, resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--adjuntos-kb", type=int, nargs="+", default=[0, 512, 4096, 16384])
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    azar = random.Random(1)
+    fecha = datetime.datetime.now(datetime.timezone.utc)
+    fallos = []
+    print(f"{'adjunto':<26} {'KB correo':>10} {'árbol KB pico':>14} {'bloques KB pico':>16} {'árbol ms':>9} {'bloques ms':>11}")
+    for adjunto_kb in args.adjuntos_kb:
+        crudo = correo_codigo("cuenta@bench.local", "http://127.0.0.1:1", "t1", fecha, azar, adjunto_kb=adjunto_kb)
+        casos = [("después del HTML", crudo)]
+        if adjunto_kb:
+            casos.append(("antes del HTML", _adjunto_primero(crudo)))
+        for posicion, datos in casos:
+            pico_arbol, ms_arbol, html_arbol = _medir(_html_con_arbol, datos, args.repeticiones)
+            pico_bloques, ms_bloques, (html_bloques, excedido) = _medir(_html_por_bloques, datos, args.repeticiones)
+            if html_arbol != html_bloques and not excedido:
+                fallos.append(f"adjunto de {adjunto_kb} KB {posicion}: los dos caminos dieron un HTML distinto")
+            etiqueta = f"{adjunto_kb} KB {posicion}" if adjunto_kb else "sin adjunto"
+            nota = "  (límite MIME_MAX_BYTES)" if excedido else ""
+            print(f"{etiqueta:<26} {len(datos) / 1024:>10.0f} {pico_arbol:>14.0f} {pico_bloques:>16.0f} {ms_arbol:>9.2f} {ms_bloques:>11.2f}{nota}")
+
+    for fallo in fallos:
+        print(f"REGRESIÓN: {fallo}")
+    return 1 if fallos else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
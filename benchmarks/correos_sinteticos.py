@@ -0,0 +1,128 @@
+"""
+Generador de buzones sintéticos para los benchmarks: correos de Netflix (código y hogar) tomados de
+benchmarks/fixtures con los enlaces apuntando al servidor HTTP local, mezclados con correos de relleno
+con asuntos codificados (RFC 2047 B y Q), cuerpos en base64 / quoted-printable / 8bit y adjuntos grandes.
+"""
+import os
+import re
+import random
+import datetime
+from email import charset, policy
+from email.header import Header
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from email.mime.application import MIMEApplication
+from email.utils import format_datetime, make_msgid
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+ASUNTO_CODIGO = "Código de acceso temporal de Netflix"
+ASUNTO_HOGAR = "Importante: Cómo actualizar tu Hogar con Netflix"
+VENTANA_RECIENTE = 600  # segundos; por debajo de la vigencia por defecto de reglas.py (900)
+ASUNTOS_RELLENO = [
+    "Tu factura de este mes", "Novedades de la semana", "Confirmación de pedido nº {n}",
+    "¡Oferta especial sólo para ti!", "Recordatorio: reunión mañana", "Netflix: nuevos estrenos de octubre",
+    "Actualización de la política de privacidad", "Tu resumen semanal", "Re: presupuesto {n}",
+]
+_POLITICA = policy.compat32.clone(linesep="\r\n")
+_URL_CODIGO = re.compile(r"https://www\.netflix\.com/account/travel/verify\?nftoken=[^&\"]*")
+_URL_HOGAR = re.compile(r"https://www\.netflix\.com/account/update-primary-location\?nftoken=[^&\"]*")
+
+
+def _fixture(nombre):
+    with open(os.path.join(FIXTURES, nombre), encoding="utf-8") as f:
+        return f.read()
+
+
+def _charset(codificacion):
+    cs = charset.Charset("utf-8")
+    cs.body_encoding = {"base64": charset.BASE64, "qp": charset.QP, "8bit": None}[codificacion]
+    return cs
+
+
+def _asunto(texto, azar):
+    # Mitad en base64, mitad en quoted-printable, y algunos sin codificar (solo si son ASCII)
+    forma = azar.choice(("b", "q", "plano"))
+    if forma == "plano" and texto.isascii():
+        return texto
+    cs = charset.Charset("utf-8")
+    cs.header_encoding = charset.BASE64 if forma == "b" else charset.QP
+    return Header(texto, cs).encode()
+
+
+def construir_correo(asunto, html, destinatario, fecha, azar, adjunto_kb=0, por_delivered_to=False):
+    alternativa = MIMEMultipart("alternative")
+    alternativa.attach(MIMEText(re.sub(r"<[^>]+>", " ", html)[:2000], "plain", _charset(azar.choice(("qp", "8bit")))))
+    alternativa.attach(MIMEText(html, "html", _charset(azar.choice(("base64", "qp")))))
+    if adjunto_kb:
+        mensaje = MIMEMultipart("mixed")
+        mensaje.attach(alternativa)
+        adjunto = MIMEApplication(azar.randbytes(adjunto_kb * 1024), "pdf")
+        adjunto.add_header("Content-Disposition", "attachment", filename="documento.pdf")
+        mensaje.attach(adjunto)
+    else:
+        mensaje = alternativa
+    mensaje["From"] = "Netflix <info@account.netflix.com>"
+    # Algunos llegan reenviados desde un alias: el destinatario real solo aparece en Delivered-To
+    mensaje["To"] = "alias@bench.local" if por_delivered_to else destinatario
+    mensaje["Delivered-To"] = destinatario
+    mensaje["Subject"] = _asunto(asunto, azar)
+    mensaje["Date"] = format_datetime(fecha)
+    mensaje["Message-ID"] = make_msgid(domain="bench.local")
+    return mensaje.as_bytes(policy=_POLITICA)
+
+
+def correo_codigo(destinatario, url_base, token, fecha, azar, adjunto_kb=0):
+    html = _URL_CODIGO.sub(f"{url_base}/codigo/{token}?nftoken={token}", _fixture("correo_codigo.html"))
+    return construir_correo(ASUNTO_CODIGO, html, destinatario, fecha, azar, adjunto_kb, azar.random() < 0.2)
+
+
+def correo_hogar(destinatario, url_base, token, fecha, azar, adjunto_kb=0):
+    html = _URL_HOGAR.sub(f"{url_base}/hogar/{token}?nftoken={token}", _fixture(azar.choice(("correo_hogar.html", "correo_hogar_entidades.html"))))
+    return construir_correo(ASUNTO_HOGAR, html, destinatario, fecha, azar, adjunto_kb, azar.random() < 0.2)
+
+
+def correo_relleno(destinatario, fecha, azar, adjunto_kb=0):
+    asunto = azar.choice(ASUNTOS_RELLENO).format(n=azar.randint(1000, 99999))
+    html = _fixture("correo_sin_enlace.html") if azar.random() < 0.5 else "<p>" + "Lorem ipsum dolor sit amet. " * azar.randint(20, 400) + "</p>"
+    return construir_correo(asunto, html, destinatario, fecha, azar, adjunto_kb)
+
+
+def sembrar_buzon(buzon, cuentas, url_base, mensajes=500, proporcion_adjuntos=0.1, adjunto_kb=512, semilla=1):
+    """
+    Llena el buzón con `mensajes` correos repartidos en las últimas horas. Cada cuenta recibe un correo de
+    código antiguo, uno reciente y uno de hogar; el resto es relleno. Los recientes (y lo que llega después)
+    caen en los últimos VENTANA_RECIENTE segundos, dentro de la vigencia de las reglas; el código antiguo
+    queda fuera. Retorna {cuenta: token_codigo_vigente}.
+    """
+    azar = random.Random(semilla)
+    ahora = datetime.datetime.now(datetime.timezone.utc)
+    relleno = max(0, mensajes - 3 * len(cuentas))
+    eventos = []
+    for i in range(relleno):
+        adjunto = adjunto_kb if azar.random() < proporcion_adjuntos else 0
+        eventos.append(("relleno", azar.choice(cuentas), adjunto))
+    vigentes = {}
+    for i, cuenta in enumerate(cuentas):
+        eventos.insert(azar.randint(0, len(eventos) // 4), ("codigo_viejo", cuenta, 0))
+        eventos.insert(azar.randint(len(eventos) // 2, len(eventos)), ("hogar", cuenta, 0))
+        eventos.insert(azar.randint(len(eventos) // 2, len(eventos)), ("codigo", cuenta, 0))
+    total = len(eventos)
+    inicio_reciente = min(n for n, evento in enumerate(eventos) if evento[0] in ("codigo", "hogar")) if cuentas else total
+    for n, (tipo, cuenta, adjunto) in enumerate(eventos):
+        if n >= inicio_reciente:
+            segundos = (total - n) * VENTANA_RECIENTE / (total - inicio_reciente + 1)
+        else:
+            segundos = VENTANA_RECIENTE + (inicio_reciente - n) * 30
+        fecha = ahora - datetime.timedelta(seconds=segundos)
+        token = f"t{n}x{azar.randint(0, 10**9)}"
+        if tipo == "relleno":
+            crudo = correo_relleno(cuenta, fecha, azar, adjunto)
+        elif tipo == "hogar":
+            crudo = correo_hogar(cuenta, url_base, token, fecha, azar)
+        else:
+            crudo = correo_codigo(cuenta, url_base, token, fecha, azar)
+            if tipo == "codigo":
+                vigentes[cuenta] = token
+        buzon.agregar(crudo, fecha.replace(tzinfo=None))
+    return vigentes
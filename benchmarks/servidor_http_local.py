@@ -0,0 +1,138 @@
+"""
+Servidor HTTP local para los benchmarks. Hace de Netflix (página del código y página de confirmación
+de hogar, a partir de benchmarks/fixtures) y de la API de Telegram (registra cada sendMessage por chat
+con su hora de llegada, para medir la latencia de extremo a extremo del webhook).
+"""
+import os
+import json
+import time
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def _leer_fixture(nombre):
+    with open(os.path.join(FIXTURES, nombre), encoding="utf-8") as f:
+        return f.read()
+
+
+def codigo_para(token):
+    """
+    Código de 4 dígitos determinista para un token, así el harness puede verificar la respuesta.
+    """
+    return f"{sum(ord(c) * (i + 1) for i, c in enumerate(token)) % 10000:04d}"
+
+
+class EstadoHTTP:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.condicion = threading.Condition(self.lock)
+        self.bytes_enviados = 0
+        self.peticiones = {"codigo": 0, "hogar": 0, "telegram": 0}
+        self.mensajes = {}  # chat_id -> [(instante, texto)]
+        self.siguiente_id = 1
+
+    def registrar_mensaje(self, chat_id, texto):
+        with self.condicion:
+            self.mensajes.setdefault(str(chat_id), []).append((time.perf_counter(), texto))
+            self.siguiente_id += 1
+            self.condicion.notify_all()
+            return self.siguiente_id
+
+    def esperar_mensaje(self, chat_id, condicion, timeout):
+        """
+        Espera el primer mensaje del chat que cumpla condicion(texto). Retorna (instante, texto) o None.
+        """
+        limite = time.perf_counter() + timeout
+        with self.condicion:
+            while True:
+                for instante, texto in self.mensajes.get(str(chat_id), []):
+                    if condicion(texto):
+                        return instante, texto
+                restante = limite - time.perf_counter()
+                if restante <= 0:
+                    return None
+                self.condicion.wait(restante)
+
+    def como_dict(self):
+        with self.lock:
+            return {"bytes_enviados": self.bytes_enviados, **{f"peticiones_{k}": v for k, v in self.peticiones.items()}}
+
+
+class ManejadorHTTP(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, como Netflix
+    estado = None
+    latencia = 0.0
+    pagina_codigo = _leer_fixture("pagina_codigo.html")
+    pagina_hogar = _leer_fixture("pagina_hogar.html")
+
+    def log_message(self, formato, *args):
+        pass
+
+    def responder(self, estado, cuerpo, tipo="text/html; charset=utf-8"):
+        datos = cuerpo.encode("utf-8")
+        self.send_response(estado)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+        with self.estado.lock:
+            self.estado.bytes_enviados += len(datos)
+
+    def do_GET(self):
+        ruta = urllib.parse.urlsplit(self.path)
+        if self.latencia:
+            time.sleep(self.latencia)
+        if ruta.path.startswith("/codigo/"):
+            token = urllib.parse.parse_qs(ruta.query).get("nftoken", [""])[0]
+            with self.estado.lock:
+                self.estado.peticiones["codigo"] += 1
+            self.responder(200, self.pagina_codigo.replace(">4821<", f">{codigo_para(token)}<"))
+        elif ruta.path.startswith("/hogar/"):
+            with self.estado.lock:
+                self.estado.peticiones["hogar"] += 1
+            self.responder(200, self.pagina_hogar)
+        else:
+            self.responder(404, "no encontrado")
+
+    def do_POST(self):
+        largo = int(self.headers.get("Content-Length") or 0)
+        cuerpo = self.rfile.read(largo).decode("utf-8") if largo else ""
+        ruta = urllib.parse.urlsplit(self.path)
+        partes = ruta.path.strip("/").split("/")
+        if len(partes) == 2 and partes[0].startswith("bot"):
+            self.api_telegram(partes[1], cuerpo, ruta.query)
+        else:
+            self.responder(404, "no encontrado")
+
+    def api_telegram(self, metodo, cuerpo, consulta):
+        # pyTelegramBotAPI manda los parámetros en la query string; otros clientes, en el cuerpo
+        parametros = {k: v[0] for k, v in urllib.parse.parse_qs(consulta).items()}
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            parametros.update(json.loads(cuerpo or "{}"))
+        else:
+            parametros.update({k: v[0] for k, v in urllib.parse.parse_qs(cuerpo).items()})
+        with self.estado.lock:
+            self.estado.peticiones["telegram"] += 1
+        if metodo == "sendMessage":
+            chat_id, texto = parametros.get("chat_id"), parametros.get("text", "")
+            message_id = self.estado.registrar_mensaje(chat_id, texto)
+            resultado = {"message_id": message_id, "date": int(time.time()), "text": texto,
+                         "chat": {"id": int(chat_id) if str(chat_id).lstrip("-").isdigit() else 0, "type": "private"}}
+        else:
+            resultado = True
+        self.responder(200, json.dumps({"ok": True, "result": resultado}), "application/json")
+
+
+def iniciar_servidor_http(latencia=0.0, puerto=0):
+    """
+    Arranca el servidor en un hilo. Retorna (servidor, puerto, estado).
+    """
+    estado = EstadoHTTP()
+    manejador = type("ManejadorHTTPConfigurado", (ManejadorHTTP,), {"estado": estado, "latencia": latencia})
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto), manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="http-local", daemon=True).start()
+    return servidor, servidor.server_address[1], estado
@@ -0,0 +1,459 @@
+"""
+Servidor IMAP4rev1 mínimo en memoria para los benchmarks (sin TLS). Implementa solo lo que usa el bot:
+CAPABILITY, LOGIN, SELECT/EXAMINE, STATUS, NOOP, IDLE, LOGOUT, UID SEARCH y UID FETCH
+(cabeceras, BODYSTRUCTURE, secciones, parciales y RFC822), con literales en ambos sentidos.
+Cuenta los bytes enviados y recibidos para comparar cuánto tráfico genera cada versión de funciones.py.
+"""
+import os
+import sys
+import time
+import email
+import select
+import datetime
+import threading
+import socketserver
+from email import policy
+from email.header import decode_header
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from protocolo_imap import _Lector  # noqa: E402
+
+_MESES = {m: i + 1 for i, m in enumerate(("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"))}
+
+
+class Mensaje:
+    def __init__(self, uid, crudo, fecha):
+        self.uid = uid
+        self.crudo = crudo
+        self.fecha = fecha
+        self.flags = set()
+        self.modseq = 0
+        self.mensaje = email.message_from_bytes(crudo, policy=policy.compat32)
+        fin = crudo.find(b"\r\n\r\n")
+        self.cabecera = crudo[:fin + 4] if fin >= 0 else crudo
+        self.texto = crudo[fin + 4:] if fin >= 0 else b""
+        self.asunto = "".join(
+            parte.decode(cod or "utf-8", errors="ignore") if isinstance(parte, bytes) else parte
+            for parte, cod in decode_header(self.mensaje.get("Subject", ""))
+        )
+
+
+class Buzon:
+    """
+    Buzón en memoria compartido por todas las conexiones. agregar() despierta a las conexiones en IDLE.
+    """
+
+    def __init__(self, uidvalidity=1):
+        self.uidvalidity = uidvalidity
+        self.mensajes = []
+        self.uidnext = 1
+        self.modseq = 1
+        self.condicion = threading.Condition()
+
+    def agregar(self, crudo, fecha=None):
+        with self.condicion:
+            mensaje = Mensaje(self.uidnext, crudo, fecha or datetime.datetime.now())
+            self.uidnext += 1
+            self.modseq += 1
+            mensaje.modseq = self.modseq
+            self.mensajes.append(mensaje)
+            self.condicion.notify_all()
+            return mensaje.uid
+
+
+class Estadisticas:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bytes_enviados = 0
+        self.bytes_recibidos = 0
+        self.comandos = 0
+        self.conexiones = 0
+
+    def como_dict(self):
+        with self.lock:
+            return {"bytes_enviados": self.bytes_enviados, "bytes_recibidos": self.bytes_recibidos,
+                    "comandos": self.comandos, "conexiones": self.conexiones}
+
+
+def _parsear_conjunto(texto, maximo):
+    """
+    Convierte un conjunto de secuencia IMAP ("1:5,8,10:*") en una función de pertenencia.
+    """
+    rangos = []
+    for parte in texto.split(","):
+        if ":" in parte:
+            a, b = parte.split(":", 1)
+            a = maximo if a == "*" else int(a)
+            b = maximo if b == "*" else int(b)
+            rangos.append((min(a, b), max(a, b)))
+        else:
+            n = maximo if parte == "*" else int(parte)
+            rangos.append((n, n))
+    return lambda n: any(a <= n <= b for a, b in rangos)
+
+
+def _cadena(valor):
+    if isinstance(valor, bytes):
+        return valor.decode("utf-8", errors="ignore")
+    return valor or ""
+
+
+def _fecha(valor):
+    dia, mes, anio = _cadena(valor).split("-")
+    return datetime.date(int(anio), _MESES[mes.lower()], int(dia))
+
+
+def _cita(valor):
+    if valor is None:
+        return "NIL"
+    return '"' + str(valor).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _parametros(parte):
+    params = parte.get_params()[1:] if parte.get_params() else []
+    if not params:
+        return "NIL"
+    return "(" + " ".join(f"{_cita(k.upper())} {_cita(v)}" for k, v in params) + ")"
+
+
+def _payload_crudo(parte):
+    # _payload y no get_payload(): este último decodifica las partes 8bit con su charset y ya no son los bytes del servidor
+    carga = parte._payload
+    if isinstance(carga, str):
+        return carga.encode("ascii", errors="surrogateescape")
+    return b""
+
+
+def bodystructure(parte):
+    if parte.is_multipart():
+        hijos = "".join(bodystructure(hijo) for hijo in parte.get_payload())
+        frontera = parte.get_boundary()
+        return f'({hijos} {_cita(parte.get_content_subtype().upper())} ("BOUNDARY" {_cita(frontera)}) NIL NIL NIL)'
+    tipo, subtipo = parte.get_content_maintype().upper(), parte.get_content_subtype().upper()
+    codificacion = (parte.get("Content-Transfer-Encoding") or "7BIT").upper()
+    cuerpo = _payload_crudo(parte)
+    disposicion = "NIL"
+    if parte.get("Content-Disposition"):
+        nombre = parte.get_filename()
+        tipo_disp = parte.get_content_disposition().upper()
+        disposicion = f'({_cita(tipo_disp)} {"(" + _cita("FILENAME") + " " + _cita(nombre) + ")" if nombre else "NIL"})'
+    base = f"{_cita(tipo)} {_cita(subtipo)} {_parametros(parte)} NIL NIL {_cita(codificacion)} {len(cuerpo)}"
+    if tipo == "TEXT":
+        lineas = cuerpo.count(b"\n")
+        return f"({base} {lineas} NIL {disposicion} NIL NIL)"
+    return f"({base} NIL {disposicion} NIL NIL)"
+
+
+def _parte_por_seccion(mensaje, seccion):
+    parte = mensaje
+    for numero in seccion.split("."):
+        if parte.is_multipart():
+            parte = parte.get_payload()[int(numero) - 1]
+        elif numero != "1":
+            raise ValueError(f"Sección inválida {seccion}")
+    return parte
+
+
+def _cabeceras_filtradas(cabecera, nombres, excluir=False):
+    lineas = cabecera.split(b"\r\n")
+    salida, incluir = [], False
+    for linea in lineas:
+        if not linea:
+            continue
+        if linea[:1] in (b" ", b"\t"):
+            if incluir:
+                salida.append(linea)
+            continue
+        nombre = linea.split(b":", 1)[0].decode("ascii", errors="ignore").upper()
+        incluir = (nombre in nombres) != excluir
+        if incluir:
+            salida.append(linea)
+    return b"\r\n".join(salida) + b"\r\n\r\n"
+
+
+class ManejadorIMAP(socketserver.StreamRequestHandler):
+    buzon = None
+    estadisticas = None
+    latencia = 0.0  # segundos añadidos a cada respuesta (simula la distancia a Gmail)
+    capacidades = "IMAP4rev1 IDLE UIDPLUS CONDSTORE"
+
+    def enviar(self, datos):
+        if isinstance(datos, str):
+            datos = datos.encode("utf-8")
+        self.wfile.write(datos)
+        with self.estadisticas.lock:
+            self.estadisticas.bytes_enviados += len(datos)
+
+    def leer_linea(self):
+        linea = self.rfile.readline()
+        with self.estadisticas.lock:
+            self.estadisticas.bytes_recibidos += len(linea)
+        return linea
+
+    def leer_comando(self):
+        """
+        Lee un comando completo, resolviendo literales {n}. Retorna (flujo, literales) para protocolo_imap._Lector.
+        """
+        partes, literales = [], []
+        while True:
+            linea = self.leer_linea()
+            if not linea:
+                return None, None
+            linea = linea.rstrip(b"\r\n")
+            if linea.endswith(b"}") and b"{" in linea:
+                inicio = linea.rindex(b"{")
+                n = int(linea[inicio + 1:-1].rstrip(b"+"))
+                partes.append(linea[:inicio] + b" \x00" + str(len(literales)).encode() + b"\x00")
+                if not linea[inicio + 1:-1].endswith(b"+"):
+                    self.enviar(b"+ Listo\r\n")
+                    self.wfile.flush()
+                literales.append(self.rfile.read(n))
+                with self.estadisticas.lock:
+                    self.estadisticas.bytes_recibidos += n
+                continue
+            partes.append(linea)
+            return b"".join(partes), literales
+
+    def handle(self):
+        with self.estadisticas.lock:
+            self.estadisticas.conexiones += 1
+        self.seleccionado = False
+        self.enviar(f"* OK [CAPABILITY {self.capacidades}] Servidor IMAP local de benchmarks\r\n")
+        while True:
+            flujo, literales = self.leer_comando()
+            if flujo is None:
+                return
+            lector = _Lector(flujo, literales)
+            try:
+                tag = lector.siguiente()
+                comando = str(lector.siguiente()).upper()
+                argumentos = []
+                while not lector.fin():
+                    argumentos.append(lector.siguiente())
+            except Exception:
+                self.enviar(b"* BAD Comando ilegible\r\n")
+                continue
+            with self.estadisticas.lock:
+                self.estadisticas.comandos += 1
+            if self.latencia:
+                time.sleep(self.latencia)
+            try:
+                if not self.ejecutar(tag, comando, argumentos):
+                    return
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            except Exception as e:
+                self.enviar(f"{tag} BAD {type(e).__name__}: {e}\r\n")
+
+    def ejecutar(self, tag, comando, argumentos):
+        if comando == "CAPABILITY":
+            self.enviar(f"* CAPABILITY {self.capacidades}\r\n{tag} OK CAPABILITY completado\r\n")
+        elif comando == "LOGIN":
+            self.enviar(f"{tag} OK LOGIN completado\r\n")
+        elif comando in ("SELECT", "EXAMINE"):
+            self.seleccionado = True
+            with self.buzon.condicion:
+                existentes, uidnext, modseq = len(self.buzon.mensajes), self.buzon.uidnext, self.buzon.modseq
+            self.existentes = existentes
+            respuesta = (f"* FLAGS (\\Seen \\Answered \\Flagged \\Deleted \\Draft)\r\n* {existentes} EXISTS\r\n* 0 RECENT\r\n"
+                         f"* OK [UIDVALIDITY {self.buzon.uidvalidity}] UIDs válidos\r\n* OK [UIDNEXT {uidnext}] Próximo UID\r\n")
+            if "CONDSTORE" in self.capacidades:
+                respuesta += f"* OK [HIGHESTMODSEQ {modseq}] Modseq\r\n"
+            self.enviar(respuesta + f"{tag} OK [READ-WRITE] {comando} completado\r\n")
+        elif comando == "STATUS":
+            items = [str(i).upper() for i in argumentos[1]]
+            with self.buzon.condicion:
+                valores = {"MESSAGES": len(self.buzon.mensajes), "UIDNEXT": self.buzon.uidnext,
+                           "UIDVALIDITY": self.buzon.uidvalidity, "UNSEEN": 0, "RECENT": 0, "HIGHESTMODSEQ": self.buzon.modseq}
+            texto = " ".join(f"{i} {valores[i]}" for i in items if i in valores)
+            self.enviar(f"* STATUS {_cita(_cadena(argumentos[0]))} ({texto})\r\n{tag} OK STATUS completado\r\n")
+        elif comando == "NOOP":
+            self.avisar_nuevos()
+            self.enviar(f"{tag} OK NOOP completado\r\n")
+        elif comando == "IDLE":
+            self.idle(tag)
+        elif comando == "LOGOUT":
+            self.enviar(f"* BYE Hasta luego\r\n{tag} OK LOGOUT completado\r\n")
+            return False
+        elif comando == "UID":
+            sub = str(argumentos[0]).upper()
+            if sub == "SEARCH":
+                uids = self.buscar(argumentos[1:])
+                self.enviar(f"* SEARCH {' '.join(str(u) for u in uids)}\r\n".replace("SEARCH \r\n", "SEARCH\r\n"))
+                self.enviar(f"{tag} OK UID SEARCH completado\r\n")
+            elif sub == "FETCH":
+                self.fetch(argumentos[1], argumentos[2], argumentos[3] if len(argumentos) > 3 else None)
+                self.enviar(f"{tag} OK UID FETCH completado\r\n")
+            else:
+                self.enviar(f"{tag} BAD UID {sub} no soportado\r\n")
+        else:
+            self.enviar(f"{tag} BAD {comando} no soportado\r\n")
+        return True
+
+    def avisar_nuevos(self):
+        with self.buzon.condicion:
+            total = len(self.buzon.mensajes)
+        if self.seleccionado and total != getattr(self, "existentes", total):
+            self.existentes = total
+            self.enviar(f"* {total} EXISTS\r\n")
+
+    def idle(self, tag):
+        self.enviar(b"+ idling\r\n")
+        self.wfile.flush()
+        while True:
+            listos, _, _ = select.select([self.connection], [], [], 0.2)
+            if listos:
+                linea = self.leer_linea()
+                if not linea or linea.strip().upper() == b"DONE":
+                    break
+            self.avisar_nuevos()
+        self.enviar(f"{tag} OK IDLE terminado\r\n")
+
+    # --- SEARCH ---
+
+    def buscar(self, criterios):
+        with self.buzon.condicion:
+            mensajes = list(self.buzon.mensajes)
+        maximo = mensajes[-1].uid if mensajes else 0
+        criterios = list(criterios)
+        if criterios and str(criterios[0]).upper() == "CHARSET":
+            criterios = criterios[2:]
+        predicados = []
+        while criterios:
+            predicados.append(self._criterio(criterios, maximo))
+        return [m.uid for m in mensajes if all(p(m) for p in predicados)]
+
+    def _criterio(self, criterios, maximo):
+        clave = str(criterios.pop(0)).upper() if not isinstance(criterios[0], list) else None
+        if clave is None:
+            sub = criterios.pop(0)
+            predicados = []
+            while sub:
+                predicados.append(self._criterio(sub, maximo))
+            return lambda m: all(p(m) for p in predicados)
+        if clave == "ALL":
+            return lambda m: True
+        if clave == "OR":
+            a, b = self._criterio(criterios, maximo), self._criterio(criterios, maximo)
+            return lambda m: a(m) or b(m)
+        if clave == "NOT":
+            a = self._criterio(criterios, maximo)
+            return lambda m: not a(m)
+        if clave == "SINCE":
+            desde = _fecha(criterios.pop(0))
+            return lambda m: m.fecha.date() >= desde
+        if clave == "SUBJECT":
+            texto = _cadena(criterios.pop(0)).lower()
+            return lambda m: texto in m.asunto.lower()
+        if clave in ("TO", "FROM", "CC"):
+            texto = _cadena(criterios.pop(0)).lower()
+            return lambda m: texto in str(m.mensaje.get(clave, "")).lower()
+        if clave == "HEADER":
+            nombre, texto = _cadena(criterios.pop(0)), _cadena(criterios.pop(0)).lower()
+            return lambda m: texto in " ".join(str(v) for v in m.mensaje.get_all(nombre, [])).lower()
+        if clave == "UID":
+            pertenece = _parsear_conjunto(str(criterios.pop(0)), maximo)
+            return lambda m: pertenece(m.uid)
+        if clave == "SEEN":
+            return lambda m: "\\Seen" in m.flags
+        if clave == "UNSEEN":
+            return lambda m: "\\Seen" not in m.flags
+        if clave == "MODSEQ":
+            criterios.pop(0)
+            return lambda m: True
+        raise ValueError(f"Criterio {clave} no soportado")
+
+    # --- FETCH ---
+
+    def fetch(self, conjunto, items, modificadores=None):
+        with self.buzon.condicion:
+            mensajes = list(self.buzon.mensajes)
+        maximo = mensajes[-1].uid if mensajes else 0
+        pertenece = _parsear_conjunto(str(conjunto), maximo)
+        if not isinstance(items, list):
+            items = [items]
+        nombres = [str(i) for i in items]
+        cambiados_desde = None
+        if modificadores and str(modificadores[0]).upper() == "CHANGEDSINCE":
+            if "CONDSTORE" not in self.capacidades:
+                raise ValueError("CHANGEDSINCE requiere CONDSTORE")
+            cambiados_desde = int(modificadores[1])
+            if "MODSEQ" not in (n.upper() for n in nombres):
+                nombres.append("MODSEQ")
+        # Los átomos con corchetes llegan completos (BODY.PEEK[HEADER.FIELDS (A B)]) gracias a _Lector
+        for secuencia, mensaje in enumerate(mensajes, start=1):
+            if not pertenece(mensaje.uid) or (cambiados_desde is not None and mensaje.modseq <= cambiados_desde):
+                continue
+            partes = [f"UID {mensaje.uid}".encode()]
+            for nombre in nombres:
+                partes.append(self._item(mensaje, nombre))
+            self.enviar(f"* {secuencia} FETCH (".encode() + b" ".join(p for p in partes if p) + b")\r\n")
+
+    def _literal(self, nombre, datos):
+        return nombre.encode() + b" {" + str(len(datos)).encode() + b"}\r\n" + datos
+
+    def _item(self, mensaje, nombre):
+        clave = nombre.upper()
+        if clave == "UID":
+            return b""
+        if clave == "MODSEQ":
+            return f"MODSEQ ({mensaje.modseq})".encode()
+        if clave == "FLAGS":
+            return f"FLAGS ({' '.join(sorted(mensaje.flags))})".encode()
+        if clave == "INTERNALDATE":
+            return f'INTERNALDATE "{mensaje.fecha.strftime("%d-%b-%Y %H:%M:%S +0000")}"'.encode()
+        if clave == "RFC822.SIZE":
+            return f"RFC822.SIZE {len(mensaje.crudo)}".encode()
+        if clave in ("BODYSTRUCTURE", "BODY"):
+            return f"{clave} {bodystructure(mensaje.mensaje)}".encode()
+        if clave == "RFC822":
+            mensaje.flags.add("\\Seen")
+            return self._literal("RFC822", mensaje.crudo)
+        if clave == "RFC822.HEADER":
+            return self._literal("RFC822.HEADER", mensaje.cabecera)
+        if clave.startswith("BODY"):
+            peek = clave.startswith("BODY.PEEK")
+            seccion = clave[clave.index("[") + 1:clave.rindex("]")]
+            parcial = clave[clave.rindex("]") + 1:]
+            seccion_original = nombre[nombre.index("[") + 1:nombre.rindex("]")]
+            if seccion == "":
+                datos = mensaje.crudo
+            elif seccion == "HEADER":
+                datos = mensaje.cabecera
+            elif seccion == "TEXT":
+                datos = mensaje.texto
+            elif seccion.startswith("HEADER.FIELDS"):
+                excluir = seccion.startswith("HEADER.FIELDS.NOT")
+                campos = set(seccion[seccion.index("(") + 1:seccion.index(")")].split())
+                datos = _cabeceras_filtradas(mensaje.cabecera, campos, excluir)
+            else:
+                datos = _payload_crudo(_parte_por_seccion(mensaje.mensaje, seccion))
+            etiqueta = f"BODY[{seccion_original}]"
+            if parcial:
+                inicio, largo = (int(x) for x in parcial.strip("<>").split("."))
+                datos = datos[inicio:inicio + largo]
+                etiqueta += f"<{inicio}>"
+            if not peek:
+                mensaje.flags.add("\\Seen")
+            return self._literal(etiqueta, datos)
+        raise ValueError(f"Ítem de FETCH {nombre} no soportado")
+
+
+class ServidorIMAPLocal(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def iniciar_servidor_imap(buzon, latencia=0.0, capacidades=None, puerto=0):
+    """
+    Arranca el servidor en un hilo. Retorna (servidor, puerto, estadisticas).
+    """
+    estadisticas = Estadisticas()
+    atributos = {"buzon": buzon, "estadisticas": estadisticas, "latencia": latencia}
+    if capacidades:
+        atributos["capacidades"] = capacidades
+    manejador = type("ManejadorIMAPConfigurado", (ManejadorIMAP,), atributos)
+    servidor = ServidorIMAPLocal(("127.0.0.1", puerto), manejador)
+    threading.Thread(target=servidor.serve_forever, name="imap-local", daemon=True).start()
+    return servidor, servidor.server_address[1], estadisticas
@@ -0,0 +1,105 @@
+import os
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from registro_cuentas import registro_cuentas
+
+# Búsqueda en varios buzones IMAP a la vez. Cada correo autorizado puede declarar su propio buzón en
+# cuentas.json ("correo|user_imap|pass_imap"); si no, se revisan los buzones de su dueño y el buzón
+# por defecto (E-MAIL_USER / EMAIL_PASS) en paralelo, y gana el primero que encuentra el correo.
+
+MULTIBUZON_HILOS = int(os.getenv("MULTIBUZON_HILOS", "8"))
+MULTIBUZON_MAX_POR_BUZON = int(os.getenv("MULTIBUZON_MAX_POR_BUZON", "2"))  # búsquedas simultáneas por buzón
+
+_ejecutor = None
+_lock_ejecutor = threading.Lock()
+_semaforos = {}
+_lock_semaforos = threading.Lock()
+
+
+def _obtener_ejecutor():
+    # Se crea con la primera búsqueda en paralelo (y no al importar), así sobrevive a un fork del servidor
+    global _ejecutor
+    with _lock_ejecutor:
+        if _ejecutor is None:
+            _ejecutor = ThreadPoolExecutor(max_workers=MULTIBUZON_HILOS, thread_name_prefix="buzon")
+        return _ejecutor
+
+
+def _semaforo_de(usuario_imap):
+    with _lock_semaforos:
+        clave = usuario_imap.lower()
+        if clave not in _semaforos:
+            _semaforos[clave] = threading.BoundedSemaphore(MULTIBUZON_MAX_POR_BUZON)
+        return _semaforos[clave]
+
+
+def buzones_para(correo_usuario, buzon_por_defecto=None):
+    """
+    Retorna la lista de buzones (user_imap, pass_imap) donde puede estar el correo de Netflix del usuario:
+    el declarado para ese correo en cuentas.json o, si no tiene, los buzones declarados por su(s) dueño(s)
+    más el buzón por defecto.
+    """
+    propio = registro_cuentas.credenciales_imap(correo_usuario)
+    if propio:
+        return [propio]
+
+    buzones = []
+    for dueno in sorted(registro_cuentas.duenos_de(correo_usuario)):
+        for otro_correo in registro_cuentas.correos_de(dueno):
+            credenciales = registro_cuentas.credenciales_imap(otro_correo)
+            if credenciales and credenciales not in buzones:
+                buzones.append(credenciales)
+    if buzon_por_defecto and all(buzon_por_defecto) and buzon_por_defecto not in buzones:
+        buzones.append(buzon_por_defecto)
+    return buzones
+
+
+def _en_buzon(buzon, funcion):
+    with _semaforo_de(buzon[0]):
+        return funcion(*buzon)
+
+
+def enviar_a_buzon(buzon, funcion):
+    """
+    Ejecuta funcion(user_imap, pass_imap) en el ejecutor compartido (respetando MULTIBUZON_MAX_POR_BUZON)
+    con el contexto del llamador. Retorna el Future.
+    """
+    return _obtener_ejecutor().submit(contextvars.copy_context().run, _en_buzon, buzon, funcion)
+
+
+def primer_resultado(buzones, funcion, es_exito):
+    """
+    Ejecuta funcion(user_imap, pass_imap) en cada buzón en paralelo. Retorna (exito, resultados):
+    exito es el primer resultado para el que es_exito(resultado) es verdadero (o None), y resultados los
+    demás resultados obtenidos en el orden de los buzones (None si ese buzón falló o no llegó a terminar).
+    Un buzón que falla (excepción) no afecta a los demás.
+    """
+    if len(buzones) == 1:
+        # Un solo buzón: sin saltos de hilo
+        try:
+            resultado = _en_buzon(buzones[0], funcion)
+        except Exception:
+            logging.exception(f"MULTIBUZON: Error buscando en el buzón {buzones[0][0]}")
+            return None, [None]
+        return (resultado, []) if es_exito(resultado) else (None, [resultado])
+
+    # Cada hilo corre en una copia del contexto del llamador, para que las métricas conserven canal y acción
+    futuros = {enviar_a_buzon(buzon, funcion): i for i, buzon in enumerate(buzones)}
+    resultados = [None] * len(buzones)
+    for futuro in as_completed(futuros):
+        i = futuros[futuro]
+        try:
+            resultado = futuro.result()
+        except Exception:
+            logging.exception(f"MULTIBUZON: Error buscando en el buzón {buzones[i][0]}")
+            continue
+        if es_exito(resultado):
+            for pendiente in futuros:
+                pendiente.cancel()  # los que aún no empezaron ya no hacen falta
+            logging.info(f"MULTIBUZON: Resultado encontrado en el buzón {buzones[i][0]} ({len(buzones)} revisados en paralelo).")
+            return resultado, resultados
+        resultados[i] = resultado
+    return None, resultados
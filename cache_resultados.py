@@ -0,0 +1,130 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from reglas import MENSAJE_SIN_CORREO
+
+# Caché de resultados de /code y /hogar por (correo, acción) con TTL corto y "single-flight":
+# si llegan varias consultas iguales a la vez, solo una hace la búsqueda y las demás esperan su resultado.
+
+CACHE_TTL = float(os.getenv("CACHE_TTL", "20"))  # segundos que se reutiliza un código/enlace encontrado
+CACHE_TTL_NEGATIVO = float(os.getenv("CACHE_TTL_NEGATIVO", "5"))  # segundos que se reutiliza un "no hay solicitud pendiente"
+CACHE_MAX_ENTRADAS = int(os.getenv("CACHE_MAX_ENTRADAS", "1000"))
+
+
+class _Vuelo:
+    """
+    Resolución en curso de una clave; los que llegan después esperan en el evento.
+    """
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        self.excepcion = None
+
+
+class CacheResultados:
+    """
+    Caché LRU thread-safe con vencimiento por entrada y coalescencia de consultas concurrentes.
+    """
+
+    def __init__(self, max_entradas=CACHE_MAX_ENTRADAS):
+        self.max_entradas = max_entradas
+        self._entradas = OrderedDict()  # clave -> (resultado, vence_en)
+        self._en_curso = {}  # clave -> _Vuelo
+        self._lock = threading.Lock()
+
+    def _vigente(self, clave):
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            return None
+        if time.monotonic() >= entrada[1]:
+            del self._entradas[clave]
+            return None
+        self._entradas.move_to_end(clave)
+        return entrada
+
+    def obtener(self, clave):
+        """
+        Resultado guardado y vigente de la clave, o None (no espera a una resolución en curso).
+        """
+        with self._lock:
+            entrada = self._vigente(clave)
+            return entrada[0] if entrada is not None else None
+
+    def obtener_o_calcular(self, clave, calcular, ttl_para):
+        """
+        Retorna (resultado, calculado_aqui). Si la clave está en caché o ya se está resolviendo en otro hilo,
+        reutiliza ese resultado (calculado_aqui=False). Si no, ejecuta calcular() y guarda el resultado por
+        ttl_para(resultado) segundos (0 = no guardar).
+        """
+        with self._lock:
+            entrada = self._vigente(clave)
+            if entrada is not None:
+                logging.info(f"CACHE: Resultado reutilizado para {clave}.")
+                return entrada[0], False
+            vuelo = self._en_curso.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = _Vuelo()
+                self._en_curso[clave] = vuelo
+
+        if not lider:
+            logging.info(f"CACHE: Esperando la consulta en curso para {clave}.")
+            vuelo.evento.wait()
+            if vuelo.excepcion is not None:
+                raise vuelo.excepcion
+            return vuelo.resultado, False
+
+        try:
+            vuelo.resultado = calcular()
+        except BaseException as e:
+            vuelo.excepcion = e
+            raise
+        finally:
+            with self._lock:
+                del self._en_curso[clave]
+                if vuelo.excepcion is None:
+                    ttl = ttl_para(vuelo.resultado)
+                    if ttl > 0:
+                        self._entradas[clave] = (vuelo.resultado, time.monotonic() + ttl)
+                        self._entradas.move_to_end(clave)
+                        while len(self._entradas) > self.max_entradas:
+                            self._entradas.popitem(last=False)
+            vuelo.evento.set()
+        return vuelo.resultado, True
+
+    def guardar(self, clave, resultado, ttl_para):
+        """
+        Guarda un resultado calculado por fuera de obtener_o_calcular (ej. una consulta en lote).
+        """
+        ttl = ttl_para(resultado)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entradas[clave] = (resultado, time.monotonic() + ttl)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def invalidar(self, clave):
+        with self._lock:
+            self._entradas.pop(clave, None)
+
+
+def ttl_por_estado(resultado):
+    """
+    TTL para los resultados (estado, valor) de funciones.resolver_accion: los aciertos se guardan CACHE_TTL,
+    "no hay solicitud pendiente" (o no hay ningún correo reciente) CACHE_TTL_NEGATIVO, y los errores de
+    conexión o del servidor no se guardan.
+    """
+    estado, valor = resultado
+    if estado == "ok":
+        return CACHE_TTL
+    if estado == "sin_solicitud" or (estado == "error" and valor == MENSAJE_SIN_CORREO):
+        return CACHE_TTL_NEGATIVO
+    return 0
+
+
+cache_resultados = CacheResultados()
@@ -0,0 +1,69 @@
+import os
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Cliente HTTP compartido para visitar las páginas de Netflix (código y confirmación de hogar).
+# Un solo pool de conexiones keep-alive por host, reutilizado por la web y el bot, con timeouts de
+# conexión y lectura separados y reintentos acotados ante errores 5xx o de conexión.
+
+HTTP_POOL_HOSTS = int(os.getenv("HTTP_POOL_HOSTS", "10"))  # hosts distintos con pool propio
+HTTP_POOL_CONEXIONES = int(os.getenv("HTTP_POOL_CONEXIONES", "20"))  # conexiones keep-alive por host
+HTTP_TIMEOUT_CONEXION = float(os.getenv("HTTP_TIMEOUT_CONEXION", "5"))
+HTTP_TIMEOUT_LECTURA = float(os.getenv("HTTP_TIMEOUT_LECTURA", "20"))
+HTTP_REINTENTOS = int(os.getenv("HTTP_REINTENTOS", "2"))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.5"))  # espera 0.5s, 1s, 2s... entre reintentos
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/100.0.4896.127 Safari/537.36'
+
+
+def _crear_adaptador():
+    reintentos = Retry(
+        total=HTTP_REINTENTOS,
+        connect=HTTP_REINTENTOS,
+        read=0,  # no repetimos una lectura cortada: la página de Netflix puede haber consumido el token
+        status=HTTP_REINTENTOS,
+        backoff_factor=HTTP_BACKOFF,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        raise_on_status=False,  # tras agotar reintentos, raise_for_status() da el error habitual
+    )
+    return HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_CONEXIONES, max_retries=reintentos, pool_block=False)
+
+
+# El adaptador (pool de urllib3) es thread-safe y es lo que guarda las conexiones keep-alive.
+# Cada petición usa su propia Session montada sobre este adaptador, para que las cookies que
+# Netflix pone durante las redirecciones de un cliente no se mezclen con las de otro.
+_adaptador = _crear_adaptador()
+
+
+def _nueva_sesion():
+    sesion = requests.Session()
+    sesion.mount("https://", _adaptador)
+    sesion.mount("http://", _adaptador)
+    sesion.headers["User-Agent"] = USER_AGENT
+    return sesion
+
+
+def obtener_pagina(url, headers=None, timeout=None):
+    """
+    GET siguiendo redirecciones sobre el pool compartido. Retorna el requests.Response
+    (lanza requests.exceptions.RequestException en errores de red, igual que requests.get).
+    """
+    sesion = _nueva_sesion()
+    # No llamamos a sesion.close(): cerraría el adaptador compartido con todas sus conexiones
+    return sesion.get(
+        url,
+        headers=headers,
+        allow_redirects=True,
+        timeout=timeout or (HTTP_TIMEOUT_CONEXION, HTTP_TIMEOUT_LECTURA),
+    )
+
+
+def cerrar():
+    """
+    Cierra las conexiones keep-alive del pool (al apagar el proceso).
+    """
+    _adaptador.close()
+    logging.info("HTTP: Conexiones del cliente compartido cerradas.")
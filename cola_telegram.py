@@ -0,0 +1,224 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+import requests
+from telebot import apihelper
+from metricas import TELEGRAM_ENTREGA_SEGUNDOS, TELEGRAM_ENVIOS
+
+# Cola de salida de mensajes de Telegram: las respuestas a los usuarios y los avisos al administrador se
+# encolan y los envían hilos en segundo plano, así una API de Telegram lenta o limitada no alarga la consulta.
+# Respeta los límites de Telegram (un mensaje por segundo por chat, ~30 por segundo en total), reintenta con
+# espera creciente ante 429/5xx o errores de red (con 429 espera lo que indica retry_after) y junta en un solo
+# mensaje los avisos al administrador que llegan seguidos.
+
+TELEGRAM_HILOS_ENVIO = int(os.getenv("TELEGRAM_HILOS_ENVIO", "2"))
+TELEGRAM_MAX_POR_SEGUNDO = float(os.getenv("TELEGRAM_MAX_POR_SEGUNDO", "25"))  # todos los chats juntos
+TELEGRAM_INTERVALO_CHAT = float(os.getenv("TELEGRAM_INTERVALO_CHAT", "1"))  # segundos entre mensajes al mismo chat
+TELEGRAM_REINTENTOS = int(os.getenv("TELEGRAM_REINTENTOS", "5"))
+TELEGRAM_BACKOFF = float(os.getenv("TELEGRAM_BACKOFF", "1"))  # espera 1s, 2s, 4s... entre reintentos
+TELEGRAM_VENTANA_ALERTAS = float(os.getenv("TELEGRAM_VENTANA_ALERTAS", "3"))  # segundos juntando avisos al admin
+TELEGRAM_MAX_CARACTERES = 4096  # límite de Telegram por mensaje
+SEPARADOR_ALERTAS = "\n\n────────\n\n"
+
+
+class _Mensaje:
+    def __init__(self, chat_id, texto, tipo, opciones, responder_a=None, no_antes_de=0.0):
+        self.chat_id = chat_id
+        self.texto = texto
+        self.tipo = tipo  # "respuesta" o "alerta": etiqueta de las métricas
+        self.opciones = opciones  # parse_mode, etc. (se pasan tal cual a send_message / reply_to)
+        self.responder_a = responder_a  # mensaje de telebot al que se responde (reply_to)
+        self.no_antes_de = no_antes_de
+        self.encolado = time.monotonic()
+        self.intentos = 0
+
+
+def _espera_reintento(error, intentos):
+    """
+    Segundos a esperar antes de reintentar el envío, o None si el error no se arregla reintentando
+    (ej. 400 por Markdown inválido o 403 porque el usuario bloqueó al bot).
+    """
+    if isinstance(error, apihelper.ApiTelegramException):
+        if error.error_code == 429:
+            return float((error.result_json.get("parameters") or {}).get("retry_after", TELEGRAM_BACKOFF))
+        codigo = error.error_code
+    elif isinstance(error, apihelper.ApiHTTPException):
+        codigo = getattr(error.result, "status_code", 0)
+    elif isinstance(error, requests.exceptions.RequestException):
+        codigo = 500
+    else:
+        return None
+    if codigo == 429 or codigo >= 500:
+        return TELEGRAM_BACKOFF * (2 ** (intentos - 1))
+    return None
+
+
+class ColaTelegram:
+    """
+    Cola de mensajes salientes por chat. Cada chat se atiende en orden y con un solo envío a la vez;
+    los hilos de envío se crean con el primer mensaje, así la cola sobrevive a un fork del servidor.
+    """
+
+    def __init__(self, hilos=TELEGRAM_HILOS_ENVIO, max_por_segundo=TELEGRAM_MAX_POR_SEGUNDO, intervalo_chat=TELEGRAM_INTERVALO_CHAT,
+                 reintentos=TELEGRAM_REINTENTOS, ventana_alertas=TELEGRAM_VENTANA_ALERTAS):
+        self.hilos = hilos
+        self.intervalo_global = 1 / max_por_segundo if max_por_segundo > 0 else 0
+        self.intervalo_chat = intervalo_chat
+        self.reintentos = reintentos
+        self.ventana_alertas = ventana_alertas
+        self.bot = None
+        self.admin_id = None
+        self._condicion = threading.Condition()
+        self._por_chat = OrderedDict()  # chat_id -> deque de _Mensaje
+        self._proximo_chat = {}  # chat_id -> momento (monotonic) desde el que se le puede volver a enviar
+        self._proximo_global = 0.0
+        self._enviando = set()  # chats con un envío en curso
+        self._alerta_abierta = None  # aviso al admin que todavía acepta más texto
+        self._trabajadores = []
+        self._detenido = False
+
+    def configurar(self, bot, admin_id=None):
+        self.bot = bot
+        self.admin_id = admin_id
+
+    def _arrancar_trabajadores(self):
+        self._trabajadores = [t for t in self._trabajadores if t.is_alive()]
+        while len(self._trabajadores) < self.hilos:
+            hilo = threading.Thread(target=self._bucle, name=f"telegram-envio-{len(self._trabajadores) + 1}", daemon=True)
+            hilo.start()
+            self._trabajadores.append(hilo)
+
+    def _encolar(self, mensaje):
+        """
+        Con el lock tomado. Retorna False si el mensaje se descartó.
+        """
+        if self.bot is None or self._detenido:
+            logging.warning(f"TELEGRAM: Bot no configurado o cola detenida. Se descarta el mensaje para {mensaje.chat_id}.")
+            return False
+        self._arrancar_trabajadores()
+        self._por_chat.setdefault(mensaje.chat_id, deque()).append(mensaje)
+        self._condicion.notify_all()
+        return True
+
+    def enviar(self, chat_id, texto, **opciones):
+        """
+        Encola un mensaje para chat_id. Las opciones (ej. parse_mode) se pasan a bot.send_message.
+        """
+        with self._condicion:
+            self._encolar(_Mensaje(chat_id, texto, "respuesta", opciones))
+
+    def responder(self, message, texto, **opciones):
+        """
+        Encola una respuesta al mensaje de telebot recibido (equivalente a bot.reply_to).
+        """
+        with self._condicion:
+            self._encolar(_Mensaje(message.chat.id, texto, "respuesta", opciones, responder_a=message))
+
+    def alerta_admin(self, texto, **opciones):
+        """
+        Encola un aviso para ADMIN_TELEGRAM_ID. Los avisos que llegan dentro de la ventana se envían juntos.
+        """
+        if not self.admin_id:
+            return
+        with self._condicion:
+            # _siguiente() cierra el aviso abierto al sacarlo de la cola para enviarlo
+            abierta = self._alerta_abierta
+            if (abierta is not None and abierta.opciones == opciones
+                    and len(abierta.texto) + len(SEPARADOR_ALERTAS) + len(texto) <= TELEGRAM_MAX_CARACTERES):
+                abierta.texto += SEPARADOR_ALERTAS + texto
+                return
+            mensaje = _Mensaje(self.admin_id, texto, "alerta", opciones, no_antes_de=time.monotonic() + self.ventana_alertas)
+            if self._encolar(mensaje):
+                self._alerta_abierta = mensaje
+
+    def pendientes(self):
+        with self._condicion:
+            return sum(len(cola) for cola in self._por_chat.values()) + len(self._enviando)
+
+    def _siguiente(self):
+        """
+        Con el lock tomado: el próximo mensaje que se puede enviar ya, o (None, segundos a esperar).
+        """
+        ahora = time.monotonic()
+        espera = None
+        for chat_id, cola in self._por_chat.items():
+            if chat_id in self._enviando:
+                continue
+            listo = max(cola[0].no_antes_de, self._proximo_chat.get(chat_id, 0.0), self._proximo_global)
+            if listo <= ahora:
+                mensaje = cola.popleft()
+                if not cola:
+                    del self._por_chat[chat_id]
+                else:
+                    self._por_chat.move_to_end(chat_id)  # turno rotativo entre chats
+                if mensaje is self._alerta_abierta:
+                    self._alerta_abierta = None
+                self._enviando.add(chat_id)
+                self._proximo_global = ahora + self.intervalo_global
+                return mensaje, None
+            espera = listo - ahora if espera is None else min(espera, listo - ahora)
+        return None, espera
+
+    def _bucle(self):
+        while True:
+            with self._condicion:
+                while True:
+                    mensaje, espera = self._siguiente()
+                    if mensaje is not None:
+                        break
+                    if self._detenido and not self._por_chat:
+                        return
+                    self._condicion.wait(espera)
+
+            try:
+                if mensaje.responder_a is not None:
+                    self.bot.reply_to(mensaje.responder_a, mensaje.texto, **mensaje.opciones)
+                else:
+                    self.bot.send_message(mensaje.chat_id, mensaje.texto, **mensaje.opciones)
+                error = None
+            except Exception as e:
+                error = e
+
+            ahora = time.monotonic()
+            with self._condicion:
+                self._enviando.discard(mensaje.chat_id)
+                if len(self._proximo_chat) > 1000:
+                    self._proximo_chat = {c: t for c, t in self._proximo_chat.items() if t > ahora}
+                self._proximo_chat[mensaje.chat_id] = ahora + self.intervalo_chat
+                if error is None:
+                    TELEGRAM_ENVIOS.inc(tipo=mensaje.tipo, resultado="ok")
+                    TELEGRAM_ENTREGA_SEGUNDOS.observar(ahora - mensaje.encolado, tipo=mensaje.tipo)
+                else:
+                    mensaje.intentos += 1
+                    espera = _espera_reintento(error, mensaje.intentos)
+                    if espera is not None and mensaje.intentos <= self.reintentos:
+                        logging.warning(f"TELEGRAM: Envío a {mensaje.chat_id} falló ({error}). Reintento {mensaje.intentos} en {espera:.1f} s.")
+                        TELEGRAM_ENVIOS.inc(tipo=mensaje.tipo, resultado="reintento")
+                        self._proximo_chat[mensaje.chat_id] = ahora + espera
+                        self._por_chat.setdefault(mensaje.chat_id, deque()).appendleft(mensaje)
+                        self._por_chat.move_to_end(mensaje.chat_id, last=False)
+                    else:
+                        logging.error(f"TELEGRAM: No se pudo enviar el mensaje a {mensaje.chat_id}: {error}")
+                        TELEGRAM_ENVIOS.inc(tipo=mensaje.tipo, resultado="descartado")
+                self._condicion.notify_all()
+
+    def detener(self, esperar=True, timeout=None):
+        """
+        Deja de aceptar mensajes; los ya encolados se terminan de enviar (sin esperar la ventana de los avisos).
+        """
+        with self._condicion:
+            self._detenido = True
+            for cola in self._por_chat.values():
+                for mensaje in cola:
+                    mensaje.no_antes_de = 0.0
+            self._condicion.notify_all()
+            trabajadores = list(self._trabajadores)
+        if esperar:
+            limite = None if timeout is None else time.monotonic() + timeout
+            for hilo in trabajadores:
+                hilo.join(None if limite is None else max(0, limite - time.monotonic()))
+
+
+cola_telegram = ColaTelegram()
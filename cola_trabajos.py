@@ -0,0 +1,150 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+# Pool de trabajadores con cola acotada para procesar las actualizaciones del webhook de Telegram
+# (y las consultas de la web) fuera del hilo que responde la petición HTTP.
+
+COLA_HILOS = int(os.getenv("COLA_HILOS", "4"))
+COLA_CAPACIDAD = int(os.getenv("COLA_CAPACIDAD", "100"))  # trabajos esperando (sin contar los que se están ejecutando)
+COLA_MAX_POR_GRUPO = int(os.getenv("COLA_MAX_POR_CHAT", "1"))  # trabajos simultáneos por chat / correo
+COLA_IDS_RECORDADOS = int(os.getenv("COLA_IDS_RECORDADOS", "1000"))
+
+
+class ColaLlena(Exception):
+    """
+    Se lanza al enviar un trabajo cuando la cola ya tiene COLA_CAPACIDAD trabajos esperando.
+    """
+
+
+class _Trabajo:
+    def __init__(self, funcion, grupo):
+        self.funcion = funcion
+        self.grupo = grupo
+        self.futuro = Future()
+
+
+class PoolTrabajos:
+    """
+    Ejecuta funciones en hilos trabajadores con:
+      - cola acotada (enviar() lanza ColaLlena si está llena),
+      - deduplicación por id_unico dentro del proceso (ej. update_id de Telegram, que reintenta si tardamos;
+        entre workers lo deduplica almacen_correos.reclamar_actualizacion),
+      - límite de trabajos simultáneos por grupo (ej. por chat); el resto espera su turno en orden.
+    Los hilos se crean con el primer trabajo, así el pool sobrevive a un fork del servidor.
+    """
+
+    def __init__(self, hilos=COLA_HILOS, capacidad=COLA_CAPACIDAD, max_por_grupo=COLA_MAX_POR_GRUPO, ids_recordados=COLA_IDS_RECORDADOS):
+        self.hilos = hilos
+        self.capacidad = capacidad
+        self.max_por_grupo = max_por_grupo
+        self.ids_recordados = ids_recordados
+        self._condicion = threading.Condition()
+        self._listos = deque()  # trabajos que pueden ejecutarse ya
+        self._en_espera = {}  # grupo -> deque de trabajos esperando que se libere su grupo
+        self._activos = {}  # grupo -> trabajos en ejecución
+        self._esperando = 0  # total en _listos + _en_espera
+        self._ejecutando = 0
+        self._vistos = OrderedDict()
+        self._trabajadores = []
+        self._detenido = False
+
+    def _arrancar_trabajadores(self):
+        self._trabajadores = [t for t in self._trabajadores if t.is_alive()]
+        while len(self._trabajadores) < self.hilos:
+            hilo = threading.Thread(target=self._bucle, name=f"trabajador-{len(self._trabajadores) + 1}", daemon=True)
+            hilo.start()
+            self._trabajadores.append(hilo)
+
+    def enviar(self, funcion, grupo=None, id_unico=None):
+        """
+        Encola funcion() y retorna un concurrent.futures.Future con su resultado.
+        Retorna None si id_unico ya se procesó (duplicado). Lanza ColaLlena si no hay lugar.
+        """
+        with self._condicion:
+            if self._detenido:
+                raise ColaLlena("El pool de trabajos se está deteniendo.")
+            if id_unico is not None:
+                if id_unico in self._vistos:
+                    logging.info(f"COLA: Trabajo duplicado ignorado ({id_unico}).")
+                    return None
+            if self._esperando >= self.capacidad:
+                raise ColaLlena(f"Cola llena ({self._esperando} trabajos esperando).")
+            if id_unico is not None:
+                self._vistos[id_unico] = True
+                while len(self._vistos) > self.ids_recordados:
+                    self._vistos.popitem(last=False)
+
+            trabajo = _Trabajo(funcion, grupo)
+            if grupo is not None and self._activos.get(grupo, 0) + len(self._en_espera.get(grupo, ())) >= self.max_por_grupo:
+                self._en_espera.setdefault(grupo, deque()).append(trabajo)
+            else:
+                self._listos.append(trabajo)
+                if grupo is not None:
+                    self._activos[grupo] = self._activos.get(grupo, 0) + 1
+            self._esperando += 1
+            self._arrancar_trabajadores()
+            self._condicion.notify()
+            return trabajo.futuro
+
+    def _bucle(self):
+        while True:
+            with self._condicion:
+                while not self._listos and not self._detenido:
+                    self._condicion.wait()
+                if not self._listos:
+                    return
+                trabajo = self._listos.popleft()
+                self._esperando -= 1
+                self._ejecutando += 1
+
+            if trabajo.futuro.set_running_or_notify_cancel():
+                try:
+                    trabajo.futuro.set_result(trabajo.funcion())
+                except BaseException as e:
+                    logging.exception(f"COLA: Error en un trabajo del grupo {trabajo.grupo}")
+                    trabajo.futuro.set_exception(e)
+
+            with self._condicion:
+                self._ejecutando -= 1
+                grupo = trabajo.grupo
+                if grupo is not None:
+                    siguientes = self._en_espera.get(grupo)
+                    if siguientes:
+                        # El grupo conserva su lugar: pasa el siguiente trabajo del mismo grupo
+                        self._listos.append(siguientes.popleft())
+                        if not siguientes:
+                            del self._en_espera[grupo]
+                        self._condicion.notify()
+                    else:
+                        self._activos[grupo] -= 1
+                        if not self._activos[grupo]:
+                            del self._activos[grupo]
+                self._condicion.notify_all()
+
+    def profundidad(self):
+        """
+        Retorna el estado de la cola: trabajos esperando, en ejecución y capacidad.
+        """
+        with self._condicion:
+            return {"esperando": self._esperando, "ejecutando": self._ejecutando, "capacidad": self.capacidad, "hilos": self.hilos}
+
+    def detener(self, esperar=True, timeout=None):
+        """
+        Deja de aceptar trabajos; los ya encolados se terminan de ejecutar.
+        """
+        with self._condicion:
+            self._detenido = True
+            self._condicion.notify_all()
+            trabajadores = list(self._trabajadores)
+        if esperar:
+            # Un solo plazo para todos los hilos: timeout es el total del apagado, no uno por hilo
+            limite = None if timeout is None else time.monotonic() + timeout
+            for hilo in trabajadores:
+                hilo.join(None if limite is None else max(0, limite - time.monotonic()))
+
+
+pool_trabajos = PoolTrabajos()
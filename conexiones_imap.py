@@ -0,0 +1,231 @@
+import os
+import time
+import hashlib
+import imaplib
+import logging
+import threading
+from contextlib import contextmanager
+
+from metricas import ACIERTOS, medir_etapa
+
+# Pool de sesiones IMAP compartido por la web y el bot de Telegram.
+# Evita repetir TLS + login + select en cada consulta (Gmail además limita los logins repetidos).
+
+IMAP_HOST = os.getenv("IMAP_HOST", "imap.gmail.com")
+IMAP_PUERTO = int(os.getenv("IMAP_PUERTO", "0"))  # 0 = puerto estándar (993 con SSL, 143 sin SSL)
+IMAP_SSL = os.getenv("IMAP_SSL", "1") == "1"  # IMAP_SSL=0 solo para servidores locales de prueba (benchmarks)
+IMAP_TIMEOUT = float(os.getenv("IMAP_TIMEOUT", "30"))
+IMAP_POOL_MAX_POR_CUENTA = int(os.getenv("IMAP_POOL_MAX_POR_CUENTA", "3"))
+IMAP_POOL_MAX_TOTAL = int(os.getenv("IMAP_POOL_MAX_TOTAL", "10"))
+IMAP_POOL_MAX_INACTIVIDAD = float(os.getenv("IMAP_POOL_MAX_INACTIVIDAD", "600"))  # segundos antes de cerrar una sesión sin uso
+IMAP_POOL_INTERVALO_NOOP = float(os.getenv("IMAP_POOL_INTERVALO_NOOP", "60"))  # segundos sin uso antes de verificar con NOOP
+
+
+def abrir_conexion(host=IMAP_HOST, timeout=IMAP_TIMEOUT):
+    """
+    Abre una conexión IMAP (SSL salvo que IMAP_SSL=0) sin autenticar.
+    """
+    if IMAP_SSL:
+        return imaplib.IMAP4_SSL(host, IMAP_PUERTO or imaplib.IMAP4_SSL_PORT, timeout=timeout)
+    return imaplib.IMAP4(host, IMAP_PUERTO or imaplib.IMAP4_PORT, timeout=timeout)
+
+
+def _cerrar_silencioso(mail):
+    """
+    Cierra una sesión IMAP ignorando errores (la conexión puede estar ya rota).
+    """
+    try:
+        mail.logout()
+    except Exception:
+        try:
+            mail.shutdown()
+        except Exception:
+            pass
+
+
+class PoolIMAP:
+    """
+    Pool thread-safe de sesiones IMAP ya autenticadas y con el buzón seleccionado,
+    agrupadas por credenciales. Uso:
+
+        with pool_imap.sesion(usuario, contrasena) as mail:
+            mail.uid("SEARCH", ...)
+    """
+
+    def __init__(self, host=IMAP_HOST, buzon="inbox", max_por_cuenta=IMAP_POOL_MAX_POR_CUENTA,
+                 max_total=IMAP_POOL_MAX_TOTAL, max_inactividad=IMAP_POOL_MAX_INACTIVIDAD,
+                 intervalo_noop=IMAP_POOL_INTERVALO_NOOP, timeout=IMAP_TIMEOUT):
+        self.host = host
+        self.buzon = buzon
+        self.max_por_cuenta = max_por_cuenta
+        self.max_total = max_total
+        self.max_inactividad = max_inactividad
+        self.intervalo_noop = intervalo_noop
+        self.timeout = timeout
+        self._condicion = threading.Condition()
+        self._libres = {}  # clave -> lista de (mail, instante_ultimo_uso)
+        self._abiertas = {}  # clave -> sesiones abiertas (libres + prestadas + conectando)
+
+    def _clave(self, usuario, contrasena):
+        # No guardamos la contraseña en claro en las claves del pool
+        return (self.host, usuario.lower(), hashlib.sha256(contrasena.encode("utf-8")).hexdigest())
+
+    def _total_abiertas(self):
+        return sum(self._abiertas.values())
+
+    def _conectar(self, usuario, contrasena):
+        logging.info(f"IMAP POOL: Abriendo nueva sesión para {usuario} en {self.host}...")
+        mail = abrir_conexion(self.host, timeout=self.timeout)
+        try:
+            mail.login(usuario, contrasena)
+            mail.select(self.buzon)
+        except Exception:
+            _cerrar_silencioso(mail)
+            raise
+        return mail
+
+    def _sesion_sana(self, mail, ultimo_uso):
+        if time.monotonic() - ultimo_uso < self.intervalo_noop:
+            return True
+        try:
+            estado, _ = mail.noop()
+            return estado == "OK"
+        except Exception as e:
+            logging.info(f"IMAP POOL: Sesión inactiva descartada tras NOOP fallido: {e}")
+            return False
+
+    def _expulsar_inactivas(self):
+        """
+        Retira del pool las sesiones libres que superaron max_inactividad. Debe llamarse con el lock tomado.
+        Retorna las sesiones a cerrar (se cierran fuera del lock).
+        """
+        limite = time.monotonic() - self.max_inactividad
+        a_cerrar = []
+        for clave, libres in self._libres.items():
+            vigentes = [(m, t) for m, t in libres if t >= limite]
+            expiradas = [m for m, t in libres if t < limite]
+            if expiradas:
+                self._libres[clave] = vigentes
+                self._abiertas[clave] -= len(expiradas)
+                a_cerrar += expiradas
+        return a_cerrar
+
+    def _liberar_libre_de_otra_cuenta(self, clave):
+        """
+        Si el pool está lleno, cierra la sesión libre más antigua de otra cuenta para hacer lugar.
+        Debe llamarse con el lock tomado. Retorna la sesión a cerrar o None.
+        """
+        candidata = None
+        for otra, libres in self._libres.items():
+            if otra != clave and libres and (candidata is None or libres[0][1] < candidata[1][1]):
+                candidata = (otra, libres[0])
+        if candidata is None:
+            return None
+        otra, (mail, _) = candidata
+        self._libres[otra].pop(0)
+        self._abiertas[otra] -= 1
+        return mail
+
+    def _tomar(self, usuario, contrasena, espera_maxima):
+        clave = self._clave(usuario, contrasena)
+        limite_espera = time.monotonic() + espera_maxima
+        while True:
+            a_cerrar = []
+            mail = None
+            with self._condicion:
+                a_cerrar += self._expulsar_inactivas()
+                while True:
+                    libres = self._libres.get(clave)
+                    if libres:
+                        mail, ultimo_uso = libres.pop()  # LIFO: la más recién usada suele seguir viva
+                        break
+                    abiertas = self._abiertas.get(clave, 0)
+                    if abiertas < self.max_por_cuenta:
+                        if self._total_abiertas() < self.max_total:
+                            break
+                        expulsada = self._liberar_libre_de_otra_cuenta(clave)
+                        if expulsada is not None:
+                            a_cerrar.append(expulsada)
+                            break
+                    restante = limite_espera - time.monotonic()
+                    if restante <= 0:
+                        raise TimeoutError(f"No hay sesiones IMAP libres para {usuario} (pool lleno).")
+                    self._condicion.wait(restante)
+                if mail is None:
+                    # Reservamos el lugar antes de conectar para respetar los límites
+                    self._abiertas[clave] = self._abiertas.get(clave, 0) + 1
+
+            for vieja in a_cerrar:
+                _cerrar_silencioso(vieja)
+
+            if mail is None:
+                ACIERTOS.inc(fuente="pool_imap", resultado="fallo")
+                try:
+                    with medir_etapa("imap_login"):
+                        return clave, self._conectar(usuario, contrasena)
+                except Exception:
+                    self._olvidar(clave)
+                    raise
+
+            if self._sesion_sana(mail, ultimo_uso):
+                ACIERTOS.inc(fuente="pool_imap", resultado="acierto")
+                return clave, mail
+
+            # La sesión estaba muerta: la descartamos y volvemos a intentar (reconexión automática)
+            _cerrar_silencioso(mail)
+            self._olvidar(clave)
+
+    def _olvidar(self, clave):
+        with self._condicion:
+            self._abiertas[clave] = max(0, self._abiertas.get(clave, 0) - 1)
+            self._condicion.notify()
+
+    def _devolver(self, clave, mail):
+        with self._condicion:
+            self._libres.setdefault(clave, []).append((mail, time.monotonic()))
+            self._condicion.notify()
+
+    @contextmanager
+    def sesion(self, usuario, contrasena, espera_maxima=None):
+        """
+        Presta una sesión IMAP autenticada y con el buzón seleccionado.
+        Si durante el uso la conexión se rompe, la sesión se descarta en vez de volver al pool.
+        """
+        # imap_sesion incluye la espera por un lugar en el pool; imap_login, solo las conexiones nuevas
+        with medir_etapa("imap_sesion"):
+            clave, mail = self._tomar(usuario, contrasena, self.timeout if espera_maxima is None else espera_maxima)
+        try:
+            yield mail
+        except (imaplib.IMAP4.abort, OSError):
+            _cerrar_silencioso(mail)
+            self._olvidar(clave)
+            raise
+        except imaplib.IMAP4.error:
+            # Respuesta NO/BAD: la conexión sigue siendo válida
+            self._devolver(clave, mail)
+            raise
+        except BaseException:
+            # Error a mitad de una respuesta: no sabemos en qué estado quedó el protocolo
+            _cerrar_silencioso(mail)
+            self._olvidar(clave)
+            raise
+        else:
+            self._devolver(clave, mail)
+
+    def cerrar_todo(self):
+        """
+        Cierra todas las sesiones libres del pool. Las que están prestadas vuelven al pool al terminar su uso.
+        """
+        with self._condicion:
+            a_cerrar = [m for libres in self._libres.values() for m, _ in libres]
+            for clave, libres in self._libres.items():
+                self._abiertas[clave] -= len(libres)
+            self._libres = {}
+            self._condicion.notify_all()
+        for mail in a_cerrar:
+            _cerrar_silencioso(mail)
+        logging.info(f"IMAP POOL: {len(a_cerrar)} sesiones cerradas.")
+
+
+# Pool global usado por funciones.py
+pool_imap = PoolIMAP()
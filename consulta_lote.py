@@ -0,0 +1,105 @@
+import os
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from funciones import obtener_links_en_lote, obtener_codigo_de_pagina, obtener_enlace_confirmacion_final_hogar
+from busqueda_multibuzon import buzones_para, enviar_a_buzon
+from indice_correos import indice_correos
+from metricas import ACIERTOS
+
+# Consulta en lote: resuelve la misma acción para muchas cuentas (ej. todas las de un revendedor) con una sola
+# pasada por cada buzón (funciones.obtener_links_en_lote) y visitando las páginas de Netflix en paralelo con
+# un pool acotado. Los resultados se entregan a medida que se resuelven, no al final.
+
+LOTE_HILOS_PAGINAS = int(os.getenv("LOTE_HILOS_PAGINAS", "4"))  # páginas de Netflix visitadas a la vez (en total)
+LOTE_MAX_CORREOS = int(os.getenv("LOTE_MAX_CORREOS", "50"))  # correos por consulta en lote
+
+_ejecutor = None
+_lock_ejecutor = threading.Lock()
+
+
+def _obtener_ejecutor():
+    # Se crea con la primera consulta en lote (y no al importar), así sobrevive a un fork del servidor
+    global _ejecutor
+    with _lock_ejecutor:
+        if _ejecutor is None:
+            _ejecutor = ThreadPoolExecutor(max_workers=LOTE_HILOS_PAGINAS, thread_name_prefix="lote-pagina")
+        return _ejecutor
+
+
+def _visitar_pagina(link, accion):
+    if accion == "hogar":
+        return obtener_enlace_confirmacion_final_hogar(link)
+    return obtener_codigo_de_pagina(link)
+
+
+def resolver_lote(correos, buzon_por_defecto, accion="code"):
+    """
+    Generador de (correo, (estado, valor)) en el orden en que se resuelven, con los mismos estados que
+    funciones.resolver_accion. Cada buzón involucrado se revisa una sola vez para todos sus correos.
+    """
+    correos = list(dict.fromkeys(correo.lower() for correo in correos))
+    ejecutor = _obtener_ejecutor()
+    paginas = {}  # futuro -> correo
+    busquedas = {}  # futuro -> correos buscados en ese buzón
+    buzones_restantes = {}  # correo -> buzones que todavía no respondieron
+    errores = {}  # correo -> último error de buzón
+
+    def visitar(correo, link):
+        paginas[ejecutor.submit(contextvars.copy_context().run, _visitar_pagina, link, accion)] = correo
+
+    por_buzon = {}
+    for correo in correos:
+        if indice_correos.activo():
+            link = indice_correos.obtener(correo, accion)
+            ACIERTOS.inc(fuente="indice", resultado="acierto" if link else "fallo")
+            if link:
+                visitar(correo, link)
+                continue
+        buzones = buzones_para(correo, buzon_por_defecto)
+        if not buzones:
+            yield correo, ("error", "❌ Error: La lectura de correos no está configurada para esta cuenta.")
+            continue
+        buzones_restantes[correo] = len(buzones)
+        for buzon in buzones:
+            por_buzon.setdefault(buzon, []).append(correo)
+
+    for buzon, lista in por_buzon.items():
+        futuro = enviar_a_buzon(buzon, lambda usuario, contrasena, lista=lista: obtener_links_en_lote(usuario, contrasena, accion, lista))
+        busquedas[futuro] = lista
+    logging.info(f"LOTE: {len(correos)} correos de '{accion}' en {len(por_buzon)} buzón(es) y {len(paginas)} desde el índice.")
+
+    while busquedas or paginas:
+        hechos, _ = wait(list(busquedas) + list(paginas), return_when=FIRST_COMPLETED)
+        for futuro in hechos:
+            if futuro in paginas:
+                correo = paginas.pop(futuro)
+                try:
+                    resultado = futuro.result()
+                except Exception:
+                    logging.exception(f"LOTE: Error visitando la página de Netflix para {correo}")
+                    resultado = None
+                yield correo, ("ok", resultado) if resultado else ("sin_resultado", None)
+                continue
+
+            lista = busquedas.pop(futuro)
+            try:
+                links, error = futuro.result()
+            except Exception as e:
+                logging.exception("LOTE: Error buscando en un buzón")
+                links, error = {}, f"⚠️ Error inesperado al acceder al correo: {str(e)}"
+            for correo in lista:
+                if correo not in buzones_restantes:
+                    continue  # ya se encontró su enlace en otro buzón
+                buzones_restantes[correo] -= 1
+                if links.get(correo):
+                    del buzones_restantes[correo]
+                    visitar(correo, links[correo])
+                    continue
+                if error:
+                    errores[correo] = error
+                if not buzones_restantes[correo]:
+                    del buzones_restantes[correo]
+                    yield correo, ("error", errores[correo]) if correo in errores else ("sin_solicitud", None)
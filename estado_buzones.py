@@ -0,0 +1,109 @@
+import os
+import logging
+import datetime
+import threading
+from reglas import regla
+
+# Estado incremental de cada buzón IMAP consultado: UIDVALIDITY, el UID más alto ya clasificado
+# (marca de agua), el HIGHESTMODSEQ visto (si el servidor soporta CONDSTORE) y los correos de Netflix
+# ya clasificados por (acción, destinatario). Con esto cada consulta solo pide al servidor lo que llegó
+# después de la marca, en vez de volver a revisar los últimos mensajes. Vive mientras dure el proceso.
+
+ESTADO_MAX_CORREOS = int(os.getenv("ESTADO_MAX_CORREOS", "5000"))  # correos clasificados por buzón
+
+
+class EstadoBuzon:
+    """
+    Estado de un buzón. El lock se toma durante toda la sincronización con el servidor para que
+    dos consultas simultáneas del mismo buzón no descarguen dos veces los mismos mensajes.
+    """
+
+    def __init__(self, clave="", max_correos=ESTADO_MAX_CORREOS):
+        self.clave = clave  # "host/usuario", también es la clave en almacen_correos
+        self.lock = threading.RLock()
+        self.max_correos = max_correos
+        self.uidvalidity = None
+        self.ultimo_uid = None  # None = aún no se hizo la sincronización inicial
+        self.modseq = None
+        self.no_soportado = False  # el servidor rechazó la búsqueda incremental: se usa la completa
+        self.restaurado = False  # ya se intentó cargar desde almacen_correos
+        self._correos = {}  # uid -> (accion, destinatarios, fecha)
+        self._links = {}  # uid -> enlace ya extraído del correo
+
+    def reiniciar(self, uidvalidity=None):
+        """
+        Olvida todo lo clasificado (UIDVALIDITY cambió: los UIDs anteriores ya no significan nada).
+        """
+        with self.lock:
+            self.uidvalidity = uidvalidity
+            self.ultimo_uid = None
+            self.modseq = None
+            self._correos = {}
+            self._links = {}
+
+    def agregar(self, uid, accion, destinatarios, fecha):
+        with self.lock:
+            self._correos[int(uid)] = (accion, frozenset(destinatarios), fecha)
+            if len(self._correos) > self.max_correos:
+                for viejo in sorted(self._correos)[:len(self._correos) - self.max_correos]:
+                    del self._correos[viejo]
+                    self._links.pop(viejo, None)
+
+    def guardar_link(self, uid, link):
+        with self.lock:
+            if int(uid) in self._correos:
+                self._links[int(uid)] = link
+
+    def link_de(self, uid):
+        with self.lock:
+            return self._links.get(int(uid))
+
+    def avanzar(self, ultimo_uid, modseq=None):
+        with self.lock:
+            self.ultimo_uid = max(self.ultimo_uid or 0, int(ultimo_uid))
+            if modseq is not None:
+                self.modseq = max(self.modseq or 0, int(modseq))
+
+    def descartar(self, uid):
+        with self.lock:
+            self._correos.pop(int(uid), None)
+            self._links.pop(int(uid), None)
+
+    def candidatos(self, accion, correo_destinatario, dias_atras):
+        """
+        UIDs (de más reciente a más antiguo) de los correos de la acción dirigidos al destinatario
+        recibidos en los últimos dias_atras días y todavía dentro de la vigencia de su regla.
+        """
+        ahora = datetime.datetime.now(datetime.timezone.utc)
+        desde = ahora - datetime.timedelta(days=dias_atras)
+        correo = correo_destinatario.lower()
+        regla_accion = regla(accion)
+        with self.lock:
+            uids = [uid for uid, (a, destinatarios, fecha) in self._correos.items()
+                    if a == accion and correo in destinatarios and fecha >= desde and regla_accion.vigente(fecha, ahora)]
+        return sorted(uids, reverse=True)
+
+    def __len__(self):
+        with self.lock:
+            return len(self._correos)
+
+
+class EstadosBuzones:
+    def __init__(self):
+        self._estados = {}
+        self._lock = threading.Lock()
+
+    def de(self, host, usuario_imap):
+        clave = (host, usuario_imap.lower())
+        with self._lock:
+            if clave not in self._estados:
+                self._estados[clave] = EstadoBuzon(f"{host}/{usuario_imap.lower()}")
+            return self._estados[clave]
+
+    def olvidar_todo(self):
+        with self._lock:
+            self._estados = {}
+        logging.info("ESTADO BUZONES: Estado incremental descartado.")
+
+
+estados_buzones = EstadosBuzones()
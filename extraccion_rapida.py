@@ -0,0 +1,64 @@
+import re
+import html
+from reglas import regla
+
+# Extracción rápida (sin árbol DOM) de los enlaces y botones que nos interesan del HTML de Netflix.
+# Son expresiones precompiladas sobre el texto; si no encuentran nada, funciones.py vuelve a
+# BeautifulSoup, que es más tolerante pero mucho más lento en correos grandes.
+
+_RE_ANCLA = re.compile(r"<a\b([^>]*)>(.*?)</a\s*>", re.IGNORECASE | re.DOTALL)
+_RE_HREF = re.compile(r"""\bhref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.IGNORECASE)
+_RE_ETIQUETA = re.compile(r"<[^>]*>")
+_RE_BOTON_CONFIRMAR = re.compile(
+    r"""<button\b[^>]*\bdata-uia\s*=\s*["']set-primary-location-action["'][^>]*>(.*?)</button\s*>""",
+    re.IGNORECASE | re.DOTALL,
+)
+_RE_TEXTO_CONFIRMAR = re.compile(r"Confirmar actualización", re.IGNORECASE)
+RE_CODIGO = re.compile(r'<div[^>]*class=["\']challenge-code["\'][^>]*>(\d{4})<\/div>')
+
+
+def _href(atributos):
+    encontrado = _RE_HREF.search(atributos)
+    if not encontrado:
+        return None
+    valor = next(grupo for grupo in encontrado.groups() if grupo is not None)
+    return html.unescape(valor).strip()
+
+
+def _texto(contenido):
+    return html.unescape(_RE_ETIQUETA.sub("", contenido)).strip()
+
+
+def extraer_link_rapido(contenido_html, es_hogar=False):
+    """
+    Igual que funciones.extraer_link_con_token_o_confirmacion pero con expresiones regulares.
+    Retorna el enlace o None si no lo pudo determinar (el llamador debe probar con el parser completo).
+    """
+    regla_correo = regla("hogar" if es_hogar else "code")
+    if regla_correo.textos_boton:
+        for ancla in _RE_ANCLA.finditer(contenido_html):
+            if regla_correo.es_boton(_texto(ancla.group(2))):
+                link = _href(ancla.group(1))
+                if link:
+                    return link
+
+    parametro = regla_correo.parametro_enlace
+    if parametro.rstrip("=") in contenido_html:
+        for ancla in _RE_ANCLA.finditer(contenido_html):
+            link = _href(ancla.group(1))
+            if link and parametro in link:
+                return link
+    return None
+
+
+def hay_boton_confirmar_rapido(contenido_html):
+    """
+    Indica si la página de confirmación de hogar tiene el botón negro 'Confirmar actualización'
+    (data-uia="set-primary-location-action"). Retorna False si no lo encontró por esta vía.
+    """
+    if "set-primary-location-action" not in contenido_html:
+        return False
+    for boton in _RE_BOTON_CONFIRMAR.finditer(contenido_html):
+        if _RE_TEXTO_CONFIRMAR.search(_texto(boton.group(1))):
+            return True
+    return False
@@ -1,92 +1,590 @@
+import os
 import imaplib
-import email
+import datetime
 from email.header import decode_header
+from email.utils import getaddresses, parsedate_to_datetime
+from email.parser import BytesHeaderParser
 import re
 import json
 import logging
 from bs4 import BeautifulSoup 
 import requests 
+from conexiones_imap import pool_imap
+from cliente_http import obtener_pagina
+from extraccion_rapida import extraer_link_rapido, hay_boton_confirmar_rapido, RE_CODIGO
+from indice_correos import indice_correos
+from busqueda_multibuzon import primer_resultado
+from protocolo_imap import parsear_respuesta_fetch, buscar_parte_html, decodificar_parte
+from mime_incremental import LectorHTML, MIME_MAX_BYTES, MIME_TAMANO_BLOQUE
+from metricas import ACIERTOS, EXTRACCIONES, MENSAJES_REVISADOS, medir_etapa
+from estado_buzones import estados_buzones
+from almacen_correos import almacen_correos
+from reglas import REGLAS_POR_ACCION, ASUNTO_BUSQUEDA, MENSAJE_SIN_CORREO, clasificar, regla
 
 # Configurar logging para ver mensajes en los logs de Render
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def buscar_ultimo_correo(usuario_imap, contrasena_imap, asunto_parte_clave, num_mensajes_revisar=50):
+# Ventana de búsqueda IMAP (en días) para el criterio SINCE. Los correos de Netflix
+# vencen en minutos, así que no hace falta mirar más atrás de un par de días.
+DIAS_BUSQUEDA_IMAP = int(os.getenv("DIAS_BUSQUEDA_IMAP", "2"))
+
+# Asunto canónico de cada acción (las variantes y el resto de la regla están en reglas.py)
+ASUNTOS_POR_ACCION = {accion: r.asunto for accion, r in REGLAS_POR_ACCION.items()}
+
+# Búsqueda incremental: cada buzón recuerda hasta qué UID ya clasificó y solo se piden los nuevos (ver estado_buzones.py)
+BUSQUEDA_INCREMENTAL = os.getenv("BUSQUEDA_INCREMENTAL", "1") == "1"
+
+_MESES_IMAP = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+
+def _fecha_imap(fecha):
+    """
+    Formatea una fecha como la espera IMAP en SINCE (ej. 05-Mar-2024), sin depender del locale.
+    """
+    return f"{fecha.day:02d}-{_MESES_IMAP[fecha.month - 1]}-{fecha.year}"
+
+
+def _construir_criterios_busqueda(asunto_parte_clave, correo_destinatario=None, dias_atras=DIAS_BUSQUEDA_IMAP):
+    """
+    Construye los criterios de un UID SEARCH del lado del servidor.
+    El asunto va al final porque se envía como literal UTF-8 (los asuntos de Netflix llevan acentos).
+    Retorna la lista de criterios y el literal del asunto.
+    """
+    desde = datetime.date.today() - datetime.timedelta(days=dias_atras)
+    criterios = ["CHARSET", "UTF-8", "SINCE", _fecha_imap(desde)]
+    if correo_destinatario:
+        # Con un dominio catch-all el correo del cliente puede venir en To o solo en Delivered-To
+        correo_citado = '"' + correo_destinatario.replace('\\', '').replace('"', '') + '"'
+        criterios += ["OR", "TO", correo_citado, "HEADER", "Delivered-To", correo_citado]
+    criterios.append("SUBJECT")
+    return criterios, asunto_parte_clave.encode("utf-8")
+
+
+def _buscar_uids_en_servidor(mail, asunto_parte_clave, correo_destinatario=None, dias_atras=DIAS_BUSQUEDA_IMAP):
+    """
+    Ejecuta el UID SEARCH en el servidor y retorna la lista de UIDs candidatos (de más antiguo a más reciente).
+    """
+    criterios, literal_asunto = _construir_criterios_busqueda(asunto_parte_clave, correo_destinatario, dias_atras)
+    mail.literal = literal_asunto
+    estado, datos = mail.uid("SEARCH", *criterios)
+    if estado != "OK":
+        raise imaplib.IMAP4.error(f"UID SEARCH rechazado por el servidor: {datos}")
+    return datos[0].split() if datos and datos[0] else []
+
+
+def _decodificar_asunto(mensaje):
+    """
+    Decodifica el asunto (RFC 2047) de un mensaje o de sus cabeceras.
+    """
+    try:
+        asunto_parts = decode_header(mensaje["Subject"])
+        asunto = ""
+        for part, encoding in asunto_parts:
+            if isinstance(part, bytes):
+                asunto += part.decode(encoding or "utf-8", errors='ignore')
+            else:
+                asunto += part
+    except Exception as e:
+        asunto = mensaje.get("Subject", "Sin Asunto")
+        logging.warning(f"No se pudo decodificar el asunto: {e}. Usando asunto crudo: {asunto}")
+    return asunto
+
+
+def _direcciones_destinatario(mensaje):
+    """
+    Retorna las direcciones (en minúsculas) a las que va dirigido el mensaje (To, Cc, Delivered-To, X-Original-To).
+    """
+    cabeceras = []
+    for nombre in ("To", "Cc", "Delivered-To", "X-Original-To"):
+        cabeceras += mensaje.get_all(nombre, [])
+    return {direccion.lower() for _, direccion in getaddresses(cabeceras) if direccion}
+
+
+def _es_para_destinatario(mensaje, correo_destinatario):
+    """
+    Verifica que el mensaje vaya dirigido al correo indicado.
+    """
+    if not correo_destinatario:
+        return True
+    return correo_destinatario.lower() in _direcciones_destinatario(mensaje)
+
+
+# Cabeceras que se piden en el primer paso (lote): suficientes para decidir por asunto y destinatario
+CABECERAS_CLASIFICACION = "SUBJECT TO CC DELIVERED-TO X-ORIGINAL-TO DATE"
+
+
+def _valor_por_prefijo(valores, prefijo):
+    """
+    Busca en un ítem de FETCH parseado el valor cuyo nombre empieza con el prefijo (ej. "BODY[HEADER").
+    """
+    for nombre, valor in valores.items():
+        if nombre.startswith(prefijo):
+            return valor
+    return None
+
+
+def _items_cabeceras(con_modseq=False, cambiados_desde=None):
+    """
+    Ítems del UID FETCH de las cabeceras de clasificación (ver _fetch_cabeceras).
+    """
+    items = f"(UID{' MODSEQ' if con_modseq else ''} BODY.PEEK[HEADER.FIELDS ({CABECERAS_CLASIFICACION})])"
+    if con_modseq and cambiados_desde:
+        items += f" (CHANGEDSINCE {cambiados_desde})"
+    return items
+
+
+def _cabeceras_de_respuesta(datos):
+    """
+    Interpreta la respuesta del UID FETCH de cabeceras.
+    Retorna ({uid: email.message.Message solo con cabeceras}, mayor_modseq_o_None).
+    """
+    cabeceras = {}
+    modseq = None
+    for uid, valores in parsear_respuesta_fetch(datos).items():
+        crudo = _valor_por_prefijo(valores, "BODY[HEADER")
+        if isinstance(crudo, bytes):
+            cabeceras[uid] = BytesHeaderParser().parsebytes(crudo)
+        if isinstance(valores.get("MODSEQ"), list) and valores["MODSEQ"]:
+            modseq = max(modseq or 0, int(valores["MODSEQ"][0]))
+    return cabeceras, modseq
+
+
+def _fetch_cabeceras(mail, conjunto, con_modseq=False, cambiados_desde=None):
+    """
+    UID FETCH de las cabeceras de clasificación del conjunto de UIDs ("1,5,7" o "120:*").
+    Con con_modseq pide también MODSEQ (CONDSTORE) y, si se indica cambiados_desde, solo los mensajes
+    modificados o llegados después de ese modseq (CHANGEDSINCE).
+    Retorna ({uid: email.message.Message solo con cabeceras}, mayor_modseq_o_None).
+    """
+    estado, datos = mail.uid("FETCH", conjunto, _items_cabeceras(con_modseq, cambiados_desde))
+    if estado != "OK":
+        raise imaplib.IMAP4.error(f"UID FETCH de cabeceras rechazado: {datos}")
+    return _cabeceras_de_respuesta(datos)
+
+
+def _obtener_cabeceras_en_lote(mail, uids):
+    """
+    Primer paso: un solo UID FETCH con BODY.PEEK de las cabeceras de todos los candidatos.
+    Retorna {uid: email.message.Message solo con cabeceras}. PEEK evita marcar los correos como leídos.
+    """
+    if not uids:
+        return {}
+    conjunto = b",".join(uid if isinstance(uid, bytes) else str(uid).encode() for uid in uids).decode()
+    return _fetch_cabeceras(mail, conjunto)[0]
+
+
+def _obtener_html_por_partes(mail, uid):
+    """
+    Segundo paso, solo para el correo elegido: BODYSTRUCTURE para ubicar la parte text/html
+    y luego BODY.PEEK[n] de esa parte únicamente (sin adjuntos ni imágenes).
+    Si la estructura no se puede interpretar, lee el mensaje por bloques con mime_incremental (también con
+    PEEK) hasta dar con la parte HTML, sin guardar los adjuntos y sin pasar de MIME_MAX_BYTES.
+    """
+    estado, datos = mail.uid("FETCH", uid, "(BODYSTRUCTURE)")
+    estructura = parsear_respuesta_fetch(datos).get(uid, {}).get("BODYSTRUCTURE") if estado == "OK" else None
+    parte = buscar_parte_html(estructura) if estructura else None
+
+    if parte:
+        seccion, codificacion, charset = parte
+        estado, datos = mail.uid("FETCH", uid, f"(BODY.PEEK[{seccion}]<0.{MIME_MAX_BYTES}>)")
+        contenido = _valor_por_prefijo(parsear_respuesta_fetch(datos).get(uid, {}), f"BODY[{seccion}]") if estado == "OK" else None
+        if contenido is not None:
+            return decodificar_parte(contenido, codificacion, charset)
+        logging.warning(f"No se pudo descargar la parte {seccion} del UID {uid}. Leyendo el mensaje por bloques.")
+    else:
+        logging.info(f"BODYSTRUCTURE del UID {uid} sin parte text/html reconocible. Leyendo el mensaje por bloques.")
+
+    lector = LectorHTML()
+    inicio = 0
+    while not lector.terminado:
+        estado, datos = mail.uid("FETCH", uid, f"(BODY.PEEK[]<{inicio}.{MIME_TAMANO_BLOQUE}>)")
+        bloque = _valor_por_prefijo(parsear_respuesta_fetch(datos).get(uid, {}), "BODY[]") if estado == "OK" else None
+        if not isinstance(bloque, bytes):
+            break
+        lector.alimentar(bloque)
+        if len(bloque) < MIME_TAMANO_BLOQUE:
+            break  # fin del mensaje
+        inicio += len(bloque)
+    return lector.cerrar()
+
+
+def _fecha_de(mensaje):
+    """
+    Fecha (con zona horaria) de la cabecera Date; si no se puede leer, el momento actual.
+    """
+    try:
+        fecha = parsedate_to_datetime(mensaje["Date"])
+        if fecha.tzinfo is None:
+            fecha = fecha.replace(tzinfo=datetime.timezone.utc)
+        return fecha
+    except (TypeError, ValueError):
+        return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _clasificar_cabeceras(estado_buzon, cabeceras):
+    """
+    Guarda en el estado del buzón los correos de Netflix (según reglas.py) de las cabeceras dadas.
+    Retorna la lista de correos clasificados para almacen_correos: (uid, accion, destinatarios, fecha, None).
+    """
+    clasificados = []
+    for uid, mensaje in cabeceras.items():
+        accion = clasificar(_decodificar_asunto(mensaje))
+        if not accion:
+            continue
+        fecha = _fecha_de(mensaje)
+        destinatarios = _direcciones_destinatario(mensaje)
+        estado_buzon.agregar(uid, accion, destinatarios, fecha)
+        clasificados.append((uid, accion, destinatarios, fecha, None))
+    return clasificados
+
+
+def _uidvalidity_anunciado(mail):
+    """
+    UIDVALIDITY que el servidor anunció a esta sesión desde la última vez que se leyó (al hacer SELECT o si
+    cambió), o None si no anunció nada nuevo. imaplib guarda esas respuestas hasta que se leen.
+    """
+    _, valores = mail.response("UIDVALIDITY")
+    valores = [v for v in (valores or []) if v]
+    return int(valores[-1]) if valores else None
+
+
+def _sincronizar_buzon(mail, estado_buzon, dias_atras):
+    """
+    Pone al día el estado del buzón. La primera vez (o si cambió UIDVALIDITY) busca en el servidor los
+    correos de Netflix de los últimos días (una sola búsqueda para todas las acciones); después pide solo las cabeceras de los UIDs por encima
+    de la marca, y con CONDSTORE solo si algo cambió desde el último HIGHESTMODSEQ visto.
+    Al primer uso del buzón en el proceso se parte de lo guardado en almacen_correos, si lo hay.
+    """
+    condstore = "CONDSTORE" in mail.capabilities
+    uidvalidity = _uidvalidity_anunciado(mail)
+    restaurado = False
+    if not estado_buzon.restaurado:
+        estado_buzon.restaurado = True
+        restaurado = almacen_correos.restaurar(estado_buzon.clave, estado_buzon)
+    if uidvalidity is None and (estado_buzon.uidvalidity is None or restaurado):
+        # Lo restaurado del disco también se valida contra el UIDVALIDITY actual del servidor
+        _, datos = mail.status("INBOX", "(UIDVALIDITY)")
+        uidvalidity = int(re.search(rb"UIDVALIDITY (\d+)", datos[0]).group(1))
+    if uidvalidity is not None and uidvalidity != estado_buzon.uidvalidity:
+        if estado_buzon.uidvalidity is not None:
+            logging.warning(f"UIDVALIDITY del buzón cambió ({estado_buzon.uidvalidity} -> {uidvalidity}). Reclasificando.")
+            almacen_correos.olvidar_buzon(estado_buzon.clave)
+        estado_buzon.reiniciar(uidvalidity)
+
+    if estado_buzon.ultimo_uid is None:
+        # Marca antes de buscar: lo que llegue mientras tanto se verá en la próxima sincronización
+        _, datos = mail.uid("SEARCH", "UID", "*")
+        maximo = max([int(u) for u in (datos[0] or b"").split()] or [0])
+        uids = _buscar_uids_en_servidor(mail, ASUNTO_BUSQUEDA, None, dias_atras)
+        cabeceras, modseq = ({}, None)
+        if uids:
+            conjunto = ",".join(sorted((u.decode() if isinstance(u, bytes) else str(u) for u in uids), key=int))
+            cabeceras, modseq = _fetch_cabeceras(mail, conjunto, con_modseq=condstore)
+        almacen_correos.guardar_correos(estado_buzon.clave, estado_buzon.uidvalidity, _clasificar_cabeceras(estado_buzon, cabeceras))
+        estado_buzon.avanzar(maximo, modseq)
+        almacen_correos.guardar_marca(estado_buzon.clave, estado_buzon.uidvalidity, estado_buzon.ultimo_uid, estado_buzon.modseq)
+        MENSAJES_REVISADOS.inc(len(cabeceras))
+        logging.info(f"Buzón clasificado: {len(estado_buzon)} correos de Netflix hasta el UID {maximo}.")
+        return
+
+    # Si no hay nada nuevo, con CHANGEDSINCE el servidor no devuelve nada; sin CONDSTORE devuelve
+    # solo el último mensaje (n:* siempre incluye el mayor UID), que se descarta por estar bajo la marca
+    marca = estado_buzon.ultimo_uid
+    cabeceras, modseq = _fetch_cabeceras(mail, f"{marca + 1}:*", con_modseq=condstore, cambiados_desde=estado_buzon.modseq)
+    nuevas = {uid: mensaje for uid, mensaje in cabeceras.items() if int(uid) > marca}
+    almacen_correos.guardar_correos(estado_buzon.clave, estado_buzon.uidvalidity, _clasificar_cabeceras(estado_buzon, nuevas))
+    estado_buzon.avanzar(max([marca] + [int(uid) for uid in cabeceras]), modseq)
+    if estado_buzon.ultimo_uid != marca or modseq is not None:
+        almacen_correos.guardar_marca(estado_buzon.clave, estado_buzon.uidvalidity, estado_buzon.ultimo_uid, estado_buzon.modseq)
+    MENSAJES_REVISADOS.inc(len(nuevas))
+    if nuevas:
+        logging.info(f"{len(nuevas)} correos nuevos desde el UID {marca}.")
+
+
+def _html_de_candidatos(mail, estado_buzon, accion, uids, solo_link=False):
+    """
+    Descarga el HTML del primer UID de la lista (de más reciente a más antiguo) que lo tenga.
+    Retorna (html, link) o (None, None). Con solo_link, y si hay estado_buzon, reutiliza el enlace ya extraído
+    de ese correo (en este proceso o antes de un reinicio, vía almacen_correos) sin descargar el cuerpo.
+    """
+    for uid in uids:
+        link = estado_buzon.link_de(uid) if solo_link and estado_buzon is not None else None
+        if solo_link and estado_buzon is not None:
+            ACIERTOS.inc(fuente="enlace_guardado", resultado="acierto" if link else "fallo")
+        if link:
+            logging.info(f"Enlace de '{accion}' (UID {uid}) ya extraído antes. Sin descargar el correo.")
+            return None, link
+        with medir_etapa("imap_cuerpo"):
+            html_content = _obtener_html_por_partes(mail, str(uid))
+        if html_content:
+            logging.info(f"HTML del correo de '{accion}' (UID {uid}) extraído con éxito.")
+            link = extraer_link_con_token_o_confirmacion(html_content, es_hogar=accion == "hogar") if solo_link else None
+            if link and estado_buzon is not None:
+                estado_buzon.guardar_link(uid, link)
+                almacen_correos.guardar_link(estado_buzon.clave, estado_buzon.uidvalidity, uid, link)
+            return html_content, link
+        logging.warning(f"No se pudo extraer contenido HTML del UID {uid}.")
+        if estado_buzon is not None:
+            # Borrado del buzón o sin HTML: no sirve para ninguna consulta futura
+            estado_buzon.descartar(uid)
+    return None, None
+
+
+def _buscar_incremental(mail, estado_buzon, accion, num_mensajes_revisar, correo_destinatario, dias_atras, solo_link=False):
+    """
+    Busca el correo de la acción usando el estado incremental del buzón (ver estado_buzones.py).
+    Retorna (html, link, error); ver _html_de_candidatos para solo_link.
+    """
+    with estado_buzon.lock, medir_etapa("imap_sincronizacion"):
+        _sincronizar_buzon(mail, estado_buzon, dias_atras)
+
+    candidatos = estado_buzon.candidatos(accion, correo_destinatario, dias_atras)[:num_mensajes_revisar]
+    html_content, link = _html_de_candidatos(mail, estado_buzon, accion, candidatos, solo_link)
+    if html_content or link:
+        return html_content, link, None
+
+    logging.info(f"No se encontró un correo reciente de '{accion}' para {correo_destinatario}.")
+    return None, None, MENSAJE_SIN_CORREO
+
+
+def _buscar_en_sesion(mail, usuario_imap, asunto_parte_clave, num_mensajes_revisar, correo_destinatario, dias_atras, solo_link=False):
+    """
+    Busca el correo dentro de una sesión IMAP ya autenticada y con el buzón seleccionado.
+    Retorna (html, link, error); link solo viene si solo_link y la búsqueda incremental ya lo extrajo.
+    """
+    # El asunto pedido se clasifica como cualquier otro: las variantes de la misma regla también sirven
+    accion = clasificar(asunto_parte_clave)
+    estado_buzon = estados_buzones.de(pool_imap.host, usuario_imap)
+    if BUSQUEDA_INCREMENTAL and accion and correo_destinatario and not estado_buzon.no_soportado:
+        try:
+            return _buscar_incremental(mail, estado_buzon, accion, num_mensajes_revisar, correo_destinatario, dias_atras, solo_link)
+        except imaplib.IMAP4.abort:
+            # Conexión caída (abort hereda de error): no dice nada del servidor; el pool descarta la sesión
+            raise
+        except imaplib.IMAP4.error as e:
+            # Ej. el servidor no acepta CHARSET UTF-8 o CHANGEDSINCE: este buzón sigue con la búsqueda completa
+            logging.warning(f"Búsqueda incremental no disponible en {usuario_imap} ({e}). Usando la búsqueda completa.")
+            estado_buzon.reiniciar()
+            estado_buzon.no_soportado = True
+
+    try:
+        with medir_etapa("imap_busqueda"):
+            uids = _buscar_uids_en_servidor(mail, ASUNTO_BUSQUEDA if accion else asunto_parte_clave, correo_destinatario, dias_atras)
+        logging.info(f"UID SEARCH devolvió {len(uids)} candidatos para '{asunto_parte_clave}' ({correo_destinatario or 'cualquier destinatario'}).")
+    except imaplib.IMAP4.abort:
+        raise
+    except imaplib.IMAP4.error as e:
+        # Algunos servidores no aceptan CHARSET UTF-8: volvemos a revisar los últimos mensajes.
+        # El filtro por asunto y destinatario se sigue aplicando abajo sobre las cabeceras.
+        logging.warning(f"Búsqueda en el servidor no disponible ({e}). Revisando los últimos {num_mensajes_revisar} mensajes.")
+        with medir_etapa("imap_busqueda"):
+            _, uids = mail.uid("SEARCH", "ALL")
+        uids = uids[0].split()
+
+    # Revisar un número limitado de mensajes recientes para eficiencia
+    uids = [uid.decode() if isinstance(uid, bytes) else str(uid) for uid in uids[-min(num_mensajes_revisar, len(uids)):]]
+    with medir_etapa("imap_cabeceras"):
+        cabeceras = _obtener_cabeceras_en_lote(mail, uids)
+    MENSAJES_REVISADOS.inc(len(uids))
+
+    for uid in reversed(uids):
+        mensaje = cabeceras.get(uid)
+        if mensaje is None:
+            continue
+
+        asunto = _decodificar_asunto(mensaje)
+
+        # CAMBIO CLAVE AQUÍ: Buscar si el asunto CONTIENE la parte clave y que el correo sea del usuario pedido
+        coincide = clasificar(asunto) == accion if accion else asunto_parte_clave.lower() in asunto.lower()
+        # Un correo más viejo que la vigencia de su regla trae un enlace que Netflix ya no acepta
+        if coincide and accion and not regla(accion).vigente(_fecha_de(mensaje)):
+            continue
+        if coincide and _es_para_destinatario(mensaje, correo_destinatario):
+            logging.info(f"Parte del asunto '{asunto_parte_clave}' encontrada en '{asunto}'. Extrayendo HTML.")
+
+            with medir_etapa("imap_cuerpo"):
+                html_content = _obtener_html_por_partes(mail, uid)
+
+            if html_content:
+                logging.info("HTML del correo extraído con éxito.")
+                return html_content, None, None
+            else:
+                logging.warning(f"No se pudo extraer contenido HTML del correo con asunto: {asunto}")
+
+    logging.info(f"No se encontró un correo reciente con el asunto que contiene '{asunto_parte_clave}' para {correo_destinatario or usuario_imap}.")
+    return None, None, MENSAJE_SIN_CORREO
+
+
+def _buscar_correo(usuario_imap, contrasena_imap, asunto_parte_clave, num_mensajes_revisar, correo_destinatario, dias_atras, solo_link=False):
+    if not usuario_imap or not contrasena_imap:
+        return None, None, "❌ Error interno: Credenciales IMAP no configuradas."
+    
+    try:
+        logging.info(f"Tomando sesión IMAP del pool para {usuario_imap}...")
+        with pool_imap.sesion(usuario_imap, contrasena_imap) as mail:
+            logging.info("Sesión IMAP lista. Buscando correos.")
+            return _buscar_en_sesion(mail, usuario_imap, asunto_parte_clave, num_mensajes_revisar, correo_destinatario, dias_atras, solo_link)
+
+    except imaplib.IMAP4.error as e:
+        logging.error(f"Error de IMAP al acceder al correo {usuario_imap}: {e}. Verifica la contraseña de aplicación de Gmail.")
+        return None, None, f"⚠️ Error de autenticación o IMAP: {str(e)}. Asegúrate de usar una contraseña de aplicación de Gmail (si tienes 2FA) y que la configuración IMAP esté habilitada."
+    except Exception as e:
+        logging.exception(f"Error inesperado al buscar correo para {usuario_imap}")
+        return None, None, f"⚠️ Error inesperado al acceder al correo: {str(e)}"
+
+
+def buscar_ultimo_correo(usuario_imap, contrasena_imap, asunto_parte_clave, num_mensajes_revisar=50, correo_destinatario=None, dias_atras=DIAS_BUSQUEDA_IMAP):
     """
     Busca el último correo que CONTIENE una parte del asunto clave para la cuenta IMAP especificada.
+    El filtrado por asunto, destinatario (correo_destinatario) y fecha (dias_atras) se hace en el servidor
+    con UID SEARCH, así que solo se descargan los candidatos.
     Retorna el HTML del correo y None si tiene éxito, o None y un mensaje de error.
     """
+    html_content, _, error = _buscar_correo(usuario_imap, contrasena_imap, asunto_parte_clave, num_mensajes_revisar, correo_destinatario, dias_atras)
+    return html_content, error
+
+
+def obtener_link_de_correo(usuario_imap, contrasena_imap, asunto_parte_clave, correo_destinatario, es_hogar=False):
+    """
+    Retorna el enlace del último correo de la acción para el destinatario, y None o un mensaje de error.
+    Primero consulta el índice que mantiene el vigilante IMAP; si no hay entrada o el vigilante
+    está caído, hace la búsqueda normal en el buzón.
+    """
+    accion = "hogar" if es_hogar else "code"
+    if indice_correos.activo():
+        link = indice_correos.obtener(correo_destinatario, accion)
+        ACIERTOS.inc(fuente="indice", resultado="acierto" if link else "fallo")
+        if link:
+            logging.info(f"Enlace de '{accion}' para {correo_destinatario} obtenido del índice del vigilante.")
+            return link, None
+
+    html_correo, link, error = _buscar_correo(usuario_imap, contrasena_imap, asunto_parte_clave, 50, correo_destinatario, DIAS_BUSQUEDA_IMAP, solo_link=True)
+    if error:
+        return None, error
+    if link:
+        return link, None
+    return extraer_link_con_token_o_confirmacion(html_correo, es_hogar=es_hogar), None
+
+
+def _candidatos_por_destinatario(mail, accion, correos_destinatarios, num_mensajes_revisar, dias_atras):
+    """
+    Sin estado incremental: un solo UID SEARCH (sin filtrar destinatario) y un solo FETCH de cabeceras,
+    repartidos por destinatario. Retorna {correo: [uid, ...]} de más reciente a más antiguo.
+    """
+    try:
+        with medir_etapa("imap_busqueda"):
+            uids = _buscar_uids_en_servidor(mail, ASUNTO_BUSQUEDA, None, dias_atras)
+    except imaplib.IMAP4.abort:
+        raise
+    except imaplib.IMAP4.error as e:
+        logging.warning(f"Búsqueda en el servidor no disponible ({e}). Revisando los últimos {num_mensajes_revisar} mensajes.")
+        with medir_etapa("imap_busqueda"):
+            _, uids = mail.uid("SEARCH", "ALL")
+        uids = uids[0].split()
+
+    uids = [uid.decode() if isinstance(uid, bytes) else str(uid) for uid in uids[-min(num_mensajes_revisar, len(uids)):]]
+    with medir_etapa("imap_cabeceras"):
+        cabeceras = _obtener_cabeceras_en_lote(mail, uids)
+    MENSAJES_REVISADOS.inc(len(uids))
+
+    candidatos = {correo: [] for correo in correos_destinatarios}
+    for uid in reversed(uids):
+        mensaje = cabeceras.get(uid)
+        if mensaje is None or clasificar(_decodificar_asunto(mensaje)) != accion or not regla(accion).vigente(_fecha_de(mensaje)):
+            continue
+        for correo in _direcciones_destinatario(mensaje) & candidatos.keys():
+            candidatos[correo].append(uid)
+    return candidatos
+
+
+def obtener_links_en_lote(usuario_imap, contrasena_imap, accion, correos_destinatarios, num_mensajes_revisar=200, dias_atras=DIAS_BUSQUEDA_IMAP):
+    """
+    Enlaces de la acción para varios destinatarios con una sola pasada por el buzón: una sincronización
+    incremental (o, sin ella, un UID SEARCH y un FETCH de cabeceras para todos) y después solo el cuerpo
+    del correo más reciente de cada destinatario.
+    Retorna ({correo: link_o_None}, None) si tiene éxito, o ({}, mensaje de error).
+    """
+    correos = sorted({correo.lower() for correo in correos_destinatarios})
     if not usuario_imap or not contrasena_imap:
-        return None, "❌ Error interno: Credenciales IMAP no configuradas."
-    
+        return {}, "❌ Error interno: Credenciales IMAP no configuradas."
+
     try:
-        logging.info(f"Intentando conectar a IMAP para {usuario_imap}...")
-        mail = imaplib.IMAP4_SSL("imap.gmail.com")
-        mail.login(usuario_imap, contrasena_imap)
-        mail.select("inbox")
-        logging.info("Conexión IMAP exitosa. Buscando correos.")
-        
-        _, mensajes = mail.search(None, "ALL") 
-        mensajes = mensajes[0].split()
+        with pool_imap.sesion(usuario_imap, contrasena_imap) as mail:
+            estado_buzon = estados_buzones.de(pool_imap.host, usuario_imap)
+            candidatos = None
+            if BUSQUEDA_INCREMENTAL and not estado_buzon.no_soportado:
+                try:
+                    with estado_buzon.lock, medir_etapa("imap_sincronizacion"):
+                        _sincronizar_buzon(mail, estado_buzon, dias_atras)
+                    candidatos = {correo: estado_buzon.candidatos(accion, correo, dias_atras)[:num_mensajes_revisar] for correo in correos}
+                except imaplib.IMAP4.abort:
+                    # Conexión caída, no un rechazo del servidor: el pool descarta la sesión
+                    raise
+                except imaplib.IMAP4.error as e:
+                    logging.warning(f"Búsqueda incremental no disponible en {usuario_imap} ({e}). Usando la búsqueda completa.")
+                    estado_buzon.reiniciar()
+                    estado_buzon.no_soportado = True
+            if candidatos is None:
+                estado_buzon = None
+                candidatos = _candidatos_por_destinatario(mail, accion, correos, num_mensajes_revisar, dias_atras)
 
-        # Revisar un número limitado de mensajes recientes para eficiencia
-        mensajes_reversados = reversed(mensajes[-min(num_mensajes_revisar, len(mensajes)):])
-        
-        for num in mensajes_reversados:
-            _, datos = mail.fetch(num, "(RFC822)")
-            mensaje = email.message_from_bytes(datos[0][1])
-
-            try:
-                asunto_parts = decode_header(mensaje["Subject"])
-                asunto = ""
-                for part, encoding in asunto_parts:
-                    if isinstance(part, bytes):
-                        asunto += part.decode(encoding or "utf-8", errors='ignore')
-                    else:
-                        asunto += part
-            except Exception as e:
-                asunto = mensaje.get("Subject", "Sin Asunto") 
-                logging.warning(f"No se pudo decodificar el asunto: {e}. Usando asunto crudo: {asunto}")
-
-            # CAMBIO CLAVE AQUÍ: Buscar si el asunto CONTIENE la parte clave
-            if asunto_parte_clave.lower() in asunto.lower():
-                logging.info(f"Parte del asunto '{asunto_parte_clave}' encontrada en '{asunto}'. Extrayendo HTML.")
-                
-                html_content = None
-                if mensaje.is_multipart():
-                    for parte in mensaje.walk():
-                        ctype = parte.get_content_type()
-                        cdisp = str(parte.get('Content-Disposition'))
-                        if ctype == 'text/html' and 'attachment' not in cdisp:
-                            try:
-                                html_content = parte.get_payload(decode=True).decode(parte.get_content_charset() or "utf-8", errors='ignore')
-                                break 
-                            except Exception as e:
-                                logging.warning(f"Error decodificando parte HTML: {e}")
-                else:
-                    try:
-                        if mensaje.get_content_type() == 'text/html':
-                            html_content = mensaje.get_payload(decode=True).decode(mensaje.get_content_charset() or "utf-8", errors='ignore')
-                    except Exception as e:
-                        logging.warning(f"Error decodificando mensaje no multipart: {e}")
-
-                if html_content:
-                    logging.info("HTML del correo extraído con éxito.")
-                    mail.logout()
-                    return html_content, None
-                else:
-                    logging.warning(f"No se pudo extraer contenido HTML del correo con asunto: {asunto}")
-
-
-        mail.logout()
-        logging.info(f"No se encontró un correo reciente con el asunto que contiene '{asunto_parte_clave}' para {usuario_imap}.")
-        return None, f"❌ No se encontró un correo reciente de Netflix para esta acción. Asegúrate de haberla solicitado y que el correo haya llegado."
+            links = {}
+            for correo in correos:
+                _, links[correo] = _html_de_candidatos(mail, estado_buzon, accion, candidatos[correo], solo_link=True)
+            logging.info(f"LOTE: {sum(1 for l in links.values() if l)} de {len(correos)} enlaces de '{accion}' encontrados en {usuario_imap}.")
+            return links, None
 
     except imaplib.IMAP4.error as e:
         logging.error(f"Error de IMAP al acceder al correo {usuario_imap}: {e}. Verifica la contraseña de aplicación de Gmail.")
-        return None, f"⚠️ Error de autenticación o IMAP: {str(e)}. Asegúrate de usar una contraseña de aplicación de Gmail (si tienes 2FA) y que la configuración IMAP esté habilitada."
+        return {}, f"⚠️ Error de autenticación o IMAP: {str(e)}."
     except Exception as e:
-        logging.exception(f"Error inesperado al buscar correo para {usuario_imap}")
-        return None, f"⚠️ Error inesperado al acceder al correo: {str(e)}"
+        logging.exception(f"Error inesperado al buscar correos en lote para {usuario_imap}")
+        return {}, f"⚠️ Error inesperado al acceder al correo: {str(e)}"
+
+
+def obtener_link_en_buzones(buzones, asunto_parte_clave, correo_destinatario, es_hogar=False):
+    """
+    Igual que obtener_link_de_correo pero revisando varios buzones IMAP en paralelo; gana el primero que
+    encuentra el enlace. Si ninguno lo encuentra y alguno falló, retorna el error de ese buzón.
+    """
+    if not buzones:
+        return None, "❌ Error interno: Credenciales IMAP no configuradas."
+    exito, resultados = primer_resultado(
+        buzones,
+        lambda usuario_imap, contrasena_imap: obtener_link_de_correo(usuario_imap, contrasena_imap, asunto_parte_clave, correo_destinatario, es_hogar=es_hogar),
+        lambda resultado: bool(resultado[0]),
+    )
+    if exito:
+        return exito
+    errores = [resultado[1] if resultado else "⚠️ Error inesperado al acceder al correo." for resultado in resultados if not resultado or resultado[1]]
+    # Un fallo real de un buzón manda sobre el "no hay correo reciente" de otro (ese sí se guarda en caché)
+    errores.sort(key=lambda error: error == MENSAJE_SIN_CORREO)
+    return None, (errores[0] if errores else None)
+
+
+def resolver_accion(buzones, asunto_parte_clave, correo_destinatario, accion):
+    """
+    Pipeline completo de una acción: busca el enlace del correo en los buzones (user_imap, pass_imap)
+    indicados y visita la página de Netflix.
+    Retorna (estado, valor):
+      ("ok", codigo_o_enlace_final), ("sin_solicitud", None) si no hay correo/enlace pendiente,
+      ("sin_resultado", None) si la página de Netflix no dio el código/enlace, o ("error", mensaje).
+    """
+    es_hogar = accion == "hogar"
+    link, error = obtener_link_en_buzones(buzones, asunto_parte_clave, correo_destinatario, es_hogar=es_hogar)
+    if error:
+        return "error", error
+    if not link:
+        return "sin_solicitud", None
+
+    if es_hogar:
+        logging.info(f"Enlace del botón rojo 'Sí, la envié yo' encontrado: {link}. Intentando obtener enlace final de confirmación...")
+        resultado = obtener_enlace_confirmacion_final_hogar(link)
+    else:
+        resultado = obtener_codigo_de_pagina(link)
+    if not resultado:
+        return "sin_resultado", None
+    return "ok", resultado
 
 
 def extraer_link_con_token_o_confirmacion(html_content, es_hogar=False):
@@ -94,21 +592,38 @@ def extraer_link_con_token_o_confirmacion(html_content, es_hogar=False):
     Extrae el enlace relevante del HTML del correo.
     Para "hogar", busca el botón rojo "Sí, la envié yo" del primer correo.
     Para "código", busca enlaces con 'nftoken='.
+    Primero prueba la extracción rápida por expresiones regulares y solo si falla arma el árbol con BeautifulSoup.
+    """
+    with medir_etapa("extraccion_correo"):
+        link = extraer_link_rapido(html_content, es_hogar=es_hogar)
+        if link:
+            logging.info(f"Enlace encontrado (extracción rápida): {link}")
+            EXTRACCIONES.inc(via="rapida")
+            return link
+        link = _extraer_link_con_soup(html_content, es_hogar=es_hogar)
+        EXTRACCIONES.inc(via="soup" if link else "ninguna")
+        return link
+
+
+def _extraer_link_con_soup(html_content, es_hogar=False):
+    """
+    Extracción con el árbol completo de BeautifulSoup (respaldo de la extracción rápida).
     """
     soup = BeautifulSoup(html_content, 'html.parser')
+    regla_correo = regla("hogar" if es_hogar else "code")
     
-    if es_hogar:
-        # Busca el botón rojo "Sí, la envié yo"
-        boton_rojo = soup.find('a', string=re.compile(r'Sí, la envié yo', re.IGNORECASE))
+    if regla_correo.textos_boton:
+        # Busca el botón rojo "Sí, la envié yo" (o su variante en otro idioma)
+        boton_rojo = soup.find('a', string=lambda texto: bool(texto) and regla_correo.es_boton(texto))
         if boton_rojo and 'href' in boton_rojo.attrs:
             link = boton_rojo['href']
-            logging.info(f"Enlace del botón 'Sí, la envié yo' encontrado: {link}")
+            logging.info(f"Enlace del botón '{boton_rojo.get_text(strip=True)}' encontrado: {link}")
             return link
     
     # Busca enlaces con nftoken para el código de acceso temporal
     for a_tag in soup.find_all('a', href=True):
         link = a_tag['href']
-        if "nftoken=" in link:
+        if regla_correo.parametro_enlace in link:
             logging.info(f"Enlace con nftoken encontrado: {link}")
             return link
             
@@ -123,44 +638,18 @@ def obtener_enlace_confirmacion_final_hogar(url_boton_rojo):
     try: # <-- Inicio del bloque try
         logging.info(f"Visitando URL del botón rojo para obtener el enlace final de confirmación: {url_boton_rojo}")
         headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/100.0.4896.127 Safari/537.36', # User-Agent más actualizado
             'Referer': 'https://www.netflix.com/' 
         }
-        # Usamos allow_redirects=True para seguir la redirección a la página del botón negro
-        response = requests.get(url_boton_rojo, headers=headers, allow_redirects=True, timeout=30) 
+        # El cliente compartido sigue la redirección a la página del botón negro
+        with medir_etapa("http_pagina"):
+            response = obtener_pagina(url_boton_rojo, headers=headers) 
         response.raise_for_status() # Lanza excepción para errores HTTP (4xx o 5xx)
 
         html_pagina_final_confirmacion = response.text
         logging.info("Página de confirmación final obtenida. Buscando el botón 'Confirmar actualización'...")
         
-        soup = BeautifulSoup(html_pagina_final_confirmacion, 'html.parser')
-        
-        # Buscamos el botón negro por su texto y data-uia (el que estaba en la captura de pantalla)
-        # Es vital que esta búsqueda sea precisa
-        boton_confirmar = soup.find('button', attrs={'data-uia': 'set-primary-location-action'}, string=re.compile(r'Confirmar actualización', re.IGNORECASE))
-        
-        if not boton_confirmar:
-            # Fallback si el data-uia o el texto cambian un poco, buscar por el <form> donde suele estar
-            # O por alguna clase CSS distintiva del botón si es posible.
-            logging.warning("No se encontró el botón de Confirmar actualización por data-uia o texto directo. Intentando buscar en formularios o enlaces si es posible.")
-            # Si el botón negro es un submit de un form, podemos buscar la URL del action del form
-            form = soup.find('form', action=True)
-            if form and 'action' in form.attrs:
-                # Esto es un placeholder, la URL exacta del action del form podría ser relativa
-                # O la acción del botón es JS. Esta es la parte más compleja sin Selenium.
-                logging.warning("Se encontró un formulario. Su acción podría ser la URL de confirmación.")
-                return response.url # Retornamos la URL de la página si el botón es un submit JS
-                
-        # Si el botón es un <button> que activa una acción JavaScript, la URL a enviar es la de la página actual
-        # porque el 'clic' real es una petición POST/GET activada por JS en esa página.
-        # En la mayoría de los casos, la URL de la página donde se encuentra el botón es la que hay que "visitar" de nuevo (POST/GET).
-        # Para el propósito de pasar un LINK al administrador, le pasamos la URL actual de la página.
-        if boton_confirmar:
-             logging.info("Botón 'Confirmar actualización' encontrado. Retornando la URL de la página.")
-             return response.url # Devolvemos la URL actual de la página donde está el botón
-            
-        logging.warning("No se encontró el botón de 'Confirmar actualización' ni un formulario de acción para el hogar.")
-        return None
+        with medir_etapa("parseo_pagina"):
+            return confirmacion_de_pagina(html_pagina_final_confirmacion, response.url)
 
     except requests.exceptions.Timeout: # <-- Bloque except del try principal
         logging.error(f"Tiempo de espera agotado al visitar {url_boton_rojo}")
@@ -172,30 +661,83 @@ def obtener_enlace_confirmacion_final_hogar(url_boton_rojo):
         logging.exception(f"Error inesperado al obtener el enlace de confirmación final: {e}")
         return None
 
+def confirmacion_de_pagina(html_pagina_final_confirmacion, url_pagina):
+    """
+    Busca el botón negro 'Confirmar actualización' en el HTML de la página de confirmación ya descargada.
+    Retorna la URL de la página (la que hay que visitar para confirmar) o None.
+    """
+    if hay_boton_confirmar_rapido(html_pagina_final_confirmacion):
+        logging.info("Botón 'Confirmar actualización' encontrado (extracción rápida). Retornando la URL de la página.")
+        return url_pagina
+
+    resultado = _buscar_confirmacion_con_soup(html_pagina_final_confirmacion)
+    if resultado == "formulario":
+        return url_pagina # Retornamos la URL de la página si el botón es un submit JS
+        
+    # Si el botón es un <button> que activa una acción JavaScript, la URL a enviar es la de la página actual
+    # porque el 'clic' real es una petición POST/GET activada por JS en esa página.
+    # En la mayoría de los casos, la URL de la página donde se encuentra el botón es la que hay que "visitar" de nuevo (POST/GET).
+    # Para el propósito de pasar un LINK al administrador, le pasamos la URL actual de la página.
+    if resultado == "boton":
+         logging.info("Botón 'Confirmar actualización' encontrado. Retornando la URL de la página.")
+         return url_pagina # Devolvemos la URL actual de la página donde está el botón
+        
+    logging.warning("No se encontró el botón de 'Confirmar actualización' ni un formulario de acción para el hogar.")
+    return None
+
+def _buscar_confirmacion_con_soup(html_pagina_final_confirmacion):
+    """
+    Busca con BeautifulSoup el botón negro 'Confirmar actualización' (respaldo de la extracción rápida).
+    Retorna "boton", "formulario" (solo se encontró el <form> donde suele estar) o None.
+    """
+    soup = BeautifulSoup(html_pagina_final_confirmacion, 'html.parser')
+    
+    # Buscamos el botón negro por su texto y data-uia (el que estaba en la captura de pantalla)
+    # Es vital que esta búsqueda sea precisa
+    boton_confirmar = soup.find('button', attrs={'data-uia': 'set-primary-location-action'}, string=re.compile(r'Confirmar actualización', re.IGNORECASE))
+    if boton_confirmar:
+        return "boton"
+
+    # Fallback si el data-uia o el texto cambian un poco, buscar por el <form> donde suele estar
+    # O por alguna clase CSS distintiva del botón si es posible.
+    logging.warning("No se encontró el botón de Confirmar actualización por data-uia o texto directo. Intentando buscar en formularios o enlaces si es posible.")
+    # Si el botón negro es un submit de un form, podemos buscar la URL del action del form
+    form = soup.find('form', action=True)
+    if form and 'action' in form.attrs:
+        # Esto es un placeholder, la URL exacta del action del form podría ser relativa
+        # O la acción del botón es JS. Esta es la parte más compleja sin Selenium.
+        logging.warning("Se encontró un formulario. Su acción podría ser la URL de confirmación.")
+        return "formulario"
+    return None
+
+def codigo_de_pagina(html_pagina_codigo):
+    """
+    Extrae el código de acceso del HTML de la página de Netflix ya descargada, o None.
+    """
+    match = RE_CODIGO.search(html_pagina_codigo) 
+    if match:
+        codigo = match.group(1)
+        logging.info(f"Código encontrado: {codigo}")
+        return codigo
+        
+    logging.warning("No se encontró el patrón de código en la página de Netflix con la regex actual.")
+    return None
+
 def obtener_codigo_de_pagina(url_netflix):
     """
     Visita la URL de Netflix y extrae el código de acceso de la página resultante.
     """
     try:
         logging.info(f"Visitando URL de Netflix para obtener código: {url_netflix}")
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url_netflix, headers=headers, allow_redirects=True, timeout=30) 
+        with medir_etapa("http_pagina"):
+            response = obtener_pagina(url_netflix) 
         response.raise_for_status() 
 
         html_pagina_codigo = response.text
         logging.info("Página de Netflix para código obtenida. Buscando el código...")
         
-        match = re.search(r'<div[^>]*class=["\']challenge-code["\'][^>]*>(\d{4})<\/div>', html_pagina_codigo) 
-
-        if match:
-            codigo = match.group(1)
-            logging.info(f"Código encontrado: {codigo}")
-            return codigo
-            
-        logging.warning("No se encontró el patrón de código en la página de Netflix con la regex actual.")
-        return None
+        with medir_etapa("parseo_pagina"):
+            return codigo_de_pagina(html_pagina_codigo)
 
     except requests.exceptions.Timeout:
         logging.error(f"Tiempo de espera agotado al visitar {url_netflix}")
@@ -0,0 +1,84 @@
+import os
+import time
+import datetime
+import logging
+import threading
+from collections import OrderedDict
+from reglas import regla
+
+# Índice en memoria de los últimos enlaces de Netflix por (destinatario, acción).
+# Lo alimenta el vigilante IMAP en segundo plano (vigilante_imap.py) y lo consultan la web y el bot.
+
+INDICE_TTL = float(os.getenv("INDICE_TTL", "900"))  # segundos de edad del correo; tope sobre la vigencia de cada regla (reglas.py)
+INDICE_MAX_ENTRADAS = int(os.getenv("INDICE_MAX_ENTRADAS", "2000"))
+INDICE_MAX_SILENCIO = float(os.getenv("INDICE_MAX_SILENCIO", "600"))  # sin latido del vigilante por más de esto = caído
+
+
+class IndiceCorreos:
+    """
+    Diccionario acotado (LRU) y con vencimiento de enlaces extraídos de correos, indexado por
+    (correo_destinatario, accion). Thread-safe.
+    """
+
+    def __init__(self, ttl=INDICE_TTL, max_entradas=INDICE_MAX_ENTRADAS, max_silencio=INDICE_MAX_SILENCIO):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.max_silencio = max_silencio
+        self._entradas = OrderedDict()  # (correo, accion) -> (link, instante, uid, fecha)
+        self._lock = threading.Lock()
+        self._ultimo_latido = None
+
+    def guardar(self, correo_destinatario, accion, link, uid=None, fecha=None):
+        """
+        fecha es la de la cabecera Date del correo: la entrada vence según la edad del correo, no según
+        cuándo se indexó (un correo visto en el barrido inicial ya puede estar casi vencido).
+        """
+        clave = (correo_destinatario.lower(), accion)
+        with self._lock:
+            actual = self._entradas.get(clave)
+            if actual and uid is not None and actual[2] is not None and int(actual[2]) > int(uid):
+                return  # ya tenemos un correo más nuevo para esta clave
+            self._entradas[clave] = (link, time.monotonic(), uid, fecha)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+        logging.info(f"INDICE: Enlace de '{accion}' guardado para {correo_destinatario} (UID {uid}).")
+
+    def obtener(self, correo_destinatario, accion):
+        """
+        Retorna el último enlace vigente para (correo, accion) o None.
+        """
+        clave = (correo_destinatario.lower(), accion)
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            link, instante, _, fecha = entrada
+            if fecha is not None:
+                edad = (datetime.datetime.now(datetime.timezone.utc) - fecha).total_seconds()
+            else:
+                edad = time.monotonic() - instante
+            if edad > min(self.ttl, regla(accion).vigencia):
+                del self._entradas[clave]
+                return None
+            self._entradas.move_to_end(clave)
+            return link
+
+    def latido(self):
+        """
+        El vigilante lo llama en cada ciclo para indicar que el índice está al día.
+        """
+        self._ultimo_latido = time.monotonic()
+
+    def detener(self):
+        self._ultimo_latido = None
+
+    def activo(self):
+        return self._ultimo_latido is not None and time.monotonic() - self._ultimo_latido <= self.max_silencio
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entradas)
+
+
+indice_correos = IndiceCorreos()
@@ -1,28 +1,35 @@
 import os
-import json
+import time
+import queue
 import logging
-from flask import Flask, render_template, request, redirect, url_for
-from keep_alive import mantener_vivo
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from flask import Flask, Response, render_template, stream_template, request, redirect, url_for, jsonify
 # Importar funciones necesarias desde funciones.py
 # Asegúrate de que estas funciones solo usen los parámetros que les pasas
-from funciones import buscar_ultimo_correo, extraer_link_con_token_o_confirmacion, obtener_codigo_de_pagina, obtener_enlace_confirmacion_final_hogar 
+from funciones import resolver_accion 
+from reglas import regla
+from cache_resultados import cache_resultados, ttl_por_estado
+from registro_cuentas import registro_cuentas
+from cola_trabajos import pool_trabajos, ColaLlena
+from cola_telegram import cola_telegram
+from busqueda_multibuzon import buzones_para
+from consulta_lote import resolver_lote, LOTE_MAX_CORREOS
+from vigilante_imap import iniciar_vigilante, detener_vigilante
+from aviso_proactivo import aviso_proactivo
+from conexiones_imap import pool_imap
+from motor_async import motor_async, MOTOR_ASYNC
+import cliente_http
+from indice_correos import indice_correos
+from almacen_correos import almacen_correos
+from metricas import registro_metricas, contexto_consulta, CONSULTAS_SEGUNDOS, ACIERTOS
 import telebot # Importamos telebot para la funcionalidad del bot
 
 # Configurar logging para ver mensajes en los logs de Render
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # Cargar cuentas desde archivo (solo para validación de correos de usuario autorizados)
-# Este archivo debe estar en la misma carpeta que main.py
-try:
-    with open("cuentas.json", "r") as file:
-        cuentas = json.load(file)
-    logging.info("Cuentas cargadas exitosamente desde cuentas.json")
-except FileNotFoundError:
-    logging.error("❌ Error: cuentas.json no encontrado. La validación de correo no funcionará.")
-    cuentas = {} # Inicializa como diccionario vacío para evitar errores posteriores
-except json.JSONDecodeError:
-    logging.error("❌ Error: Formato JSON inválido en cuentas.json. La validación de correo podría ser inconsistente.")
-    cuentas = {}
+# Este archivo debe estar en la misma carpeta que main.py. Se recarga solo si cambia en disco.
+registro_cuentas.cargar()
 
 # Obtener credenciales IMAP y el token del bot desde las variables de entorno de Render
 BOT_TOKEN = os.getenv("BOT_TOKEN")
@@ -33,18 +40,35 @@ ADMIN_TELEGRAM_ID = os.getenv("ADMIN_TELEGRAM_ID") # Asegúrate de definir esta
 if not BOT_TOKEN:
     logging.error("❌ BOT_TOKEN no está definido en las variables de entorno de Render. La funcionalidad de Telegram NO ESTARÁ DISPONIBLE.")
 if not IMAP_USER or not IMAP_PASS:
-    logging.error("❌ E-MAIL_USER o EMAIL_PASS no están definidos en las variables de entorno de Render. La funcionalidad de lectura de correos NO ESTARÁ DISPONIBLE.")
-    # Si estas no están, el bot no podrá conectarse a Gmail, lo que es crítico.
+    logging.error("❌ E-MAIL_USER o EMAIL_PASS no están definidos en las variables de entorno de Render. Solo funcionarán los correos con buzón propio en cuentas.json.")
+    # Si estas no están, el bot no podrá conectarse a Gmail para los correos sin buzón propio, lo que es crítico.
 if not ADMIN_TELEGRAM_ID:
     logging.warning("⚠️ ADMIN_TELEGRAM_ID no está definido. No se enviarán notificaciones al administrador.")
 
 
+# Activa el vigilante IMAP en segundo plano (IDLE) que indexa los correos de Netflix a medida que llegan
+VIGILANTE_IMAP = os.getenv("VIGILANTE_IMAP", "1") == "1"
+# Tiempo máximo que la web espera el resultado de una consulta encolada
+WEB_TIMEOUT_CONSULTA = float(os.getenv("WEB_TIMEOUT_CONSULTA", "90"))
+# Segundos que /codes junta resultados del lote antes de mandarlos en un mensaje (Telegram limita por chat)
+LOTE_INTERVALO_TELEGRAM = float(os.getenv("LOTE_INTERVALO_TELEGRAM", "2"))
+
 # Inicializar Flask
 app = Flask(__name__)
 
+# Valores instantáneos que se calculan al consultar /metrics
+registro_metricas.medidor("cola_trabajos", "Trabajos esperando y en ejecución en el pool compartido.",
+                          lambda: {k: v for k, v in pool_trabajos.profundidad().items() if k in ("esperando", "ejecutando")}, etiqueta="estado")
+registro_metricas.medidor("telegram_cola_pendientes", "Mensajes de Telegram esperando envío o enviándose.", lambda: cola_telegram.pendientes())
+registro_metricas.medidor("indice_correos_entradas", "Enlaces guardados en el índice del vigilante IMAP.", lambda: len(indice_correos))
+
 # Inicializar Telebot solo si el token está presente
 if BOT_TOKEN:
-    bot = telebot.TeleBot(BOT_TOKEN)
+    # Sin hilos propios: los manejadores corren dentro del trabajo de pool_trabajos que procesa la actualización,
+    # así se respetan la cola acotada y el orden por chat
+    bot = telebot.TeleBot(BOT_TOKEN, threaded=False)
+    # Las respuestas y los avisos al admin salen por la cola de envío (límites de Telegram, reintentos)
+    cola_telegram.configurar(bot, ADMIN_TELEGRAM_ID)
     logging.info("Bot de Telegram inicializado.")
 else:
     bot = None # Establecemos bot a None para evitar errores si no hay token
@@ -57,18 +81,160 @@ def es_correo_autorizado(correo_usuario):
     """
     Verifica si el correo de usuario (ej. @dgplayk.com) pertenece a una de las cuentas autorizadas en cuentas.json.
     """
-    if not cuentas:
+    if not registro_cuentas.hay_cuentas():
         logging.warning("No hay cuentas cargadas para validación. Todos los correos serán rechazados por el bot.")
         return False
-        
-    for user_id, correos_list in cuentas.items():
-        for entrada in correos_list:
-            # La entrada puede ser "correo@dominio.com" o "correo@dominio.com|user_imap|pass_imap"
-            # Nos interesa solo la primera parte para comparar con el input del usuario
-            correo_en_lista = entrada.split("|")[0].lower()
-            if correo_en_lista == correo_usuario.lower():
-                return True
-    return False
+
+    # La entrada puede ser "correo@dominio.com" o "correo@dominio.com|user_imap|pass_imap";
+    # el registro ya indexa solo la primera parte, normalizada en minúsculas
+    return registro_cuentas.es_autorizado(correo_usuario)
+
+def iniciar_servicios():
+    """
+    Arranca los servicios en segundo plano que acompañan a la app Flask.
+    """
+    registro_metricas.iniciar_volcado()
+    if VIGILANTE_IMAP and IMAP_USER and IMAP_PASS:
+        iniciar_vigilante(IMAP_USER, IMAP_PASS)
+    elif aviso_proactivo.activo:
+        logging.warning("⚠️ AVISO_PROACTIVO necesita el vigilante IMAP (VIGILANTE_IMAP=1 y E-MAIL_USER/EMAIL_PASS). No se enviarán avisos.")
+
+def detener_servicios(timeout=None):
+    """
+    Apagado ordenado: detiene el vigilante y los avisos en curso, deja terminar los trabajos ya encolados
+    (búsquedas IMAP en curso incluidas) y las respuestas de Telegram, todo dentro de timeout segundos, y cierra
+    las sesiones IMAP y las conexiones HTTP compartidas (también las del motor async).
+    """
+    # Un solo plazo para todo el apagado: lo que no use una etapa queda para la siguiente
+    limite = None if timeout is None else time.monotonic() + timeout
+    detener_vigilante()
+    aviso_proactivo.detener(esperar=True)
+    pool_trabajos.detener(esperar=True, timeout=None if limite is None else max(0, limite - time.monotonic()))
+    pendientes = pool_trabajos.profundidad()
+    if pendientes["esperando"] or pendientes["ejecutando"]:
+        logging.warning(f"Apagado: quedaron trabajos sin terminar ({pendientes['esperando']} esperando, {pendientes['ejecutando']} ejecutando).")
+    # Después de los trabajos, que todavía pueden encolar respuestas
+    cola_telegram.detener(esperar=True, timeout=None if limite is None else max(0, limite - time.monotonic()))
+    if cola_telegram.pendientes():
+        logging.warning(f"Apagado: quedaron {cola_telegram.pendientes()} mensajes de Telegram sin enviar.")
+    motor_async.detener()
+    pool_imap.cerrar_todo()
+    cliente_http.cerrar()
+    registro_metricas.detener_volcado()
+
+def buzones_de(correo_usuario):
+    """
+    Buzones IMAP donde buscar los correos de Netflix de este usuario (ver busqueda_multibuzon.buzones_para).
+    """
+    return buzones_para(correo_usuario, (IMAP_USER, IMAP_PASS))
+
+def resolver_con_cache(correo_usuario, accion, canal):
+    """
+    Resuelve el código o el enlace de hogar pasando por la caché de resultados, de modo que varias
+    consultas iguales seguidas (o simultáneas) hagan una sola búsqueda.
+    canal ("web" o "telegram") etiqueta las métricas de la consulta.
+    Retorna ((estado, valor), calculado_aqui); ver funciones.resolver_accion.
+    """
+    inicio = time.perf_counter()
+    with contexto_consulta(canal, accion):
+        resultado, calculado_aqui = cache_resultados.obtener_o_calcular(
+            (correo_usuario.lower(), accion),
+            lambda: (motor_async.resolver_accion if MOTOR_ASYNC else resolver_accion)(
+                buzones_de(correo_usuario), regla(accion).asunto, correo_usuario, accion),
+            ttl_por_estado,
+        )
+        ACIERTOS.inc(fuente="cache", resultado="fallo" if calculado_aqui else "acierto")
+        CONSULTAS_SEGUNDOS.observar(time.perf_counter() - inicio, estado=resultado[0])
+    return resultado, calculado_aqui
+
+def resolver_lote_con_cache(correos_usuario, canal):
+    """
+    Resuelve los códigos de varios correos con una sola pasada por cada buzón (ver consulta_lote.py).
+    Generador de (correo, (estado, valor)) a medida que se resuelven. Los que ya están en la caché salen de
+    ahí sin buscarlos; los demás quedan guardados, así un /code posterior de esa cuenta los reutiliza.
+    """
+    inicio = time.perf_counter()
+    with contexto_consulta(canal, "code"):
+        faltantes = []
+        for correo in dict.fromkeys(correo.lower() for correo in correos_usuario):
+            resultado = cache_resultados.obtener((correo, "code"))
+            ACIERTOS.inc(fuente="cache", resultado="fallo" if resultado is None else "acierto")
+            if resultado is None:
+                faltantes.append(correo)
+                continue
+            CONSULTAS_SEGUNDOS.observar(time.perf_counter() - inicio, estado=resultado[0])
+            yield correo, resultado
+        if not faltantes:
+            return
+        for correo, resultado in resolver_lote(faltantes, (IMAP_USER, IMAP_PASS), "code"):
+            cache_resultados.guardar((correo, "code"), resultado, ttl_por_estado)
+            CONSULTAS_SEGUNDOS.observar(time.perf_counter() - inicio, estado=resultado[0])
+            yield correo, resultado
+
+def texto_resultado_lote(estado, valor):
+    """
+    Texto corto del resultado de una cuenta en una consulta en lote.
+    """
+    if estado == "ok":
+        return f"✅ {valor}"
+    if estado == "error":
+        return valor
+    if estado == "sin_resultado":
+        return "❌ No se pudo obtener el código activo."
+    return "— Sin solicitud pendiente."
+
+def resolver_web(correo_usuario, accion):
+    """
+    Igual que resolver_con_cache, pero ejecutado en el pool de trabajos compartido con el webhook,
+    para que la web también respete el límite de búsquedas simultáneas.
+    """
+    try:
+        futuro = pool_trabajos.enviar(lambda: resolver_con_cache(correo_usuario, accion, "web"), grupo=correo_usuario.lower())
+        return futuro.result(timeout=WEB_TIMEOUT_CONSULTA)
+    except ColaLlena:
+        logging.warning(f"WEB: Cola de trabajos llena. Rechazando la consulta de {correo_usuario}.")
+        return ("error", "⏳ El servicio está muy ocupado en este momento. Intenta de nuevo en unos segundos."), False
+    except FuturesTimeoutError:
+        logging.error(f"WEB: La consulta de {accion} para {correo_usuario} superó {WEB_TIMEOUT_CONSULTA} segundos.")
+        return ("error", "⚠️ La consulta está tardando demasiado. Intenta de nuevo en unos momentos."), False
+
+def resolver_lote_web(correos_usuario):
+    """
+    Igual que resolver_lote_con_cache, pero ejecutado en el pool de trabajos compartido (como resolver_web).
+    Encola la consulta al llamarla (lanza ColaLlena si no hay lugar) y retorna un generador que entrega los
+    resultados a medida que el trabajo los produce; lo que no llegue en WEB_TIMEOUT_CONSULTA sale como error.
+    """
+    resultados = queue.Queue()
+
+    def consultar():
+        try:
+            for par in resolver_lote_con_cache(correos_usuario, "web"):
+                resultados.put(par)
+        finally:
+            resultados.put(None)
+
+    pool_trabajos.enviar(consultar)
+
+    def entregar():
+        pendientes = dict.fromkeys(correo.lower() for correo in correos_usuario)
+        limite = time.monotonic() + WEB_TIMEOUT_CONSULTA
+        while pendientes:
+            try:
+                par = resultados.get(timeout=max(0, limite - time.monotonic()))
+            except queue.Empty:
+                logging.error(f"WEB: La consulta en lote superó {WEB_TIMEOUT_CONSULTA} segundos ({len(pendientes)} correos sin resultado).")
+                for correo in pendientes:
+                    yield correo, ("error", "⚠️ La consulta está tardando demasiado. Intenta de nuevo en unos momentos.")
+                return
+            if par is None:
+                # El trabajo terminó sin dar todos los resultados (falló con una excepción)
+                for correo in pendientes:
+                    yield correo, ("error", "⚠️ Error inesperado al acceder al correo.")
+                return
+            pendientes.pop(par[0], None)
+            yield par
+
+    return entregar()
 
 # =====================
 # Rutas de la aplicación web (Flask)
@@ -79,6 +245,50 @@ def home():
     """Renderiza la página principal con el formulario."""
     return render_template('index.html')
 
+@app.route('/salud')
+def salud():
+    """Endpoint para el ping de Render / UptimeRobot: solo confirma que el proceso responde."""
+    return "Bot y Web activos", 200
+
+@app.route('/estado_cola')
+def estado_cola():
+    """Expone la profundidad de la cola de trabajos (esperando, ejecutando, capacidad)."""
+    return jsonify(pool_trabajos.profundidad())
+
+@app.route('/metrics')
+def metricas():
+    """Métricas de latencia por etapa, aciertos de caché/índice y estado de la cola, en formato Prometheus."""
+    return Response(registro_metricas.exportar(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/consultar_lote', methods=['POST'])
+def consultar_lote_web():
+    """
+    Códigos de varias cuentas a la vez (uno por línea). Los resultados se envían a medida que aparecen.
+    """
+    correos = list(dict.fromkeys(c.lower() for c in request.form.get('correos', '').replace(',', ' ').split()))
+    if not correos:
+        return render_template('result.html', status="error", message="❌ Por favor, ingresa al menos un correo.")
+    if len(correos) > LOTE_MAX_CORREOS:
+        return render_template('result.html', status="error", message=f"❌ Máximo {LOTE_MAX_CORREOS} correos por consulta.")
+
+    autorizados = [c for c in correos if es_correo_autorizado(c)]
+    no_autorizados = [c for c in correos if c not in autorizados]
+    logging.info(f"WEB: Consulta en lote de {len(autorizados)} correos ({len(no_autorizados)} no autorizados).")
+
+    try:
+        lote = resolver_lote_web(autorizados)
+    except ColaLlena:
+        logging.warning("WEB: Cola de trabajos llena. Rechazando la consulta en lote.")
+        return render_template('result.html', status="error", message="⏳ El servicio está muy ocupado en este momento. Intenta de nuevo en unos segundos.")
+
+    def resultados():
+        for correo in no_autorizados:
+            yield correo, "error", "⚠️ Correo no autorizado."
+        for correo, (estado, valor) in lote:
+            yield correo, estado, texto_resultado_lote(estado, valor)
+
+    return stream_template('lote.html', total=len(correos), resultados=resultados())
+
 @app.route('/consultar_accion', methods=['POST'])
 def consultar_accion_web():
     user_email_input = request.form.get('email', '').strip()
@@ -93,72 +303,55 @@ def consultar_accion_web():
         # LÍNEA CORREGIDA: Mensaje genérico para cualquier dominio no autorizado
         return render_template('result.html', status="error", message="⚠️ Correo no autorizado. Por favor, usa un correo que esté registrado en nuestra lista de cuentas autorizadas.")
 
-    if not IMAP_USER or not IMAP_PASS:
-        logging.error("WEB: E-MAIL_USER o EMAIL_PASS no definidos. La funcionalidad de lectura de correos no es válida.")
+    if not buzones_de(user_email_input):
+        logging.error(f"WEB: Sin buzón IMAP para {user_email_input} (E-MAIL_USER o EMAIL_PASS no definidos y sin buzón propio en cuentas.json).")
         return render_template('result.html', status="error", message="❌ Error interno del servidor: La configuración de lectura de correos no es válida. Contacta al administrador del servicio.")
 
     # Lógica para obtener el código o confirmar el hogar
     if action == 'code':
-        asunto_clave = "Código de acceso temporal de Netflix" # Asunto para códigos
-        logging.info(f"WEB: Solicitud de código para {user_email_input}. Buscando en {IMAP_USER} correo con asunto: '{asunto_clave}'")
+        logging.info(f"WEB: Solicitud de código para {user_email_input}. Buscando en {len(buzones_de(user_email_input))} buzón(es) correo con asunto: '{regla('code').asunto}'")
         
-        html_correo, error = buscar_ultimo_correo(IMAP_USER, IMAP_PASS, asunto_clave) 
+        (estado, valor), _ = resolver_web(user_email_input, 'code')
         
-        if error:
-            logging.error(f"WEB: Error al buscar correo para código: {error}")
-            return render_template('result.html', status="error", message=error)
-
-        link = extraer_link_con_token_o_confirmacion(html_correo, es_hogar=False) 
-        if link:
-            codigo_final = obtener_codigo_de_pagina(link)
-            if codigo_final:
-                logging.info(f"WEB: Código obtenido: {codigo_final}")
-                return render_template('result.html', status="success", message=f"✅ Tu código de Netflix es: <strong>{codigo_final}</strong>.<br>Úsalo en tu TV o dispositivo.")
-            else:
-                logging.warning("WEB: Se encontró el enlace de código, pero no se pudo extraer el código de la página de Netflix.")
-                return render_template('result.html', status="warning", message="No se pudo obtener el código activo para esta cuenta.")
+        if estado == "error":
+            logging.error(f"WEB: Error al buscar correo para código: {valor}")
+            return render_template('result.html', status="error", message=valor)
+
+        if estado == "ok":
+            logging.info(f"WEB: Código obtenido: {valor}")
+            return render_template('result.html', status="success", message=f"✅ Tu código de Netflix es: <strong>{valor}</strong>.<br>Úsalo en tu TV o dispositivo.")
+        elif estado == "sin_resultado":
+            logging.warning("WEB: Se encontró el enlace de código, pero no se pudo extraer el código de la página de Netflix.")
+            return render_template('result.html', status="warning", message="No se pudo obtener el código activo para esta cuenta.")
         else:
             logging.warning("WEB: No se encontró enlace de código de Netflix en el correo principal.")
             return render_template('result.html', status="warning", message="No se encontró ninguna solicitud pendiente para esta cuenta.")
 
     elif action == 'hogar':
-        # ASUNTO FLEXIBLE Y ACTUALIZADO: Buscamos una parte constante del asunto para "Actualizar Hogar"
-        asunto_parte_clave = "Importante: Cómo actualizar tu Hogar con Netflix" 
-        logging.info(f"WEB: Solicitud de hogar para {user_email_input}. Buscando en {IMAP_USER} correo que contenga: '{asunto_parte_clave}'")
+        logging.info(f"WEB: Solicitud de hogar para {user_email_input}. Buscando en {len(buzones_de(user_email_input))} buzón(es) correo con asunto: '{regla('hogar').asunto}'")
         
-        html_correo, error = buscar_ultimo_correo(IMAP_USER, IMAP_PASS, asunto_parte_clave) 
+        # Obtenemos el enlace del botón rojo "Sí, la envié yo" del correo y luego el del botón negro "Confirmar actualización"
+        (estado, enlace_final_confirmacion), calculado_aqui = resolver_web(user_email_input, 'hogar')
         
-        if error:
-            logging.error(f"WEB: Error al buscar correo para hogar: {error}")
-            return render_template('result.html', status="error", message=error)
+        if estado == "error":
+            logging.error(f"WEB: Error al buscar correo para hogar: {enlace_final_confirmacion}")
+            return render_template('result.html', status="error", message=enlace_final_confirmacion)
 
-        # Primero extraemos el enlace del botón rojo "Sí, la envié yo" del correo inicial
-        link_boton_rojo = extraer_link_con_token_o_confirmacion(html_correo, es_hogar=True)
-        
-        if link_boton_rojo:
-            logging.info(f"WEB: Enlace del botón rojo 'Sí, la envié yo' encontrado: {link_boton_rojo}. Intentando obtener enlace final de confirmación...")
+        if estado == "ok":
+            # *** CAMBIO CLAVE AQUÍ: MUESTRA EL ENLACE DIRECTAMENTE EN LA WEB ***
+            mensaje_web = f"✅ Solicitud de Hogar procesada. Por favor, **HAZ CLIC INMEDIATAMENTE** en este enlace para confirmar la actualización:<br><br><strong><a href='{enlace_final_confirmacion}' target='_blank'>{enlace_final_confirmacion}</a></strong><br><br>⚠️ Este enlace vence muy rápido. Si ya lo has usado o ha pasado mucho tiempo, es posible que debas solicitar una nueva actualización en tu TV."
+            
+            # Opcional: También enviamos a Telegram como backup o notificación extra (una sola vez por resolución, no en cada acierto de caché)
+            if bot and ADMIN_TELEGRAM_ID and calculado_aqui:
+                mensaje_telegram_admin = f"🚨 NOTIFICACIÓN DE HOGAR NETFLIX (WEB) 🚨\n\nEl usuario **{user_email_input}** ha solicitado actualizar el Hogar Netflix.\n\nEl enlace también se mostró en la web. Si el usuario no puede acceder, **HAZ CLIC INMEDIATAMENTE AQUÍ**:\n{enlace_final_confirmacion}\n\n⚠️ Este enlace vence muy rápido."
+                cola_telegram.alerta_admin(mensaje_telegram_admin, parse_mode='Markdown')
+                logging.info(f"WEB: Enlace de hogar final encolado para el admin por Telegram (adicional) para {user_email_input}.")
             
-            # NUEVA LLAMADA: Visitamos el enlace del botón rojo y extraemos el enlace del botón negro "Confirmar actualización"
-            enlace_final_confirmacion = obtener_enlace_confirmacion_final_hogar(link_boton_rojo)
-
-            if enlace_final_confirmacion:
-                # *** CAMBIO CLAVE AQUÍ: MUESTRA EL ENLACE DIRECTAMENTE EN LA WEB ***
-                mensaje_web = f"✅ Solicitud de Hogar procesada. Por favor, **HAZ CLIC INMEDIATAMENTE** en este enlace para confirmar la actualización:<br><br><strong><a href='{enlace_final_confirmacion}' target='_blank'>{enlace_final_confirmacion}</a></strong><br><br>⚠️ Este enlace vence muy rápido. Si ya lo has usado o ha pasado mucho tiempo, es posible que debas solicitar una nueva actualización en tu TV."
-                
-                # Opcional: También enviamos a Telegram como backup o notificación extra
-                if bot and ADMIN_TELEGRAM_ID:
-                    mensaje_telegram_admin = f"🚨 NOTIFICACIÓN DE HOGAR NETFLIX (WEB) 🚨\n\nEl usuario **{user_email_input}** ha solicitado actualizar el Hogar Netflix.\n\nEl enlace también se mostró en la web. Si el usuario no puede acceder, **HAZ CLIC INMEDIATAMENTE AQUÍ**:\n{enlace_final_confirmacion}\n\n⚠️ Este enlace vence muy rápido."
-                    try:
-                        bot.send_message(ADMIN_TELEGRAM_ID, mensaje_telegram_admin, parse_mode='Markdown')
-                        logging.info(f"WEB: Enlace de hogar final enviado al admin por Telegram (adicional) para {user_email_input}.")
-                    except Exception as e:
-                        logging.error(f"WEB: Error al enviar notificación ADICIONAL por Telegram: {e}")
-                
-                return render_template('result.html', status="success", message=mensaje_web)
-
-            else:
-                logging.warning("WEB: No se pudo extraer el enlace de confirmación final del botón negro.")
-                return render_template('result.html', status="warning", message="❌ No se pudo obtener el enlace de confirmación final. El formato de la página de Netflix puede haber cambiado. Contacta al administrador si persiste.")
+            return render_template('result.html', status="success", message=mensaje_web)
+
+        elif estado == "sin_resultado":
+            logging.warning("WEB: No se pudo extraer el enlace de confirmación final del botón negro.")
+            return render_template('result.html', status="warning", message="❌ No se pudo obtener el enlace de confirmación final. El formato de la página de Netflix puede haber cambiado. Contacta al administrador si persiste.")
         else:
             logging.warning("WEB: No se encontró el enlace del botón 'Sí, la envié yo' en el correo principal.")
             return render_template('result.html', status="warning", message="No se encontró ninguna solicitud pendiente para esta cuenta.")
@@ -179,7 +372,19 @@ if bot:
         if request.headers.get('content-type') == 'application/json':
             json_str = request.get_data().decode("utf-8")
             update = telebot.types.Update.de_json(json_str)
-            bot.process_new_updates([update])
+            # Respondemos a Telegram enseguida y procesamos en segundo plano; si tardáramos, Telegram reintentaría
+            # y procesaríamos la misma actualización dos veces. Por eso se deduplica por update_id: en el almacén
+            # (entre todos los workers del servidor) y en el pool (dentro del proceso, también sin almacén)
+            if not almacen_correos.reclamar_actualizacion(update.update_id):
+                logging.info(f"TELEGRAM: Actualización {update.update_id} ya atendida por otro proceso.")
+                return "", 200
+            chat_id = update.message.chat.id if update.message else None
+            try:
+                pool_trabajos.enviar(lambda: bot.process_new_updates([update]), grupo=chat_id, id_unico=update.update_id)
+            except ColaLlena:
+                logging.warning(f"TELEGRAM: Cola de trabajos llena. Rechazando la actualización {update.update_id}.")
+                if chat_id is not None:
+                    cola_telegram.enviar(chat_id, "⏳ El servicio está muy ocupado en este momento. Intenta de nuevo en unos segundos.")
             return "", 200 # Respuesta exitosa para Telegram
         else:
             logging.warning("TELEGRAM: Encabezado Content-Type incorrecto en la solicitud del webhook.")
@@ -190,112 +395,117 @@ if bot:
         """
         Maneja el comando /code para obtener un código de Netflix vía Telegram.
         """
-        if not IMAP_USER or not IMAP_PASS:
-            bot.reply_to(message, "❌ Error: La lectura de correos no está configurada en el servidor. Contacta al administrador.")
-            return
-
-        bot.reply_to(message, "TELEGRAM: Buscando correo de código, por favor espera unos momentos...")
+        cola_telegram.responder(message, "TELEGRAM: Buscando correo de código, por favor espera unos momentos...")
         partes = message.text.split()
         if len(partes) != 2:
-            bot.reply_to(message, "❌ Uso: /code tu_correo_netflix@dgplayk.com")
+            cola_telegram.responder(message, "❌ Uso: /code tu_correo_netflix@dgplayk.com")
             return
 
         correo_busqueda = partes[1].lower()
         if not es_correo_autorizado(correo_busqueda):
              # Mantenemos el mensaje genérico aquí para no confundir al usuario
-             bot.reply_to(message, "⚠️ Correo no autorizado para esta acción.")
+             cola_telegram.responder(message, "⚠️ Correo no autorizado para esta acción.")
              return
+
+        if not buzones_de(correo_busqueda):
+            cola_telegram.responder(message, "❌ Error: La lectura de correos no está configurada en el servidor. Contacta al administrador.")
+            return
         
-        asunto_clave = "Código de acceso temporal de Netflix" # Asunto para códigos
-        html_correo, error = buscar_ultimo_correo(IMAP_USER, IMAP_PASS, asunto_clave) 
+        (estado, valor), _ = resolver_con_cache(correo_busqueda, 'code', "telegram")
 
-        if error:
-            bot.reply_to(message, error)
+        if estado == "error":
+            cola_telegram.responder(message, valor)
             return
 
-        link = extraer_link_con_token_o_confirmacion(html_correo, es_hogar=False) 
-        if link:
-            codigo_final = obtener_codigo_de_pagina(link)
-            if codigo_final:
-                bot.reply_to(message, f"✅ TELEGRAM: Tu código de Netflix es: `{codigo_final}`")
-            else:
-                bot.reply_to(message, "❌ TELEGRAM: No se pudo obtener el código activo para esta cuenta.")
+        if estado == "ok":
+            cola_telegram.responder(message, f"✅ TELEGRAM: Tu código de Netflix es: `{valor}`")
+        elif estado == "sin_resultado":
+            cola_telegram.responder(message, "❌ TELEGRAM: No se pudo obtener el código activo para esta cuenta.")
         else:
-            bot.reply_to(message, "❌ TELEGRAM: No se encontró ninguna solicitud pendiente para esta cuenta.")
+            cola_telegram.responder(message, "❌ TELEGRAM: No se encontró ninguna solicitud pendiente para esta cuenta.")
 
     @bot.message_handler(commands=["hogar"])
     def manejar_hogar_telegram(message):
         """
         Maneja el comando /hogar para notificar al administrador con el enlace de confirmación.
         """
-        if not IMAP_USER or not IMAP_PASS:
-            bot.reply_to(message, "❌ Error: La lectura de correos no está configurada en el servidor. Contacta al administrador.")
-            return
-
-        bot.reply_to(message, "TELEGRAM: Buscando correo de hogar, por favor espera unos momentos...")
+        cola_telegram.responder(message, "TELEGRAM: Buscando correo de hogar, por favor espera unos momentos...")
         partes = message.text.split()
         if len(partes) != 2:
-            bot.reply_to(message, "❌ Uso: /hogar tu_correo_netflix@dgplayk.com")
+            cola_telegram.responder(message, "❌ Uso: /hogar tu_correo_netflix@dgplayk.com")
             return
 
         correo_busqueda = partes[1].lower()
         if not es_correo_autorizado(correo_busqueda):
             # Mantenemos el mensaje genérico aquí para no confundir al usuario
-            bot.reply_to(message, "⚠️ Correo no autorizado para esta acción.")
+            cola_telegram.responder(message, "⚠️ Correo no autorizado para esta acción.")
             return
 
-        # ASUNTO FLEXIBLE Y ACTUALIZADO: Buscamos una parte constante del asunto para "Actualizar Hogar"
-        asunto_parte_clave = "Importante: Cómo actualizar tu Hogar con Netflix" 
-        html_correo, error = buscar_ultimo_correo(IMAP_USER, IMAP_PASS, asunto_parte_clave) 
-
-        if error:
-            bot.reply_to(message, error)
+        if not buzones_de(correo_busqueda):
+            cola_telegram.responder(message, "❌ Error: La lectura de correos no está configurada en el servidor. Contacta al administrador.")
             return
 
-        link_boton_rojo = extraer_link_con_token_o_confirmacion(html_correo, es_hogar=True)
+        # El asunto (y sus variantes) de cada acción está en reglas.py
+        (estado, enlace_final_confirmacion), calculado_aqui = resolver_con_cache(correo_busqueda, 'hogar', "telegram")
+
+        if estado == "error":
+            cola_telegram.responder(message, enlace_final_confirmacion)
+            return
         
-        if link_boton_rojo:
-            logging.info(f"TELEGRAM: Enlace del botón rojo 'Sí, la envié yo' encontrado: {link_boton_rojo}. Intentando obtener enlace final de confirmación...")
+        if estado == "ok":
+            # *** CAMBIO CLAVE AQUÍ: EN EL COMANDO TELEGRAM, MUESTRA EL ENLACE DIRECTAMENTE EN EL CHAT ***
+            mensaje_telegram_usuario = f"🏠 Solicitud de Hogar procesada. Por favor, **HAZ CLIC INMEDIATAMENTE** en este enlace para confirmar la actualización:\n{enlace_final_confirmacion}\n\n⚠️ Este enlace vence muy rápido. Si ya lo has usado o ha pasado mucho tiempo, es posible que debas solicitar una nueva actualización en tu TV."
             
-            enlace_final_confirmacion = obtener_enlace_confirmacion_final_hogar(link_boton_rojo)
-
-            if enlace_final_confirmacion:
-                # *** CAMBIO CLAVE AQUÍ: EN EL COMANDO TELEGRAM, MUESTRA EL ENLACE DIRECTAMENTE EN EL CHAT ***
-                mensaje_telegram_usuario = f"🏠 Solicitud de Hogar procesada. Por favor, **HAZ CLIC INMEDIATAMENTE** en este enlace para confirmar la actualización:\n{enlace_final_confirmacion}\n\n⚠️ Este enlace vence muy rápido. Si ya lo has usado o ha pasado mucho tiempo, es posible que debas solicitar una nueva actualización en tu TV."
-                
-                # Opcional: También enviamos a Telegram del admin como backup o notificación extra (si es diferente al usuario que inició el comando)
-                # Si el usuario que usa el comando /hogar es el ADMIN_TELEGRAM_ID, no hace falta enviar dos veces.
-                # Considerar si quieres que el ADMIN_TELEGRAM_ID sea diferente al ID de los usuarios autorizados.
-                if ADMIN_TELEGRAM_ID and str(message.from_user.id) != ADMIN_TELEGRAM_ID:
-                    mensaje_telegram_admin = f"🚨 NOTIFICACIÓN DE HOGAR NETFLIX (TELEGRAM) 🚨\n\nEl usuario **{correo_busqueda}** ha solicitado actualizar el Hogar Netflix.\n\nEl enlace también se mostró al usuario. Si el usuario no puede acceder, **HAZ CLIC INMEDIATAMENTE AQUÍ**:\n{enlace_final_confirmacion}\n\n⚠️ Este enlace vence muy rápido."
-                    try:
-                        bot.send_message(ADMIN_TELEGRAM_ID, mensaje_telegram_admin, parse_mode='Markdown')
-                        logging.info(f"TELEGRAM: Enlace de hogar final enviado al admin por Telegram (adicional) para {correo_busqueda}.")
-                    except Exception as e:
-                        logging.error(f"TELEGRAM: Error al enviar notificación ADICIONAL por Telegram: {e}")
-                
-                bot.reply_to(message, mensaje_telegram_usuario, parse_mode='Markdown')
-
-            else:
-                logging.warning("TELEGRAM: No se pudo extraer el enlace de confirmación final del botón negro.")
-                bot.reply_to(message, "❌ TELEGRAM: No se pudo obtener el enlace de confirmación final. El formato de la página puede haber cambiado.")
+            # Opcional: También enviamos a Telegram del admin como backup o notificación extra (si es diferente al usuario que inició el comando)
+            # Si el usuario que usa el comando /hogar es el ADMIN_TELEGRAM_ID, no hace falta enviar dos veces.
+            # Considerar si quieres que el ADMIN_TELEGRAM_ID sea diferente al ID de los usuarios autorizados.
+            # Solo se avisa una vez por resolución, no en cada acierto de caché.
+            if ADMIN_TELEGRAM_ID and str(message.from_user.id) != ADMIN_TELEGRAM_ID and calculado_aqui:
+                mensaje_telegram_admin = f"🚨 NOTIFICACIÓN DE HOGAR NETFLIX (TELEGRAM) 🚨\n\nEl usuario **{correo_busqueda}** ha solicitado actualizar el Hogar Netflix.\n\nEl enlace también se mostró al usuario. Si el usuario no puede acceder, **HAZ CLIC INMEDIATAMENTE AQUÍ**:\n{enlace_final_confirmacion}\n\n⚠️ Este enlace vence muy rápido."
+                cola_telegram.alerta_admin(mensaje_telegram_admin, parse_mode='Markdown')
+                logging.info(f"TELEGRAM: Enlace de hogar final encolado para el admin por Telegram (adicional) para {correo_busqueda}.")
+            
+            cola_telegram.responder(message, mensaje_telegram_usuario, parse_mode='Markdown')
+
+        elif estado == "sin_resultado":
+            logging.warning("TELEGRAM: No se pudo extraer el enlace de confirmación final del botón negro.")
+            cola_telegram.responder(message, "❌ TELEGRAM: No se pudo obtener el enlace de confirmación final. El formato de la página puede haber cambiado.")
         else:
-            bot.reply_to(message, "❌ TELEGRAM: No se encontró ninguna solicitud pendiente para esta cuenta.")
+            cola_telegram.responder(message, "❌ TELEGRAM: No se encontró ninguna solicitud pendiente para esta cuenta.")
+
+    @bot.message_handler(commands=["codes"])
+    def manejar_codes_telegram(message):
+        """
+        Maneja el comando /codes: busca de una vez los códigos de todas las cuentas registradas para el ID
+        y los va enviando a medida que aparecen.
+        """
+        correos = registro_cuentas.correos_de(message.from_user.id)
+        if not correos:
+            cola_telegram.responder(message, "⚠️ No hay correos registrados para tu ID.")
+            return
+        if len(correos) > LOTE_MAX_CORREOS:
+            cola_telegram.responder(message, f"⚠️ Tienes {len(correos)} correos; se consultan los primeros {LOTE_MAX_CORREOS}.")
+            correos = correos[:LOTE_MAX_CORREOS]
+
+        cola_telegram.responder(message, f"TELEGRAM: Buscando los códigos de {len(correos)} cuentas. Te los envío a medida que aparezcan...")
+        lineas, ultimo_envio = [], time.monotonic()
+        for correo, (estado, valor) in resolver_lote_con_cache(correos, "telegram"):
+            lineas.append(f"{correo}: {texto_resultado_lote(estado, valor)}")
+            if time.monotonic() - ultimo_envio >= LOTE_INTERVALO_TELEGRAM:
+                cola_telegram.responder(message, "\n".join(lineas))
+                lineas, ultimo_envio = [], time.monotonic()
+        if lineas:
+            cola_telegram.responder(message, "\n".join(lineas))
 
     @bot.message_handler(commands=["cuentas"])
     def mostrar_correos_telegram(message):
         """
         Maneja el comando /cuentas para mostrar los correos autorizados.
         """
-        todos = []
-        user_id = str(message.from_user.id)
-        if user_id in cuentas and isinstance(cuentas[user_id], list):
-            for entrada in cuentas[user_id]:
-                correo = entrada.split("|")[0] if "|" in entrada else entrada
-                todos.append(correo)
+        todos = registro_cuentas.correos_de(message.from_user.id)
 
-        texto = "📋 Correos registrados para tu ID:\n" + "\n".join(sorted(list(set(todos)))) if todos else "⚠️ No hay correos registrados para tu ID."
-        bot.reply_to(message, texto)
+        texto = "📋 Correos registrados para tu ID:\n" + "\n".join(todos) if todos else "⚠️ No hay correos registrados para tu ID."
+        cola_telegram.responder(message, texto)
 
 else: # Si no hay BOT_TOKEN, la ruta del webhook debe devolver 200 OK para evitar errores de Render.
     @app.route(f"/{os.getenv('BOT_TOKEN', 'dummy_token')}", methods=["POST"])
@@ -307,8 +517,12 @@ else: # Si no hay BOT_TOKEN, la ruta del webhook debe devolver 200 OK para evita
 # Inicio de la aplicación Flask
 # =====================
 
+# En producción la app se sirve con servidor.py (gunicorn, varios procesos e hilos); esto es solo para desarrollo.
 if __name__ == "__main__":
-    mantener_vivo() # Para asegurar que Render mantenga la app viva
+    iniciar_servicios()
     port = int(os.environ.get("PORT", 8080))
-    logging.info(f"Iniciando Flask app en el puerto {port}")
-    app.run(host="0.0.0.0", port=port)
+    logging.info(f"Iniciando Flask app (servidor de desarrollo) en el puerto {port}")
+    try:
+        app.run(host="0.0.0.0", port=port, threaded=True)
+    finally:
+        detener_servicios(timeout=30)
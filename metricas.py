@@ -0,0 +1,343 @@
+import os
+import copy
+import json
+import math
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Métricas en formato de texto de Prometheus (expuestas en /metrics de main.app), sin dependencias externas.
+# Cada consulta fija su canal (web / telegram) y acción (code / hogar) con contexto_consulta(); las etapas
+# medidas dentro de ella (IMAP, extracción, página de Netflix) heredan esas etiquetas, también en los hilos
+# que se lancen con contextvars.copy_context() (ver busqueda_multibuzon.py).
+#
+# Con varios procesos (servidor.py) cada uno cuenta lo suyo: si METRICAS_DIR apunta a un directorio compartido,
+# cada proceso vuelca ahí sus valores cada METRICAS_INTERVALO_VOLCADO segundos y /metrics, lo atienda el
+# proceso que sea, suma los contadores e histogramas de todos. Los medidores (valores instantáneos, como la
+# profundidad de la cola) no se suman: salen uno por proceso vivo con la etiqueta proceso (el pid).
+
+METRICAS_DIR = os.getenv("METRICAS_DIR", "")  # vacío = solo las métricas del proceso que responde
+METRICAS_INTERVALO_VOLCADO = float(os.getenv("METRICAS_INTERVALO_VOLCADO", "5"))
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+_contexto = contextvars.ContextVar("metricas_contexto", default={"canal": "ninguno", "accion": "ninguna"})
+
+
+@contextmanager
+def contexto_consulta(canal, accion):
+    """
+    Etiqueta con canal y acción todas las métricas registradas dentro del bloque.
+    """
+    token = _contexto.set({"canal": canal, "accion": accion})
+    try:
+        yield
+    finally:
+        _contexto.reset(token)
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _formatear_etiquetas(nombres, valores, extra=""):
+    partes = [f'{nombre}="{_escapar(valor)}"' for nombre, valor in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+def _proceso_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _formatear_numero(valor):
+    if valor == math.inf:
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def _clave(self, etiquetas):
+        # Las etiquetas canal/accion que no se pasan explícitamente salen del contexto de la consulta
+        contexto = _contexto.get()
+        return tuple(str(etiquetas[n]) if n in etiquetas else contexto.get(n, "") for n in self.etiquetas)
+
+    def instantanea(self):
+        """
+        Copia de las series en una forma que se puede guardar como JSON: [[etiquetas, valor], ...].
+        """
+        with self._lock:
+            return [[list(clave), copy.deepcopy(valor)] for clave, valor in self._series.items()]
+
+    def combinar(self, instantaneas):
+        """
+        Suma varias instantáneas (una por proceso) en un solo diccionario de series.
+        """
+        series = {}
+        for instantanea in instantaneas:
+            for clave, valor in instantanea:
+                clave = tuple(clave)
+                series[clave] = self._sumar(series[clave], valor) if clave in series else valor
+        return series
+
+    def exportar(self, series=None):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        if series is None:
+            with self._lock:
+                series = copy.deepcopy(self._series)
+        lineas += [linea for clave, valor in sorted(series.items()) for linea in self._lineas(clave, valor)]
+        return lineas
+
+
+class Contador(_Metrica):
+    tipo = "counter"
+
+    def inc(self, cantidad=1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._series[clave] = self._series.get(clave, 0) + cantidad
+
+    @staticmethod
+    def _sumar(valor, otro):
+        return valor + otro
+
+    def _lineas(self, clave, valor):
+        return [f"{self.nombre}{_formatear_etiquetas(self.etiquetas, clave)} {_formatear_numero(valor)}"]
+
+
+class Histograma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observar(self, valor, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = [[0] * len(self.buckets), 0.0, 0]  # conteos por bucket, suma, total
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie[0][i] += 1
+                    break
+            serie[1] += valor
+            serie[2] += 1
+
+    @staticmethod
+    def _sumar(serie, otra):
+        return [[a + b for a, b in zip(serie[0], otra[0])], serie[1] + otra[1], serie[2] + otra[2]]
+
+    def _lineas(self, clave, serie):
+        conteos, suma, total = serie
+        lineas, acumulado = [], 0
+        for limite, conteo in zip(self.buckets, conteos):
+            acumulado += conteo
+            le = f'le="{_formatear_numero(limite)}"'
+            lineas.append(f"{self.nombre}_bucket{_formatear_etiquetas(self.etiquetas, clave, le)} {acumulado}")
+        etiquetas = _formatear_etiquetas(self.etiquetas, clave)
+        lineas.append(f"{self.nombre}_sum{etiquetas} {_formatear_numero(suma)}")
+        lineas.append(f"{self.nombre}_count{etiquetas} {total}")
+        return lineas
+
+    @contextmanager
+    def medir(self, **etiquetas):
+        """
+        Observa la duración del bloque en segundos (también si termina con una excepción).
+        """
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **etiquetas)
+
+
+class Medidor(_Metrica):
+    """
+    Valor instantáneo calculado al exportar: funcion() retorna un número o {valor_etiqueta: número}.
+    """
+    tipo = "gauge"
+
+    def __init__(self, nombre, ayuda, funcion, etiqueta=None):
+        super().__init__(nombre, ayuda, (etiqueta,) if etiqueta else ())
+        self.funcion = funcion
+
+    def instantanea(self):
+        valores = self.funcion()
+        if not isinstance(valores, dict):
+            valores = {None: valores}
+        return sorted(([valor_etiqueta, valor] for valor_etiqueta, valor in valores.items()), key=lambda par: str(par[0]))
+
+    def exportar(self, por_proceso=None):
+        """
+        Sin por_proceso, el valor de este proceso; con una lista de (pid, instantanea), una serie por proceso.
+        """
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        if por_proceso is None:
+            por_proceso = [(None, self.instantanea())]
+        for pid, instantanea in por_proceso:
+            extra = f'proceso="{pid}"' if pid is not None else ""
+            for valor_etiqueta, valor in instantanea:
+                etiquetas = _formatear_etiquetas(self.etiquetas, (valor_etiqueta,) if self.etiquetas else (), extra)
+                lineas.append(f"{self.nombre}{etiquetas} {_formatear_numero(valor)}")
+        return lineas
+
+
+class RegistroMetricas:
+    def __init__(self, directorio=METRICAS_DIR, intervalo_volcado=METRICAS_INTERVALO_VOLCADO):
+        self.directorio = directorio
+        self.intervalo_volcado = intervalo_volcado
+        self._metricas = []
+        self._lock = threading.Lock()
+        self._hilo_volcado = None
+        self._parar_volcado = threading.Event()
+
+    def registrar(self, metrica):
+        with self._lock:
+            self._metricas.append(metrica)
+        return metrica
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        return self.registrar(Contador(nombre, ayuda, etiquetas))
+
+    def histograma(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        return self.registrar(Histograma(nombre, ayuda, etiquetas, buckets))
+
+    def medidor(self, nombre, ayuda, funcion, etiqueta=None):
+        return self.registrar(Medidor(nombre, ayuda, funcion, etiqueta))
+
+    def volcar(self):
+        """
+        Escribe los valores de este proceso en METRICAS_DIR (un archivo por pid, reemplazado de una vez).
+        """
+        if not self.directorio:
+            return
+        with self._lock:
+            metricas = list(self._metricas)
+        datos = {"series": {}, "medidores": {}}
+        for metrica in metricas:
+            try:
+                datos["medidores" if isinstance(metrica, Medidor) else "series"][metrica.nombre] = metrica.instantanea()
+            except Exception as e:
+                logging.error(f"METRICAS: No se pudo leer {metrica.nombre}: {e}")
+        ruta = os.path.join(self.directorio, f"{os.getpid()}.json")
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            with open(ruta + ".tmp", "w") as archivo:
+                json.dump(datos, archivo)
+            os.replace(ruta + ".tmp", ruta)
+        except OSError as e:
+            logging.error(f"METRICAS: No se pudieron volcar las métricas en {self.directorio}: {e}")
+
+    def _volcados(self):
+        # Los de procesos ya terminados también cuentan: sus contadores no deben desaparecer del total
+        volcados = []
+        for nombre in os.listdir(self.directorio):
+            if not nombre.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directorio, nombre)) as archivo:
+                    volcados.append((int(nombre[:-len(".json")]), json.load(archivo)))
+            except (OSError, ValueError):
+                continue
+        return volcados
+
+    def _bucle_volcado(self):
+        while not self._parar_volcado.wait(self.intervalo_volcado):
+            self.volcar()
+
+    def iniciar_volcado(self):
+        """
+        Arranca el volcado periódico de este proceso (llamar en cada proceso, después del fork).
+        """
+        if not self.directorio or (self._hilo_volcado and self._hilo_volcado.is_alive()):
+            return
+        self._parar_volcado.clear()
+        self._hilo_volcado = threading.Thread(target=self._bucle_volcado, name="metricas-volcado", daemon=True)
+        self._hilo_volcado.start()
+
+    def detener_volcado(self):
+        """
+        Detiene el volcado periódico dejando escritos los últimos valores del proceso.
+        """
+        self._parar_volcado.set()
+        self.volcar()
+
+    def exportar(self):
+        """
+        Texto en el formato de exposición de Prometheus (text/plain; version=0.0.4).
+        """
+        with self._lock:
+            metricas = list(self._metricas)
+        volcados = None
+        if self.directorio:
+            self.volcar()
+            volcados = self._volcados()
+        lineas = []
+        for metrica in metricas:
+            try:
+                if volcados is None:
+                    lineas += metrica.exportar()
+                elif isinstance(metrica, Medidor):
+                    lineas += metrica.exportar([(pid, datos["medidores"].get(metrica.nombre, [])) for pid, datos in sorted(volcados, key=lambda par: par[0]) if _proceso_vivo(pid)])
+                else:
+                    lineas += metrica.exportar(metrica.combinar(datos["series"].get(metrica.nombre, []) for _, datos in volcados))
+            except Exception as e:
+                lineas.append(f"# ERROR {metrica.nombre}: {_escapar(e)}")
+        return "\n".join(lineas) + "\n"
+
+
+registro_metricas = RegistroMetricas()
+
+# Métricas del pipeline de /code y /hogar
+CONSULTAS_SEGUNDOS = registro_metricas.histograma(
+    "netflix_consulta_segundos", "Duración total de una consulta de código u hogar.", ("canal", "accion", "estado"))
+ETAPAS_SEGUNDOS = registro_metricas.histograma(
+    "netflix_etapa_segundos", "Duración de cada etapa de una consulta (login/búsqueda/fetch IMAP, extracción, página de Netflix).",
+    ("canal", "accion", "etapa"))
+MENSAJES_REVISADOS = registro_metricas.contador(
+    "netflix_mensajes_revisados_total", "Correos cuyas cabeceras se descargaron para clasificarlos.", ("canal", "accion"))
+ACIERTOS = registro_metricas.contador(
+    "netflix_aciertos_total", "Aciertos y fallos de la caché de resultados, el índice del vigilante y el pool IMAP.",
+    ("canal", "accion", "fuente", "resultado"))
+EXTRACCIONES = registro_metricas.contador(
+    "netflix_extracciones_total", "Extracciones de enlaces del correo según la vía que dio el resultado.", ("canal", "accion", "via"))
+
+
+def medir_etapa(etapa):
+    """
+    Atajo para ETAPAS_SEGUNDOS.medir(etapa=...).
+    """
+    return ETAPAS_SEGUNDOS.medir(etapa=etapa)
+
+# Métricas de la cola de salida de Telegram (cola_telegram.py)
+TELEGRAM_ENTREGA_SEGUNDOS = registro_metricas.histograma(
+    "telegram_entrega_segundos", "Tiempo desde que un mensaje se encola hasta que Telegram lo acepta (incluye reintentos).", ("tipo",))
+TELEGRAM_ENVIOS = registro_metricas.contador(
+    "telegram_envios_total", "Intentos de envío a Telegram según su resultado (ok / reintento / descartado).", ("tipo", "resultado"))
+
+# Métricas del aviso proactivo (aviso_proactivo.py)
+AVISO_LATENCIA_SEGUNDOS = registro_metricas.histograma(
+    "aviso_latencia_segundos", "Tiempo desde la llegada del correo (cabecera Date) hasta encolar el aviso con el resultado.",
+    ("accion", "estado"), buckets=(1, 2.5, 5, 10, 20, 30, 60, 120, 300, 900))
+AVISOS = registro_metricas.contador(
+    "avisos_total", "Correos procesados por el aviso proactivo según su resultado.", ("accion", "resultado"))
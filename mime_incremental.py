@@ -0,0 +1,121 @@
+import os
+import logging
+from email.feedparser import BytesFeedParser
+from protocolo_imap import decodificar_parte
+
+# Lectura incremental de un correo MIME crudo, por bloques, para sacar solo su primer cuerpo text/html.
+# A diferencia de email.message_from_bytes no arma el árbol completo del mensaje: las cabeceras de cada
+# parte se leen con el FeedParser de la librería estándar, los cuerpos que no interesan (adjuntos, texto
+# plano, imágenes) se saltan línea a línea sin guardarlos, y la lectura termina apenas se cierra la
+# parte HTML o se supera MIME_MAX_BYTES.
+
+MIME_MAX_BYTES = int(os.getenv("MIME_MAX_BYTES", str(5 * 1024 * 1024)))  # bytes leídos como máximo por correo
+MIME_TAMANO_BLOQUE = int(os.getenv("MIME_TAMANO_BLOQUE", str(64 * 1024)))  # bytes por FETCH parcial
+
+
+class LectorHTML:
+    """
+    Se alimenta con alimentar(bloque) hasta que retorna True (ya se tiene el HTML, o se superó el límite)
+    o hasta que no quedan datos; luego cerrar() y el resultado queda en .html (o None).
+    """
+
+    def __init__(self, max_bytes=MIME_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.leidos = 0
+        self.html = None
+        self.terminado = False
+        self.excedido = False
+        self._pendiente = b""  # última línea incompleta del bloque anterior
+        self._estado = "cabeceras"  # cabeceras / saltar / html
+        self._cabeceras = BytesFeedParser()
+        self._limites = []  # delimitadores ("--" + boundary) de los multipart abiertos, del más externo al más interno
+        self._parte_html = None  # (codificación, charset) de la parte HTML que se está leyendo
+        self._cuerpo = []
+
+    def alimentar(self, datos):
+        if self.terminado:
+            return True
+        self.leidos += len(datos)
+        if self.leidos > self.max_bytes:
+            logging.warning(f"MIME: El correo supera {self.max_bytes} bytes sin una parte HTML completa. Se deja de leer.")
+            self.excedido = self.terminado = True
+            return True
+        lineas = (self._pendiente + datos).split(b"\n")
+        self._pendiente = lineas.pop()
+        for linea in lineas:
+            self._linea(linea + b"\n")
+            if self.terminado:
+                break
+        return self.terminado
+
+    def cerrar(self):
+        """
+        Fin de los datos: un correo que es solo text/html termina sin delimitador.
+        """
+        if not self.terminado:
+            if self._pendiente:
+                self._linea(self._pendiente)
+                self._pendiente = b""
+            if self._estado == "html":
+                self._terminar_html()
+        self.terminado = True
+        return self.html
+
+    def _linea(self, linea):
+        if self._estado == "cabeceras":
+            self._cabeceras.feed(linea)
+            if linea in (b"\r\n", b"\n"):
+                self._empezar_parte(self._cabeceras.close())
+            return
+
+        limite = self._limite(linea)
+        if limite is not None:
+            delimitador, es_cierre = limite
+            if self._estado == "html":
+                self._terminar_html()
+                return
+            # Cierra los multipart anidados que hayan quedado abiertos dentro de este
+            del self._limites[self._limites.index(delimitador) + (0 if es_cierre else 1):]
+            if es_cierre:
+                self._estado = "saltar"  # epílogo del multipart: se ignora hasta el delimitador de afuera
+            else:
+                self._estado = "cabeceras"
+                self._cabeceras = BytesFeedParser()
+        elif self._estado == "html":
+            self._cuerpo.append(linea)
+
+    def _limite(self, linea):
+        if not self._limites or not linea.startswith(b"--"):
+            return None
+        linea = linea.rstrip()
+        for delimitador in reversed(self._limites):
+            if linea == delimitador:
+                return delimitador, False
+            if linea == delimitador + b"--":
+                return delimitador, True
+        return None
+
+    def _empezar_parte(self, parte):
+        tipo = parte.get_content_type()
+        if parte.get_content_maintype() == "multipart" and parte.get_boundary():
+            self._limites.append(b"--" + parte.get_boundary().encode("utf-8", errors="replace"))
+            self._estado = "saltar"  # preámbulo hasta el primer delimitador
+        elif tipo == "text/html" and "attachment" not in str(parte.get("Content-Disposition", "")).lower():
+            self._parte_html = (parte.get("Content-Transfer-Encoding"), parte.get_content_charset())
+            self._estado = "html"
+        else:
+            self._estado = "saltar"
+            if not self._limites:
+                self.terminado = True  # correo de una sola parte que no es HTML
+
+    def _terminar_html(self):
+        cuerpo = b"".join(self._cuerpo)
+        # El salto de línea antes del delimitador pertenece al delimitador (RFC 2046)
+        if cuerpo.endswith(b"\r\n"):
+            cuerpo = cuerpo[:-2]
+        elif cuerpo.endswith(b"\n"):
+            cuerpo = cuerpo[:-1]
+        codificacion, charset = self._parte_html
+        self.html = decodificar_parte(cuerpo, codificacion, charset)
+        self._cuerpo = []
+        self.terminado = True
@@ -0,0 +1,764 @@
+import os
+import re
+import ssl
+import time
+import asyncio
+import imaplib
+import hashlib
+import logging
+import threading
+import contextvars
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import aiohttp  # en requirements.txt; sin aiohttp las páginas se piden con cliente_http en hilos (ver ClienteHTTPAsync)
+except ImportError:
+    aiohttp = None
+
+from cliente_http import (obtener_pagina, USER_AGENT, HTTP_POOL_CONEXIONES, HTTP_TIMEOUT_CONEXION, HTTP_TIMEOUT_LECTURA,
+                          HTTP_REINTENTOS, HTTP_BACKOFF)
+from conexiones_imap import IMAP_HOST, IMAP_PUERTO, IMAP_SSL, IMAP_TIMEOUT, IMAP_POOL_MAX_POR_CUENTA, IMAP_POOL_MAX_INACTIVIDAD, IMAP_POOL_INTERVALO_NOOP
+from funciones import (DIAS_BUSQUEDA_IMAP, BUSQUEDA_INCREMENTAL, _construir_criterios_busqueda, _valor_por_prefijo,
+                       _items_cabeceras, _cabeceras_de_respuesta, _clasificar_cabeceras,
+                       _decodificar_asunto, _direcciones_destinatario, _fecha_de, extraer_link_con_token_o_confirmacion,
+                       codigo_de_pagina, confirmacion_de_pagina)
+from protocolo_imap import parsear_respuesta_fetch, buscar_parte_html, decodificar_parte
+from mime_incremental import LectorHTML, MIME_MAX_BYTES, MIME_TAMANO_BLOQUE
+from indice_correos import indice_correos
+from estado_buzones import estados_buzones
+from almacen_correos import almacen_correos
+from reglas import ASUNTO_BUSQUEDA, MENSAJE_SIN_CORREO, clasificar, regla
+from metricas import ACIERTOS, MENSAJES_REVISADOS, medir_etapa
+
+# Motor asyncio (opcional, MOTOR_ASYNC=1) del pipeline de /code y /hogar: buscar el correo, extraer el enlace y
+# visitar la página de Netflix. Un solo hilo con un bucle de eventos atiende todas las consultas en curso: IMAP
+# con un cliente mínimo sobre asyncio streams (las respuestas se interpretan con protocolo_imap), HTTP con aiohttp
+# si está instalado, y el parseo (cabeceras, MIME, BeautifulSoup) en un pool de hilos aparte. Cada operación
+# tiene su timeout y una consulta vencida se cancela entera. Las rutas de Flask y los handlers de telebot lo usan
+# con el adaptador síncrono motor_async.resolver_accion, igual que funciones.resolver_accion.
+# La búsqueda es la misma que la síncrona: el estado incremental de estado_buzones (y su copia en almacen_correos)
+# si BUSQUEDA_INCREMENTAL, la vigencia de las reglas y la búsqueda de respaldo si el servidor no acepta CHARSET UTF-8.
+
+MOTOR_ASYNC = os.getenv("MOTOR_ASYNC", "0") == "1"
+MOTOR_HILOS_PARSEO = int(os.getenv("MOTOR_HILOS_PARSEO", "4"))
+MOTOR_HILOS_HTTP = int(os.getenv("MOTOR_HILOS_HTTP", "4"))  # páginas pedidas a la vez sin aiohttp
+MOTOR_TIMEOUT_IMAP = float(os.getenv("MOTOR_TIMEOUT_IMAP", str(IMAP_TIMEOUT)))  # segundos por comando IMAP
+MOTOR_TIMEOUT_HTTP = float(os.getenv("MOTOR_TIMEOUT_HTTP", str(HTTP_TIMEOUT_CONEXION + HTTP_TIMEOUT_LECTURA)))  # segundos por página
+MOTOR_TIMEOUT_CONSULTA = float(os.getenv("MOTOR_TIMEOUT_CONSULTA", "90"))  # segundos por consulta completa (adaptador síncrono)
+MOTOR_MENSAJES_REVISAR = 50
+
+_LITERAL = re.compile(rb"\{(\d+)\}$")
+_CODIGO_RESPUESTA = re.compile(rb"^\[([A-Z-]+)(?: ([^\]]*))?\]")
+
+
+def _citar(texto):
+    return '"' + texto.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+class ClienteIMAPAsync:
+    """
+    Cliente IMAP mínimo sobre asyncio streams, un comando a la vez. Las respuestas tienen la misma forma que
+    las de imaplib (bytes y tuplas (prefijo, literal)), así protocolo_imap las interpreta igual.
+    """
+
+    def __init__(self, lector, escritor):
+        self._lector = lector
+        self._escritor = escritor
+        self._tag = 0
+        self.usado = time.monotonic()
+        self.capabilities = ()
+        self._anuncios = {}  # códigos de respuestas "* OK [CODIGO valor]" aún no leídos (como imaplib)
+
+    @classmethod
+    async def conectar(cls, host=IMAP_HOST, timeout=MOTOR_TIMEOUT_IMAP):
+        puerto = IMAP_PUERTO or (imaplib.IMAP4_SSL_PORT if IMAP_SSL else imaplib.IMAP4_PORT)
+        contexto = ssl.create_default_context() if IMAP_SSL else None
+        lector, escritor = await asyncio.wait_for(asyncio.open_connection(host, puerto, ssl=contexto, limit=1024 * 1024), timeout)
+        cliente = cls(lector, escritor)
+        try:
+            saludo = await asyncio.wait_for(cliente._leer_linea(), timeout)
+            if not saludo.startswith(b"* OK"):
+                raise imaplib.IMAP4.error(f"Saludo inesperado del servidor: {saludo!r}")
+            cliente._anotar_codigo(saludo[5:])
+            capacidades = cliente._anuncios.pop("CAPABILITY", None)
+            if capacidades is None:
+                capacidades = (await cliente._exigir("CAPABILITY", timeout=timeout)).get(b"CAPABILITY", [b""])
+            cliente.capabilities = tuple(capacidades[-1].decode("ascii", errors="replace").upper().split())
+        except BaseException:
+            cliente.abortar()
+            raise
+        return cliente
+
+    def _anotar_codigo(self, texto):
+        encontrado = _CODIGO_RESPUESTA.match(texto)
+        if encontrado:
+            self._anuncios.setdefault(encontrado.group(1).decode("ascii"), []).append(encontrado.group(2) or b"")
+
+    def anunciado(self, codigo):
+        """
+        Como imaplib mail.response(codigo): los valores anunciados con ese código desde la última lectura.
+        """
+        return self._anuncios.pop(codigo, [])
+
+    async def _leer_linea(self):
+        try:
+            linea = await self._lector.readuntil(b"\r\n")
+        except asyncio.IncompleteReadError:
+            raise imaplib.IMAP4.abort("Conexión cerrada por el servidor.")
+        return linea[:-2]
+
+    async def _leer_respuesta(self):
+        """
+        Una respuesta completa con sus literales. Retorna (primera_linea, tipo_o_None, datos al estilo imaplib).
+        """
+        linea = await self._leer_linea()
+        tipo, texto = None, linea
+        if linea.startswith(b"* "):
+            partes = linea[2:].split(b" ", 2)
+            if partes[0].isdigit() and len(partes) > 1:
+                tipo, texto = partes[1].upper(), b" ".join([partes[0]] + partes[2:])  # "* 3 FETCH (...)" -> "3 (...)"
+            else:
+                tipo, texto = partes[0].upper(), b" ".join(partes[1:])
+        datos = []
+        encontrado = _LITERAL.search(texto)
+        while encontrado:
+            try:
+                literal = await self._lector.readexactly(int(encontrado.group(1)))
+            except asyncio.IncompleteReadError:
+                raise imaplib.IMAP4.abort("Conexión cerrada por el servidor en medio de un literal.")
+            datos.append((texto, literal))
+            texto = await self._leer_linea()
+            encontrado = _LITERAL.search(texto)
+        if texto or not datos:
+            datos.append(texto)
+        return linea, tipo, datos
+
+    async def comando(self, *partes, literal=None):
+        """
+        Envía un comando y lee hasta su respuesta etiquetada. Retorna (estado, {tipo: datos}, línea final).
+        Con literal, lo envía como último argumento ({n} y espera la continuación "+").
+        """
+        self._tag += 1
+        tag = f"M{self._tag:04d}".encode()
+        linea = tag + b" " + b" ".join(p if isinstance(p, bytes) else str(p).encode() for p in partes)
+        if literal is not None:
+            linea += b" {" + str(len(literal)).encode() + b"}"
+        self._escritor.write(linea + b"\r\n")
+        await self._escritor.drain()
+
+        respuestas = {}
+        esperando_continuacion = literal is not None
+        while True:
+            primera, tipo, datos = await self._leer_respuesta()
+            if esperando_continuacion and primera.startswith(b"+"):
+                esperando_continuacion = False
+                self._escritor.write(literal + b"\r\n")
+                await self._escritor.drain()
+            elif primera.startswith(tag + b" "):
+                estado = primera[len(tag) + 1:].split(b" ", 1)[0].decode("ascii", errors="replace").upper()
+                return estado, respuestas, primera.decode("utf-8", errors="replace")
+            elif tipo:
+                respuestas.setdefault(tipo, []).extend(datos)
+                if tipo == b"OK" and isinstance(datos[0], bytes):
+                    self._anotar_codigo(datos[0])  # ej. "* OK [UIDVALIDITY 3857529045]" al hacer SELECT
+
+    async def _exigir(self, *partes, timeout=MOTOR_TIMEOUT_IMAP):
+        estado, respuestas, final = await asyncio.wait_for(self.comando(*partes), timeout)
+        if estado != "OK":
+            raise imaplib.IMAP4.error(final.split(" ", 2)[-1])
+        return respuestas
+
+    async def login(self, usuario, contrasena):
+        await self._exigir("LOGIN", _citar(usuario), _citar(contrasena))
+
+    async def select(self, buzon):
+        await self._exigir("SELECT", buzon)
+
+    async def status(self, buzon, items):
+        estado, respuestas, _ = await asyncio.wait_for(self.comando("STATUS", buzon, items), MOTOR_TIMEOUT_IMAP)
+        return estado, respuestas.get(b"STATUS", [])
+
+    async def noop(self, timeout=5):
+        await self._exigir("NOOP", timeout=timeout)
+
+    async def uid(self, comando, *argumentos, literal=None, timeout=MOTOR_TIMEOUT_IMAP):
+        """
+        Equivalente a imaplib mail.uid(comando, ...): retorna (estado, datos de las respuestas de ese tipo).
+        Como imaplib, un BAD lanza IMAP4.error y un NO retorna el texto del servidor como datos.
+        """
+        estado, respuestas, final = await asyncio.wait_for(self.comando("UID", comando, *argumentos, literal=literal), timeout)
+        texto = final.split(" ", 2)[-1]
+        if estado == "BAD":
+            raise imaplib.IMAP4.error(f"UID command error: BAD [{texto.encode()!r}]")
+        if estado != "OK":
+            return estado, [texto.encode()]
+        return estado, respuestas.get(comando.upper().encode(), [])
+
+    def abortar(self):
+        # Sin LOGOUT: tras una cancelación o un error la conexión puede haber quedado a mitad de una respuesta
+        self._escritor.close()
+
+    async def cerrar(self):
+        try:
+            await asyncio.wait_for(self.comando("LOGOUT"), 2)
+        except Exception:
+            pass
+        self.abortar()
+
+
+class PoolIMAPAsync:
+    """
+    Sesiones IMAP autenticadas y con el buzón seleccionado, por credenciales, como conexiones_imap.PoolIMAP
+    pero para el bucle del motor: a lo sumo max_por_cuenta comandos en curso por cuenta, el resto espera.
+    """
+
+    def __init__(self, host=IMAP_HOST, buzon="inbox", max_por_cuenta=IMAP_POOL_MAX_POR_CUENTA,
+                 max_inactividad=IMAP_POOL_MAX_INACTIVIDAD, intervalo_noop=IMAP_POOL_INTERVALO_NOOP):
+        self.host = host
+        self.buzon = buzon
+        self.max_por_cuenta = max_por_cuenta
+        self.max_inactividad = max_inactividad
+        self.intervalo_noop = intervalo_noop
+        self._libres = {}  # clave -> lista de ClienteIMAPAsync
+        self._limites = {}  # clave -> asyncio.Semaphore
+
+    def _clave(self, usuario, contrasena):
+        return (self.host, usuario.lower(), hashlib.sha256(contrasena.encode("utf-8")).hexdigest())
+
+    async def _tomar_libre(self, clave):
+        libres = self._libres.get(clave, [])
+        while libres:
+            cliente = libres.pop()
+            inactivo = time.monotonic() - cliente.usado
+            if inactivo > self.max_inactividad:
+                await cliente.cerrar()
+                continue
+            if inactivo > self.intervalo_noop:
+                try:
+                    await cliente.noop()
+                except Exception as e:
+                    logging.info(f"MOTOR: Sesión IMAP inactiva descartada tras NOOP fallido: {e}")
+                    cliente.abortar()
+                    continue
+            return cliente
+        return None
+
+    @asynccontextmanager
+    async def sesion(self, usuario, contrasena):
+        clave = self._clave(usuario, contrasena)
+        limite = self._limites.setdefault(clave, asyncio.Semaphore(self.max_por_cuenta))
+        async with limite:
+            cliente = await self._tomar_libre(clave)
+            ACIERTOS.inc(fuente="pool_imap", resultado="acierto" if cliente else "fallo")
+            if cliente is None:
+                logging.info(f"MOTOR: Abriendo nueva sesión IMAP para {usuario} en {self.host}...")
+                with medir_etapa("imap_login"):
+                    cliente = await ClienteIMAPAsync.conectar(self.host)
+                    try:
+                        await cliente.login(usuario, contrasena)
+                        await cliente.select(self.buzon)
+                    except BaseException:
+                        cliente.abortar()
+                        raise
+            try:
+                yield cliente
+            except BaseException:
+                cliente.abortar()  # también si se canceló la consulta: la respuesta pudo quedar a medias
+                raise
+            cliente.usado = time.monotonic()
+            self._libres.setdefault(clave, []).append(cliente)
+
+    async def cerrar_todo(self):
+        libres, self._libres = self._libres, {}
+        for clientes in libres.values():
+            for cliente in clientes:
+                await cliente.cerrar()
+
+
+class ClienteHTTPAsync:
+    """
+    GET de las páginas de Netflix. Con aiohttp: un conector keep-alive compartido y una sesión (cookies) por
+    petición, con los mismos timeouts y reintentos que cliente_http. Sin aiohttp: cliente_http en un pool de
+    MOTOR_HILOS_HTTP hilos propio, para no ocupar los del parseo ni el ejecutor por defecto del bucle.
+    """
+
+    def __init__(self):
+        self._conector = None
+        self._ejecutor = None
+
+    async def obtener(self, url, headers=None):
+        """
+        Retorna (html, url_final) siguiendo redirecciones; lanza excepción en errores de red o HTTP.
+        """
+        if aiohttp is None:
+            if self._ejecutor is None:
+                logging.warning(f"MOTOR: aiohttp no está instalado. Las páginas de Netflix se piden con cliente_http en {MOTOR_HILOS_HTTP} hilos.")
+                self._ejecutor = ThreadPoolExecutor(max_workers=MOTOR_HILOS_HTTP, thread_name_prefix="motor-http")
+            respuesta = await asyncio.get_running_loop().run_in_executor(self._ejecutor, lambda: obtener_pagina(url, headers=headers))
+            respuesta.raise_for_status()
+            return respuesta.text, respuesta.url
+
+        if self._conector is None:
+            self._conector = aiohttp.TCPConnector(limit_per_host=HTTP_POOL_CONEXIONES)
+        timeout = aiohttp.ClientTimeout(sock_connect=HTTP_TIMEOUT_CONEXION, sock_read=HTTP_TIMEOUT_LECTURA)
+        for intento in range(HTTP_REINTENTOS + 1):
+            ultimo = intento == HTTP_REINTENTOS
+            try:
+                async with aiohttp.ClientSession(connector=self._conector, connector_owner=False, timeout=timeout,
+                                                 headers={"User-Agent": USER_AGENT}) as sesion:
+                    async with sesion.get(url, headers=headers, allow_redirects=True) as respuesta:
+                        if respuesta.status not in (500, 502, 503, 504) or ultimo:
+                            respuesta.raise_for_status()
+                            return await respuesta.text(), str(respuesta.url)
+            except aiohttp.ClientConnectorError:
+                # Como cliente_http: se reintenta la conexión, nunca una lectura cortada (puede haber consumido el token)
+                if ultimo:
+                    raise
+            await asyncio.sleep(HTTP_BACKOFF * (2 ** intento))
+
+    async def cerrar(self):
+        if self._conector is not None:
+            await self._conector.close()
+            self._conector = None
+        if self._ejecutor is not None:
+            self._ejecutor.shutdown(wait=False)
+            self._ejecutor = None
+
+
+def _candidatos(cabeceras, accion, correo_destinatario):
+    """
+    UIDs (de más reciente a más antiguo) de las cabeceras que son de la acción, van al destinatario y siguen
+    dentro de la vigencia de la regla; el mismo filtro que la búsqueda completa de funciones._buscar_en_sesion.
+    """
+    correo = correo_destinatario.lower()
+    uids = [uid for uid, mensaje in cabeceras.items()
+            if clasificar(_decodificar_asunto(mensaje)) == accion and correo in _direcciones_destinatario(mensaje)
+            and regla(accion).vigente(_fecha_de(mensaje))]
+    return sorted(uids, key=int, reverse=True)
+
+
+def _parte_html(datos, uid):
+    estructura = parsear_respuesta_fetch(datos).get(uid, {}).get("BODYSTRUCTURE")
+    return buscar_parte_html(estructura) if estructura else None
+
+
+def _decodificar_seccion(datos, uid, seccion, codificacion, charset):
+    contenido = _valor_por_prefijo(parsear_respuesta_fetch(datos).get(uid, {}), f"BODY[{seccion}]")
+    return decodificar_parte(contenido, codificacion, charset) if contenido is not None else None
+
+
+def _bloque(datos, uid):
+    return _valor_por_prefijo(parsear_respuesta_fetch(datos).get(uid, {}), "BODY[]")
+
+
+class MotorAsync:
+    """
+    Pipeline async de /code y /hogar y su adaptador síncrono. El bucle de eventos corre en un hilo propio que se
+    crea con la primera consulta (y no al importar), así sobrevive a un fork del servidor.
+    """
+
+    def __init__(self, hilos_parseo=MOTOR_HILOS_PARSEO):
+        self.hilos_parseo = hilos_parseo
+        self.pool = None
+        self.http = None
+        self._lock = threading.Lock()
+        self._loop = None
+        self._hilo = None
+        self._pid = None
+        self._ejecutor = None
+        self._locks = {}  # clave del buzón -> asyncio.Lock de su sincronización
+        self._hilos_buzon = {}  # clave del buzón -> ejecutor de un hilo que toma su RLock y toca su estado
+
+    # --- Adaptador síncrono ---
+
+    def _asegurar_bucle(self):
+        with self._lock:
+            if self._loop is not None and self._pid == os.getpid() and self._hilo.is_alive():
+                return self._loop
+            self._loop = asyncio.new_event_loop()
+            self._ejecutor = ThreadPoolExecutor(max_workers=self.hilos_parseo, thread_name_prefix="motor-parseo")
+            self.pool = PoolIMAPAsync()
+            self.http = ClienteHTTPAsync()
+            self._locks = {}
+            self._hilos_buzon = {}
+            self._hilo = threading.Thread(target=self._correr, args=(self._loop,), name="motor-async", daemon=True)
+            self._hilo.start()
+            self._pid = os.getpid()
+            logging.info(f"MOTOR: Bucle asyncio iniciado (HTTP con {'aiohttp' if aiohttp else 'cliente_http en hilos'}).")
+            return self._loop
+
+    @staticmethod
+    def _correr(loop):
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+        loop.close()
+
+    def ejecutar(self, corrutina, timeout=MOTOR_TIMEOUT_CONSULTA):
+        """
+        Corre la corrutina en el bucle del motor y espera su resultado desde código síncrono. Si pasa el timeout
+        se cancela (con sus comandos IMAP y peticiones HTTP en curso) y se lanza TimeoutError. Las etiquetas de
+        métricas del hilo que llama (metricas.contexto_consulta) pasan a la corrutina.
+        """
+        futuro = asyncio.run_coroutine_threadsafe(corrutina, self._asegurar_bucle())
+        try:
+            return futuro.result(timeout)
+        except TimeoutError:
+            futuro.cancel()
+            raise
+
+    def resolver_accion(self, buzones, asunto_parte_clave, correo_destinatario, accion, timeout=MOTOR_TIMEOUT_CONSULTA):
+        """
+        Mismo contrato que funciones.resolver_accion, resuelto en el motor async (el asunto sale de reglas.py).
+        """
+        try:
+            return self.ejecutar(self.resolver_accion_async(buzones, correo_destinatario, accion), timeout)
+        except TimeoutError:
+            logging.error(f"MOTOR: La consulta de {accion} para {correo_destinatario} superó {timeout} segundos y se canceló.")
+            return "error", "⚠️ La consulta está tardando demasiado. Intenta de nuevo en unos momentos."
+
+    def detener(self, timeout=5):
+        """
+        Cierra las sesiones IMAP y el conector HTTP del motor y detiene su bucle.
+        """
+        with self._lock:
+            loop, hilo, ejecutor, hilos_buzon = self._loop, self._hilo, self._ejecutor, list(self._hilos_buzon.values())
+            self._loop = None
+        if loop is None or self._pid != os.getpid():
+            return
+
+        async def cerrar():
+            await self.pool.cerrar_todo()
+            await self.http.cerrar()
+        try:
+            asyncio.run_coroutine_threadsafe(cerrar(), loop).result(timeout)
+        except Exception as e:
+            logging.warning(f"MOTOR: No se pudieron cerrar las conexiones del motor: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        hilo.join(timeout)
+        ejecutor.shutdown(wait=False)
+        for hilo_buzon in hilos_buzon:
+            hilo_buzon.shutdown(wait=False)
+
+    # --- Pipeline async ---
+
+    async def _en_hilo(self, funcion, *argumentos):
+        # Parseo fuera del bucle; con el contexto de la consulta para que las métricas lleven sus etiquetas
+        return await asyncio.get_running_loop().run_in_executor(self._ejecutor, contextvars.copy_context().run, funcion, *argumentos)
+
+    async def _html_de_uid(self, cliente, uid):
+        """
+        Como funciones._obtener_html_por_partes: la parte text/html según BODYSTRUCTURE o, si no, el mensaje por bloques.
+        """
+        estado, datos = await cliente.uid("FETCH", uid, "(BODYSTRUCTURE)")
+        parte = await self._en_hilo(_parte_html, datos, uid) if estado == "OK" else None
+        if parte:
+            seccion, codificacion, charset = parte
+            estado, datos = await cliente.uid("FETCH", uid, f"(BODY.PEEK[{seccion}]<0.{MIME_MAX_BYTES}>)")
+            html = await self._en_hilo(_decodificar_seccion, datos, uid, seccion, codificacion, charset) if estado == "OK" else None
+            if html is not None:
+                return html
+            logging.warning(f"MOTOR: No se pudo descargar la parte {seccion} del UID {uid}. Leyendo el mensaje por bloques.")
+
+        lector = LectorHTML()
+        inicio = 0
+        while not lector.terminado:
+            estado, datos = await cliente.uid("FETCH", uid, f"(BODY.PEEK[]<{inicio}.{MIME_TAMANO_BLOQUE}>)")
+            bloque = _bloque(datos, uid) if estado == "OK" else None
+            if not isinstance(bloque, bytes):
+                break
+            await self._en_hilo(lector.alimentar, bloque)
+            if len(bloque) < MIME_TAMANO_BLOQUE:
+                break
+            inicio += len(bloque)
+        return lector.cerrar()
+
+    def _hilo_de(self, estado_buzon):
+        hilo = self._hilos_buzon.get(estado_buzon.clave)
+        if hilo is None:
+            hilo = self._hilos_buzon[estado_buzon.clave] = ThreadPoolExecutor(max_workers=1, thread_name_prefix="motor-buzon")
+        return hilo
+
+    @asynccontextmanager
+    async def _bloquear(self, estado_buzon):
+        """
+        Exclusión de la sincronización de un buzón. El asyncio.Lock ordena las corrutinas del bucle y el RLock del
+        estado, a los hilos que usan funciones (ej. la consulta en lote). El RLock lo toma y lo suelta el hilo propio
+        del buzón (la espera no frena el bucle), y todo lo que toque el estado dentro del bloque corre en ese mismo
+        hilo con _en_buzon: el RLock es de un hilo, en el del bucle o en otro se quedaría esperándose a sí mismo.
+        """
+        async with self._locks.setdefault(estado_buzon.clave, asyncio.Lock()):
+            hilo = self._hilo_de(estado_buzon)
+            tomado = hilo.submit(estado_buzon.lock.acquire)
+            try:
+                # Si la consulta se cancela mientras espera, el acquire igual termina y el release de abajo lo suelta
+                await asyncio.shield(asyncio.wrap_future(tomado))
+                yield
+            finally:
+                hilo.submit(estado_buzon.lock.release)
+
+    async def _en_buzon(self, estado_buzon, funcion, *argumentos):
+        # Dentro de _bloquear: en el hilo que tiene el RLock del buzón, con el contexto de la consulta
+        return await asyncio.get_running_loop().run_in_executor(self._hilo_de(estado_buzon), contextvars.copy_context().run, funcion, *argumentos)
+
+    async def _en_estado(self, estado_buzon, funcion, *argumentos):
+        # Un método del estado fuera de la sincronización: espera a la que esté en curso, sin frenar el bucle
+        async with self._bloquear(estado_buzon):
+            return await self._en_buzon(estado_buzon, funcion, *argumentos)
+
+    async def _buscar_uids_en_servidor(self, cliente, asunto, correo_destinatario, dias_atras):
+        criterios, literal_asunto = _construir_criterios_busqueda(asunto, correo_destinatario, dias_atras)
+        estado, datos = await cliente.uid("SEARCH", *criterios, literal=literal_asunto)
+        if estado != "OK":
+            raise imaplib.IMAP4.error(f"UID SEARCH rechazado por el servidor: {datos}")
+        return datos[0].split() if datos and datos[0] else []
+
+    async def _fetch_cabeceras(self, cliente, conjunto, con_modseq=False, cambiados_desde=None):
+        estado, datos = await cliente.uid("FETCH", conjunto, _items_cabeceras(con_modseq, cambiados_desde))
+        if estado != "OK":
+            raise imaplib.IMAP4.error(f"UID FETCH de cabeceras rechazado: {datos}")
+        return await self._en_hilo(_cabeceras_de_respuesta, datos)
+
+    async def _sincronizar_buzon(self, cliente, estado_buzon, dias_atras):
+        """
+        Mismo flujo que funciones._sincronizar_buzon, sobre el cliente async y con el mismo estado (estado_buzones)
+        y la misma copia en disco (almacen_correos). Se llama con _bloquear tomado: lo que toca el estado (y el
+        almacén, que lo carga) corre con _en_buzon.
+        """
+        condstore = "CONDSTORE" in cliente.capabilities
+        anunciados = [v for v in cliente.anunciado("UIDVALIDITY") if v]
+        uidvalidity = int(anunciados[-1]) if anunciados else None
+        restaurado = False
+        if not estado_buzon.restaurado:
+            estado_buzon.restaurado = True
+            restaurado = await self._en_buzon(estado_buzon, almacen_correos.restaurar, estado_buzon.clave, estado_buzon)
+        if uidvalidity is None and (estado_buzon.uidvalidity is None or restaurado):
+            _, datos = await cliente.status("INBOX", "(UIDVALIDITY)")
+            uidvalidity = int(re.search(rb"UIDVALIDITY (\d+)", datos[0]).group(1))
+        if uidvalidity is not None and uidvalidity != estado_buzon.uidvalidity:
+            if estado_buzon.uidvalidity is not None:
+                logging.warning(f"MOTOR: UIDVALIDITY del buzón cambió ({estado_buzon.uidvalidity} -> {uidvalidity}). Reclasificando.")
+                await self._en_hilo(almacen_correos.olvidar_buzon, estado_buzon.clave)
+            await self._en_buzon(estado_buzon, estado_buzon.reiniciar, uidvalidity)
+
+        if estado_buzon.ultimo_uid is None:
+            _, datos = await cliente.uid("SEARCH", "UID", "*")
+            maximo = max([int(u) for u in (datos[0] if datos else b"").split()] or [0])
+            uids = await self._buscar_uids_en_servidor(cliente, ASUNTO_BUSQUEDA, None, dias_atras)
+            cabeceras, modseq = ({}, None)
+            if uids:
+                conjunto = ",".join(sorted((u.decode() for u in uids), key=int))
+                cabeceras, modseq = await self._fetch_cabeceras(cliente, conjunto, con_modseq=condstore)
+            clasificados = await self._en_buzon(estado_buzon, _clasificar_cabeceras, estado_buzon, cabeceras)
+            await self._en_buzon(estado_buzon, estado_buzon.avanzar, maximo, modseq)
+            await self._en_hilo(almacen_correos.guardar_correos, estado_buzon.clave, estado_buzon.uidvalidity, clasificados)
+            await self._en_hilo(almacen_correos.guardar_marca, estado_buzon.clave, estado_buzon.uidvalidity, estado_buzon.ultimo_uid, estado_buzon.modseq)
+            MENSAJES_REVISADOS.inc(len(cabeceras))
+            logging.info(f"MOTOR: Buzón clasificado: {len(clasificados)} correos de Netflix hasta el UID {maximo}.")
+            return
+
+        marca = estado_buzon.ultimo_uid
+        cabeceras, modseq = await self._fetch_cabeceras(cliente, f"{marca + 1}:*", con_modseq=condstore, cambiados_desde=estado_buzon.modseq)
+        nuevas = {uid: mensaje for uid, mensaje in cabeceras.items() if int(uid) > marca}
+        clasificados = await self._en_buzon(estado_buzon, _clasificar_cabeceras, estado_buzon, nuevas)
+        await self._en_buzon(estado_buzon, estado_buzon.avanzar, max([marca] + [int(uid) for uid in cabeceras]), modseq)
+        await self._en_hilo(almacen_correos.guardar_correos, estado_buzon.clave, estado_buzon.uidvalidity, clasificados)
+        if estado_buzon.ultimo_uid != marca or modseq is not None:
+            await self._en_hilo(almacen_correos.guardar_marca, estado_buzon.clave, estado_buzon.uidvalidity, estado_buzon.ultimo_uid, estado_buzon.modseq)
+        MENSAJES_REVISADOS.inc(len(nuevas))
+
+    async def _candidatos_en_servidor(self, cliente, accion, correo_destinatario, num_mensajes_revisar, dias_atras):
+        """
+        Sin estado incremental: UID SEARCH por destinatario y FETCH de las cabeceras de los últimos candidatos.
+        Si el servidor no acepta la búsqueda (ej. CHARSET UTF-8), se revisan los últimos mensajes del buzón.
+        """
+        try:
+            with medir_etapa("imap_busqueda"):
+                uids = await self._buscar_uids_en_servidor(cliente, ASUNTO_BUSQUEDA, correo_destinatario, dias_atras)
+        except imaplib.IMAP4.abort:
+            raise
+        except imaplib.IMAP4.error as e:
+            logging.warning(f"MOTOR: Búsqueda en el servidor no disponible ({e}). Revisando los últimos {num_mensajes_revisar} mensajes.")
+            with medir_etapa("imap_busqueda"):
+                _, datos = await cliente.uid("SEARCH", "ALL")
+            uids = datos[0].split() if datos and datos[0] else []
+        uids = [uid.decode() for uid in uids][-num_mensajes_revisar:]
+        if not uids:
+            return []
+        with medir_etapa("imap_cabeceras"):
+            cabeceras, _ = await self._fetch_cabeceras(cliente, ",".join(uids))
+        MENSAJES_REVISADOS.inc(len(uids))
+        return await self._en_hilo(_candidatos, cabeceras, accion, correo_destinatario)
+
+    async def _html_de_candidatos(self, cliente, estado_buzon, accion, uids, solo_link=False):
+        """
+        Como funciones._html_de_candidatos: retorna (html, link) del primer UID con HTML; con solo_link y estado,
+        reutiliza el enlace ya extraído de ese correo y guarda el que se extraiga.
+        """
+        for uid in uids:
+            link = await self._en_estado(estado_buzon, estado_buzon.link_de, uid) if solo_link and estado_buzon is not None else None
+            if solo_link and estado_buzon is not None:
+                ACIERTOS.inc(fuente="enlace_guardado", resultado="acierto" if link else "fallo")
+            if link:
+                return None, link
+            with medir_etapa("imap_cuerpo"):
+                html_content = await self._html_de_uid(cliente, str(uid))
+            if html_content:
+                logging.info(f"MOTOR: HTML del correo de '{accion}' (UID {uid}) extraído con éxito.")
+                link = await self._en_hilo(extraer_link_con_token_o_confirmacion, html_content, accion == "hogar") if solo_link else None
+                if link and estado_buzon is not None:
+                    await self._en_estado(estado_buzon, estado_buzon.guardar_link, uid, link)
+                    await self._en_hilo(almacen_correos.guardar_link, estado_buzon.clave, estado_buzon.uidvalidity, uid, link)
+                return html_content, link
+            logging.warning(f"MOTOR: No se pudo extraer contenido HTML del UID {uid}.")
+            if estado_buzon is not None:
+                await self._en_estado(estado_buzon, estado_buzon.descartar, uid)
+        return None, None
+
+    async def _buscar_en_sesion(self, cliente, usuario_imap, accion, correo_destinatario, num_mensajes_revisar, dias_atras, solo_link):
+        """
+        Como funciones._buscar_en_sesion para una acción: el estado incremental del buzón si está disponible
+        y, si no, la búsqueda completa en el servidor. Retorna (html, link).
+        """
+        estado_buzon = estados_buzones.de(self.pool.host, usuario_imap)
+        candidatos = None
+        if BUSQUEDA_INCREMENTAL and not estado_buzon.no_soportado:
+            try:
+                async with self._bloquear(estado_buzon):
+                    with medir_etapa("imap_sincronizacion"):
+                        await self._sincronizar_buzon(cliente, estado_buzon, dias_atras)
+                    candidatos = (await self._en_buzon(estado_buzon, estado_buzon.candidatos, accion, correo_destinatario, dias_atras))[:num_mensajes_revisar]
+            except imaplib.IMAP4.abort:
+                raise
+            except imaplib.IMAP4.error as e:
+                logging.warning(f"MOTOR: Búsqueda incremental no disponible en {usuario_imap} ({e}). Usando la búsqueda completa.")
+                await self._en_estado(estado_buzon, estado_buzon.reiniciar)
+                estado_buzon.no_soportado = True
+        if candidatos is None:
+            estado_buzon = None
+            candidatos = await self._candidatos_en_servidor(cliente, accion, correo_destinatario, num_mensajes_revisar, dias_atras)
+        return await self._html_de_candidatos(cliente, estado_buzon, accion, candidatos, solo_link)
+
+    async def _buscar_correo(self, usuario_imap, contrasena_imap, accion, correo_destinatario, num_mensajes_revisar, dias_atras, solo_link=False):
+        """
+        Retorna (html, link, error), como funciones._buscar_correo.
+        """
+        if not usuario_imap or not contrasena_imap:
+            return None, None, "❌ Error interno: Credenciales IMAP no configuradas."
+        try:
+            async with self.pool.sesion(usuario_imap, contrasena_imap) as cliente:
+                html_content, link = await self._buscar_en_sesion(cliente, usuario_imap, accion, correo_destinatario,
+                                                                  num_mensajes_revisar, dias_atras, solo_link)
+        except TimeoutError:
+            logging.error(f"MOTOR: El servidor IMAP no respondió a tiempo para {usuario_imap}.")
+            return None, None, "⚠️ El servidor de correo no respondió a tiempo. Intenta de nuevo en unos momentos."
+        except imaplib.IMAP4.error as e:
+            logging.error(f"MOTOR: Error de IMAP al acceder al correo {usuario_imap}: {e}.")
+            return None, None, f"⚠️ Error de autenticación o IMAP: {str(e)}. Asegúrate de usar una contraseña de aplicación de Gmail (si tienes 2FA) y que la configuración IMAP esté habilitada."
+        except Exception as e:
+            logging.exception(f"MOTOR: Error inesperado al buscar correo para {usuario_imap}")
+            return None, None, f"⚠️ Error inesperado al acceder al correo: {str(e)}"
+        if html_content or link:
+            return html_content, link, None
+        logging.info(f"MOTOR: No se encontró un correo reciente de '{accion}' para {correo_destinatario}.")
+        return None, None, MENSAJE_SIN_CORREO
+
+    async def buscar_ultimo_correo(self, usuario_imap, contrasena_imap, accion, correo_destinatario,
+                                   num_mensajes_revisar=MOTOR_MENSAJES_REVISAR, dias_atras=DIAS_BUSQUEDA_IMAP):
+        """
+        Versión async de funciones.buscar_ultimo_correo, por acción: retorna (html, None) o (None, mensaje de error).
+        """
+        html_content, _, error = await self._buscar_correo(usuario_imap, contrasena_imap, accion, correo_destinatario,
+                                                           num_mensajes_revisar, dias_atras)
+        return html_content, error
+
+    async def _link_en_buzon(self, usuario_imap, contrasena_imap, correo_destinatario, accion):
+        html_correo, link, error = await self._buscar_correo(usuario_imap, contrasena_imap, accion, correo_destinatario,
+                                                             MOTOR_MENSAJES_REVISAR, DIAS_BUSQUEDA_IMAP, solo_link=True)
+        if error:
+            return None, error
+        if link:
+            return link, None
+        return await self._en_hilo(extraer_link_con_token_o_confirmacion, html_correo, accion == "hogar"), None
+
+    async def obtener_link_en_buzones(self, buzones, correo_destinatario, accion):
+        """
+        Como funciones.obtener_link_en_buzones: el índice del vigilante primero y después todos los buzones a la
+        vez; gana el primero que da un enlace y los demás se cancelan. Retorna (link, None) o (None, error_o_None).
+        """
+        if indice_correos.activo():
+            link = indice_correos.obtener(correo_destinatario, accion)
+            ACIERTOS.inc(fuente="indice", resultado="acierto" if link else "fallo")
+            if link:
+                return link, None
+        if not buzones:
+            return None, "❌ Error interno: Credenciales IMAP no configuradas."
+
+        tareas = [asyncio.create_task(self._link_en_buzon(usuario, contrasena, correo_destinatario, accion)) for usuario, contrasena in buzones]
+        errores = []
+        try:
+            for siguiente in asyncio.as_completed(tareas):
+                try:
+                    link, error = await siguiente
+                except Exception as e:
+                    logging.exception("MOTOR: Error buscando en un buzón")
+                    link, error = None, f"⚠️ Error inesperado al acceder al correo: {str(e)}"
+                if link:
+                    return link, None
+                if error:
+                    errores.append(error)
+        finally:
+            for tarea in tareas:
+                tarea.cancel()
+        errores.sort(key=lambda error: error == MENSAJE_SIN_CORREO)
+        return None, (errores[0] if errores else None)
+
+    async def _visitar(self, url, headers=None):
+        try:
+            with medir_etapa("http_pagina"):
+                return await asyncio.wait_for(self.http.obtener(url, headers=headers), MOTOR_TIMEOUT_HTTP)
+        except TimeoutError:
+            logging.error(f"MOTOR: Tiempo de espera agotado al visitar {url}")
+        except Exception as e:
+            logging.error(f"MOTOR: Error de red al visitar {url}: {e}")
+        return None, None
+
+    async def obtener_codigo_de_pagina(self, url_netflix):
+        """
+        Versión async de funciones.obtener_codigo_de_pagina.
+        """
+        html_pagina, _ = await self._visitar(url_netflix)
+        if html_pagina is None:
+            return None
+        with medir_etapa("parseo_pagina"):
+            return await self._en_hilo(codigo_de_pagina, html_pagina)
+
+    async def obtener_enlace_confirmacion_final_hogar(self, url_boton_rojo):
+        """
+        Versión async de funciones.obtener_enlace_confirmacion_final_hogar.
+        """
+        html_pagina, url_pagina = await self._visitar(url_boton_rojo, headers={'Referer': 'https://www.netflix.com/'})
+        if html_pagina is None:
+            return None
+        with medir_etapa("parseo_pagina"):
+            return await self._en_hilo(confirmacion_de_pagina, html_pagina, url_pagina)
+
+    async def resolver_accion_async(self, buzones, correo_destinatario, accion):
+        """
+        Versión async de funciones.resolver_accion; retorna los mismos (estado, valor).
+        """
+        link, error = await self.obtener_link_en_buzones(buzones, correo_destinatario, accion)
+        if error:
+            return "error", error
+        if not link:
+            return "sin_solicitud", None
+        if accion == "hogar":
+            resultado = await self.obtener_enlace_confirmacion_final_hogar(link)
+        else:
+            resultado = await self.obtener_codigo_de_pagina(link)
+        if not resultado:
+            return "sin_resultado", None
+        return "ok", resultado
+
+
+motor_async = MotorAsync()
@@ -0,0 +1,196 @@
+import re
+import base64
+import quopri
+import logging
+
+# Utilidades para interpretar respuestas FETCH de imaplib (listas con literales y BODYSTRUCTURE),
+# que imaplib entrega sin parsear.
+
+_LITERAL = re.compile(rb"\{(\d+)\}$")
+
+
+def _reconstruir_flujo(datos):
+    """
+    imaplib separa los literales en tuplas (prefijo, literal). Volvemos a armar el texto tal como
+    vino del servidor, guardando los literales aparte para no tener que escaparlos.
+    Retorna (bytes_del_flujo, lista_de_literales); cada literal queda marcado como {n} en el flujo.
+    """
+    partes = []
+    literales = []
+    for item in datos:
+        if isinstance(item, tuple):
+            prefijo, literal = item[0], item[1]
+            prefijo = _LITERAL.sub(b"", prefijo.rstrip())
+            partes.append(prefijo + b" \x00" + str(len(literales)).encode() + b"\x00")
+            literales.append(literal)
+        elif isinstance(item, bytes):
+            partes.append(item + b"\n")
+    return b"".join(partes), literales
+
+
+class _Lector:
+    def __init__(self, flujo, literales):
+        self.flujo = flujo
+        self.literales = literales
+        self.pos = 0
+
+    def _saltar_espacios(self):
+        while self.pos < len(self.flujo) and self.flujo[self.pos] in b" \r\n":
+            self.pos += 1
+
+    def fin(self):
+        self._saltar_espacios()
+        return self.pos >= len(self.flujo)
+
+    def siguiente(self):
+        """
+        Lee el siguiente valor: lista (list), cadena (str), literal (bytes), número o átomo (str) o NIL (None).
+        """
+        self._saltar_espacios()
+        c = self.flujo[self.pos:self.pos + 1]
+        if c == b"(":
+            self.pos += 1
+            lista = []
+            while True:
+                self._saltar_espacios()
+                if self.pos >= len(self.flujo):
+                    return lista
+                if self.flujo[self.pos:self.pos + 1] == b")":
+                    self.pos += 1
+                    return lista
+                lista.append(self.siguiente())
+        if c == b")":
+            # Paréntesis de cierre suelto (imaplib lo deja como elemento aparte tras un literal)
+            self.pos += 1
+            return self.siguiente() if not self.fin() else None
+        if c == b'"':
+            self.pos += 1
+            salida = bytearray()
+            while self.pos < len(self.flujo):
+                b = self.flujo[self.pos]
+                if b == 0x5C:  # barra invertida
+                    salida.append(self.flujo[self.pos + 1])
+                    self.pos += 2
+                    continue
+                if b == 0x22:
+                    self.pos += 1
+                    break
+                salida.append(b)
+                self.pos += 1
+            return salida.decode("utf-8", errors="replace")
+        if c == b"\x00":
+            fin = self.flujo.index(b"\x00", self.pos + 1)
+            indice = int(self.flujo[self.pos + 1:fin])
+            self.pos = fin + 1
+            return self.literales[indice]
+        inicio = self.pos
+        while self.pos < len(self.flujo):
+            b = self.flujo[self.pos:self.pos + 1]
+            if b == b"[":
+                # Dentro de corchetes puede haber espacios y paréntesis: BODY[HEADER.FIELDS (SUBJECT)]
+                self.pos = self.flujo.index(b"]", self.pos) + 1
+                continue
+            if b in (b" ", b"(", b")", b"\r", b"\n", b"\x00"):
+                break
+            self.pos += 1
+        atomo = self.flujo[inicio:self.pos].decode("ascii", errors="replace")
+        return None if atomo.upper() == "NIL" else atomo
+
+
+def parsear_respuesta_fetch(datos):
+    """
+    Convierte la respuesta de mail.uid("FETCH", ...) en un diccionario {uid: {ITEM: valor}}.
+    Los nombres de los ítems se normalizan en mayúsculas y sin el .PEEK (BODY[1], BODYSTRUCTURE, ...).
+    Las respuestas FETCH sin UID (avisos no solicitados de cambios de flags) se ignoran.
+    """
+    flujo, literales = _reconstruir_flujo(datos or [])
+    lector = _Lector(flujo, literales)
+    resultados = {}
+    while not lector.fin():
+        numero = lector.siguiente()
+        if isinstance(numero, list) or numero is None:
+            continue
+        items = lector.siguiente()
+        if not isinstance(items, list):
+            continue
+        valores = {}
+        for i in range(0, len(items) - 1, 2):
+            nombre = str(items[i]).upper().replace(".PEEK", "")
+            valores[nombre] = items[i + 1]
+        uid = valores.get("UID")
+        if uid is not None:
+            resultados[str(uid)] = valores
+    return resultados
+
+
+def _como_texto(valor):
+    if isinstance(valor, bytes):
+        return valor.decode("utf-8", errors="replace")
+    return valor
+
+
+def _parametros(lista):
+    """
+    Convierte una lista de parámetros IMAP ("charset" "utf-8" "name" "x") en diccionario en minúsculas.
+    """
+    if not isinstance(lista, list):
+        return {}
+    return {str(_como_texto(lista[i])).lower(): _como_texto(lista[i + 1]) for i in range(0, len(lista) - 1, 2)}
+
+
+def buscar_parte_html(bodystructure, seccion=""):
+    """
+    Recorre un BODYSTRUCTURE ya parseado y retorna (seccion, codificacion, charset) de la primera
+    parte text/html que no sea adjunto, o None si no hay.
+    """
+    if not isinstance(bodystructure, list) or not bodystructure:
+        return None
+
+    if isinstance(bodystructure[0], list):
+        # multipart: las primeras entradas son las subpartes, luego el subtipo y extensiones
+        numero = 0
+        for subparte in bodystructure:
+            if not isinstance(subparte, list):
+                break
+            numero += 1
+            encontrada = buscar_parte_html(subparte, f"{seccion}.{numero}" if seccion else str(numero))
+            if encontrada:
+                return encontrada
+        return None
+
+    tipo = str(_como_texto(bodystructure[0]) or "").lower()
+    subtipo = str(_como_texto(bodystructure[1]) or "").lower() if len(bodystructure) > 1 else ""
+    if (tipo, subtipo) != ("text", "html"):
+        return None
+
+    parametros = _parametros(bodystructure[2] if len(bodystructure) > 2 else None)
+    codificacion = str(_como_texto(bodystructure[5]) or "7bit").lower() if len(bodystructure) > 5 else "7bit"
+    # Para text/*: 7=líneas, 8=md5, 9=disposición
+    disposicion = bodystructure[9] if len(bodystructure) > 9 else None
+    if isinstance(disposicion, list) and disposicion and str(_como_texto(disposicion[0])).lower() == "attachment":
+        return None
+    if "name" in parametros:
+        return None
+    return (seccion or "1", codificacion, parametros.get("charset") or "utf-8")
+
+
+def decodificar_parte(contenido, codificacion, charset):
+    """
+    Decodifica el cuerpo de una parte MIME según su Content-Transfer-Encoding y charset.
+    """
+    if contenido is None:
+        return None
+    if isinstance(contenido, str):
+        contenido = contenido.encode("utf-8", errors="replace")
+    codificacion = (codificacion or "").lower()
+    try:
+        if codificacion == "base64":
+            contenido = base64.b64decode(re.sub(rb"[^A-Za-z0-9+/=]", b"", contenido))
+        elif codificacion == "quoted-printable":
+            contenido = quopri.decodestring(contenido)
+    except Exception as e:
+        logging.warning(f"No se pudo decodificar la parte ({codificacion}): {e}")
+    try:
+        return contenido.decode(charset or "utf-8", errors="ignore")
+    except LookupError:
+        return contenido.decode("utf-8", errors="ignore")
@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import logging
+import threading
+
+# Registro de cuentas autorizadas (cuentas.json) con tablas de búsqueda ya normalizadas.
+# Formato del archivo: {"id_telegram": ["correo@dominio.com", "correo@dominio.com|user_imap|pass_imap", ...]}
+# Se recarga solo cuando el archivo cambia en disco, sin reiniciar el proceso.
+
+CUENTAS_RUTA = os.getenv("CUENTAS_RUTA", "cuentas.json")
+CUENTAS_INTERVALO_REVISION = float(os.getenv("CUENTAS_INTERVALO_REVISION", "5"))  # segundos entre chequeos del mtime
+
+
+class _Tablas:
+    """
+    Instantánea inmutable de cuentas.json. Se reemplaza entera en cada recarga.
+    """
+
+    def __init__(self, por_correo=None, por_dueno=None):
+        self.por_correo = por_correo or {}  # correo en minúsculas -> {"correo", "duenos", "imap"}
+        self.por_dueno = por_dueno or {}  # id de Telegram -> lista ordenada de correos (como están escritos)
+
+
+def _parsear_entrada(entrada):
+    """
+    Valida una entrada "correo" o "correo|user_imap|pass_imap". Retorna (correo, credenciales_o_None) o None si es inválida.
+    """
+    if not isinstance(entrada, str):
+        return None
+    partes = [parte.strip() for parte in entrada.split("|")]
+    correo = partes[0]
+    if "@" not in correo:
+        return None
+    if len(partes) == 1:
+        return correo, None
+    if len(partes) == 3 and partes[1] and partes[2]:
+        return correo, (partes[1], partes[2])
+    return None
+
+
+def construir_tablas(datos):
+    """
+    Construye las tablas de búsqueda a partir del contenido de cuentas.json, validando cada entrada una sola vez.
+    """
+    por_correo = {}
+    por_dueno = {}
+    if not isinstance(datos, dict):
+        logging.error("❌ cuentas.json debe ser un objeto {id_telegram: [correos]}. Se ignora su contenido.")
+        return _Tablas()
+
+    for dueno, entradas in datos.items():
+        if not isinstance(entradas, list):
+            logging.warning(f"⚠️ cuentas.json: el ID {dueno} no tiene una lista de correos. Se ignora.")
+            continue
+        correos_dueno = {}
+        for entrada in entradas:
+            parseada = _parsear_entrada(entrada)
+            if parseada is None:
+                logging.warning(f"⚠️ cuentas.json: entrada inválida para el ID {dueno}: {str(entrada).split('|')[0]!r}. Se ignora.")
+                continue
+            correo, credenciales = parseada
+            clave = correo.lower()
+            correos_dueno.setdefault(clave, correo)
+            registro = por_correo.setdefault(clave, {"correo": correo, "duenos": set(), "imap": None})
+            registro["duenos"].add(str(dueno))
+            if credenciales and not registro["imap"]:
+                registro["imap"] = credenciales
+        por_dueno[str(dueno)] = sorted(correos_dueno.values())
+
+    for registro in por_correo.values():
+        registro["duenos"] = frozenset(registro["duenos"])
+    return _Tablas(por_correo, por_dueno)
+
+
+class RegistroCuentas:
+    """
+    Acceso thread-safe a las cuentas autorizadas. Las consultas leen una instantánea de las tablas;
+    la recarga construye tablas nuevas aparte y las cambia de una vez, sin bloquear a nadie.
+    """
+
+    def __init__(self, ruta=CUENTAS_RUTA, intervalo_revision=CUENTAS_INTERVALO_REVISION):
+        self.ruta = ruta
+        self.intervalo_revision = intervalo_revision
+        self._tablas = _Tablas()
+        self._firma = None  # (mtime, tamaño) del archivo cargado
+        self._ultima_revision = 0.0
+        self._lock_recarga = threading.Lock()
+
+    def _firma_archivo(self):
+        try:
+            estado = os.stat(self.ruta)
+        except FileNotFoundError:
+            return None
+        return (estado.st_mtime_ns, estado.st_size)
+
+    def cargar(self):
+        """
+        Lee cuentas.json y reemplaza las tablas. Si el archivo tiene JSON inválido, se mantienen las anteriores.
+        """
+        firma = self._firma_archivo()
+        try:
+            with open(self.ruta, "r") as archivo:
+                datos = json.load(archivo)
+        except FileNotFoundError:
+            logging.error("❌ Error: cuentas.json no encontrado. La validación de correo no funcionará.")
+            self._tablas = _Tablas()
+            self._firma = None
+            return
+        except json.JSONDecodeError:
+            logging.error("❌ Error: Formato JSON inválido en cuentas.json. Se mantienen las cuentas cargadas anteriormente.")
+            self._firma = firma
+            return
+        self._tablas = construir_tablas(datos)
+        self._firma = firma
+        logging.info(f"Cuentas cargadas exitosamente desde cuentas.json ({len(self._tablas.por_correo)} correos, {len(self._tablas.por_dueno)} IDs).")
+
+    def _tablas_actuales(self):
+        """
+        Retorna la instantánea vigente, recargando antes si el archivo cambió en disco.
+        """
+        ahora = time.monotonic()
+        if ahora - self._ultima_revision >= self.intervalo_revision and self._lock_recarga.acquire(blocking=False):
+            # Solo un hilo revisa/recarga; los demás siguen con la instantánea anterior
+            try:
+                self._ultima_revision = ahora
+                if self._firma_archivo() != self._firma:
+                    logging.info("cuentas.json cambió en disco. Recargando cuentas...")
+                    self.cargar()
+            finally:
+                self._lock_recarga.release()
+        return self._tablas
+
+    def hay_cuentas(self):
+        return bool(self._tablas_actuales().por_correo)
+
+    def es_autorizado(self, correo):
+        return correo.strip().lower() in self._tablas_actuales().por_correo
+
+    def credenciales_imap(self, correo):
+        """
+        Retorna (user_imap, pass_imap) declarados para el correo en cuentas.json, o None.
+        """
+        registro = self._tablas_actuales().por_correo.get(correo.strip().lower())
+        return registro["imap"] if registro else None
+
+    def duenos_de(self, correo):
+        registro = self._tablas_actuales().por_correo.get(correo.strip().lower())
+        return registro["duenos"] if registro else frozenset()
+
+    def correos_de(self, dueno):
+        return list(self._tablas_actuales().por_dueno.get(str(dueno), []))
+
+
+registro_cuentas = RegistroCuentas()
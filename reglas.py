@@ -0,0 +1,110 @@
+import os
+import re
+import datetime
+import unicodedata
+
+# Tabla de reglas de los correos de Netflix que nos interesan. Cada regla dice qué asuntos la identifican
+# (con sus variantes de idioma; mayúsculas, acentos y espacios no importan), cómo sacar el enlace del HTML
+# y cuánto tiempo sirve ese enlace. Se compila una sola vez al importar: todos los asuntos quedan en una
+# única expresión con un grupo por acción, así cada correo se clasifica para todas las acciones en una pasada.
+
+VIGENCIA_CODIGO = float(os.getenv("VIGENCIA_CODIGO", "900"))  # segundos que sirve el enlace de un código
+VIGENCIA_HOGAR = float(os.getenv("VIGENCIA_HOGAR", "900"))  # segundos que sirve el enlace de hogar
+
+# Texto que comparten todos los asuntos: es lo que se busca en el servidor (UID SEARCH SUBJECT), que no sabe
+# de variantes ni de acentos. El resultado se clasifica después con clasificar().
+ASUNTO_BUSQUEDA = "Netflix"
+
+# Respuesta cuando no hay ningún correo reciente para la acción. Es un "no hay solicitud" y no un fallo
+# del servidor, así que cache_resultados la guarda el mismo tiempo que las demás respuestas negativas.
+MENSAJE_SIN_CORREO = "❌ No se encontró un correo reciente de Netflix para esta acción. Asegúrate de haberla solicitado y que el correo haya llegado."
+
+
+def normalizar(texto):
+    """
+    Minúsculas, sin acentos y con los espacios colapsados (ej. "Código  de" -> "codigo de").
+    """
+    texto = unicodedata.normalize("NFKD", texto)
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(texto.casefold().split())
+
+
+def _alternativas(textos):
+    return "|".join(re.escape(normalizar(texto)) for texto in textos)
+
+
+class Regla:
+    """
+    Una acción ("code", "hogar") y lo necesario para reconocer y leer sus correos.
+    """
+
+    def __init__(self, accion, asuntos, vigencia, textos_boton=(), parametro_enlace="nftoken="):
+        self.accion = accion
+        self.asuntos = tuple(asuntos)  # el primero es el canónico (el de las cuentas en español)
+        self.vigencia = vigencia
+        self.textos_boton = tuple(textos_boton)  # texto del botón cuyo enlace se prefiere, si lo hay
+        self.parametro_enlace = parametro_enlace  # si no hay botón, el primer enlace que lo contenga
+        self._re_boton = re.compile(_alternativas(self.textos_boton)) if self.textos_boton else None
+        for asunto in self.asuntos:
+            if normalizar(ASUNTO_BUSQUEDA) not in normalizar(asunto):
+                raise ValueError(f"El asunto '{asunto}' de la regla '{accion}' no contiene '{ASUNTO_BUSQUEDA}'.")
+
+    @property
+    def asunto(self):
+        return self.asuntos[0]
+
+    def es_boton(self, texto):
+        """
+        Indica si el texto de un enlace es el del botón de esta regla.
+        """
+        return self._re_boton is not None and self._re_boton.search(normalizar(texto)) is not None
+
+    def vigente(self, fecha, ahora=None):
+        """
+        Indica si un correo con esa fecha (cabecera Date, con zona horaria) todavía trae un enlace que
+        Netflix acepta. La edad se cuenta desde la fecha del correo, no desde que lo vimos.
+        """
+        ahora = ahora or datetime.datetime.now(datetime.timezone.utc)
+        return (ahora - fecha).total_seconds() <= self.vigencia
+
+
+REGLAS = (
+    Regla(
+        "code",
+        asuntos=(
+            "Código de acceso temporal de Netflix",
+            "Your Netflix temporary access code",
+            "Seu código de acesso temporário da Netflix",
+        ),
+        vigencia=VIGENCIA_CODIGO,
+    ),
+    Regla(
+        "hogar",
+        asuntos=(
+            "Importante: Cómo actualizar tu Hogar con Netflix",
+            "Important: How to update your Netflix Household",
+            "Importante: como atualizar sua Residência Netflix",
+        ),
+        vigencia=VIGENCIA_HOGAR,
+        textos_boton=("Sí, la envié yo", "Yes, this was me", "Sim, fui eu"),
+    ),
+)
+
+REGLAS_POR_ACCION = {regla.accion: regla for regla in REGLAS}
+
+# Un grupo con nombre por acción: el que coincide (lastgroup) es la acción del correo
+_RE_ASUNTOS = re.compile("|".join(f"(?P<{regla.accion}>{_alternativas(regla.asuntos)})" for regla in REGLAS))
+
+
+def clasificar(asunto):
+    """
+    Retorna la acción a la que corresponde el asunto, o None si no es un correo que nos interese.
+    """
+    if not asunto:
+        return None
+    encontrado = _RE_ASUNTOS.search(normalizar(asunto))
+    return encontrado.lastgroup if encontrado else None
+
+
+def regla(accion):
+    return REGLAS_POR_ACCION[accion]
@@ -0,0 +1,83 @@
+import os
+import shutil
+import logging
+import tempfile
+from gunicorn.app.base import BaseApplication
+
+# Punto de entrada de producción: sirve main.app con gunicorn (varios procesos, cada uno con varios hilos)
+# en lugar del servidor de desarrollo de Flask. La app se importa una vez en el proceso maestro (cuentas.json,
+# BeautifulSoup y las expresiones regulares ya cargadas) y los procesos hijos la heredan al hacer fork.
+# Los servicios con hilos propios (vigilante IMAP) se arrancan en cada hijo después del fork; cada proceso
+# tiene su propio pool IMAP, caché e índice, así que con VIGILANTE_IMAP=1 hay una conexión IDLE por proceso.
+# Las métricas de /metrics se suman entre los procesos a través de un directorio temporal (ver metricas.py).
+#
+#   python servidor.py
+
+WEB_PROCESOS = int(os.getenv("WEB_PROCESOS", "2"))
+WEB_HILOS = int(os.getenv("WEB_HILOS", "8"))  # peticiones simultáneas por proceso
+WEB_TIMEOUT_PETICIONES = int(os.getenv("WEB_TIMEOUT_PETICIONES", "30"))  # segundos para terminar las peticiones en curso al apagar
+WEB_TIMEOUT_APAGADO = int(os.getenv("WEB_TIMEOUT_APAGADO", "30"))  # segundos para terminar lo pendiente al apagar
+WEB_MARGEN_APAGADO = 5  # segundos para cerrar conexiones y salir antes de que el maestro mate el proceso
+PORT = int(os.getenv("PORT", "8080"))
+
+
+def _post_fork(server, worker):
+    # graceful_timeout es a la vez la espera del hijo por las peticiones en curso y el plazo tras el que el
+    # maestro lo mata (contado desde el SIGTERM). El hijo espera solo sus peticiones; el maestro, además,
+    # el tiempo del vaciado en _worker_exit, que corre después.
+    worker.cfg.set("graceful_timeout", WEB_TIMEOUT_PETICIONES)
+    import main
+    main.iniciar_servicios()
+    logging.info(f"Proceso web {worker.pid} listo ({WEB_HILOS} hilos).")
+
+
+def _on_exit(server):
+    # Solo si el directorio de métricas lo creó este servidor (y no vino de METRICAS_DIR)
+    if server.app.directorio_metricas:
+        shutil.rmtree(server.app.directorio_metricas, ignore_errors=True)
+
+
+def _worker_exit(server, worker):
+    # gunicorn ya dejó de aceptar peticiones y esperó las que estaban en curso; quedan los trabajos
+    # encolados por el webhook de Telegram, que siguen buscando en IMAP aunque su petición ya respondió
+    import main
+    logging.info(f"Proceso web {worker.pid} apagándose. Terminando trabajos pendientes...")
+    main.detener_servicios(timeout=WEB_TIMEOUT_APAGADO)
+
+
+class ServidorWeb(BaseApplication):
+    def __init__(self, opciones=None):
+        # Antes de importar main (en load()), que lee METRICAS_DIR al importar metricas
+        self.directorio_metricas = None
+        if "METRICAS_DIR" not in os.environ:
+            self.directorio_metricas = tempfile.mkdtemp(prefix="metricas-")
+            os.environ["METRICAS_DIR"] = self.directorio_metricas
+        self.opciones = {
+            "bind": f"0.0.0.0:{PORT}",
+            "workers": WEB_PROCESOS,
+            "threads": WEB_HILOS,
+            "worker_class": "gthread",
+            "preload_app": True,
+            "graceful_timeout": WEB_TIMEOUT_PETICIONES + WEB_TIMEOUT_APAGADO + WEB_MARGEN_APAGADO,
+            # El latido lo da el bucle principal del proceso, no los hilos: una consulta larga no lo reinicia
+            "timeout": 120,
+            "post_fork": _post_fork,
+            "worker_exit": _worker_exit,
+            "on_exit": _on_exit,
+        }
+        self.opciones.update(opciones or {})
+        super().__init__()
+
+    def load_config(self):
+        for clave, valor in self.opciones.items():
+            if clave in self.cfg.settings and valor is not None:
+                self.cfg.set(clave, valor)
+
+    def load(self):
+        from main import app
+        logging.info(f"Iniciando servidor web en {self.cfg.bind[0]} ({self.cfg.workers} procesos x {self.cfg.threads} hilos).")
+        return app
+
+
+if __name__ == "__main__":
+    ServidorWeb().run()
@@ -0,0 +1,5 @@
+import os
+
+# Se fija antes de importar los módulos del servidor, que leen la configuración al importarse
+os.environ.setdefault("BOT_TOKEN", "123456:prueba")
+os.environ.setdefault("ALMACEN_RUTA", "")  # sin correos.db en el directorio de trabajo
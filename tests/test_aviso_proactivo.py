@@ -0,0 +1,57 @@
+import datetime
+import time
+
+import pytest
+
+import aviso_proactivo as modulo
+from aviso_proactivo import AvisoProactivo
+from cache_resultados import CacheResultados, CACHE_TTL
+
+CODIGOS = {"https://netflix.test/1": "1111", "https://netflix.test/2": "2222"}
+
+
+@pytest.fixture
+def aviso(monkeypatch):
+    cache = CacheResultados()
+    monkeypatch.setattr(modulo, "cache_resultados", cache)
+    monkeypatch.setattr(modulo, "obtener_codigo_de_pagina", lambda link: CODIGOS[link])
+    monkeypatch.setattr(modulo.registro_cuentas, "es_autorizado", lambda correo: True)
+    monkeypatch.setattr(modulo.registro_cuentas, "duenos_de", lambda correo: set())
+    monkeypatch.setattr(modulo.almacen_correos, "reclamar_aviso", lambda *args: True)
+    return AvisoProactivo(activo=True, hilos=1), cache
+
+
+def _correo(aviso, uid, hace_segundos=0):
+    fecha = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=hace_segundos)
+    aviso.correo_nuevo("imap.test/buzon", 1, uid, "a@x.com", "code", f"https://netflix.test/{uid}", fecha)
+    aviso.detener()
+
+
+def test_un_correo_nuevo_reemplaza_el_codigo_anterior(aviso):
+    aviso, cache = aviso
+    _correo(aviso, 1, hace_segundos=30)
+    assert cache.obtener(("a@x.com", "code")) == ("ok", "1111")
+    _correo(aviso, 2)
+    assert cache.obtener(("a@x.com", "code")) == ("ok", "2222")
+
+
+def test_el_proceso_que_no_avisa_tambien_olvida_el_codigo_anterior(aviso, monkeypatch):
+    aviso, cache = aviso
+    _correo(aviso, 1)
+    monkeypatch.setattr(modulo.almacen_correos, "reclamar_aviso", lambda *args: False)
+    _correo(aviso, 2)
+    assert cache.obtener(("a@x.com", "code")) is None
+
+
+def test_el_resultado_se_guarda_como_maximo_cache_ttl(aviso):
+    aviso, cache = aviso
+    _correo(aviso, 1)
+    _, vence_en = cache._entradas[("a@x.com", "code")]
+    assert vence_en - time.monotonic() <= CACHE_TTL
+
+
+def test_un_correo_mas_viejo_no_pisa_al_mas_nuevo(aviso):
+    aviso, cache = aviso
+    _correo(aviso, 2)
+    _correo(aviso, 1, hace_segundos=30)  # resuelto después, pero llegó antes
+    assert cache.obtener(("a@x.com", "code")) == ("ok", "2222")
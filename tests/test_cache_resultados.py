@@ -0,0 +1,53 @@
+from cache_resultados import CacheResultados, ttl_por_estado, CACHE_TTL, CACHE_TTL_NEGATIVO
+from reglas import MENSAJE_SIN_CORREO
+
+
+def test_ttl_por_estado():
+    assert ttl_por_estado(("ok", "1234")) == CACHE_TTL
+    assert ttl_por_estado(("sin_solicitud", None)) == CACHE_TTL_NEGATIVO
+    assert ttl_por_estado(("error", MENSAJE_SIN_CORREO)) == CACHE_TTL_NEGATIVO
+    assert ttl_por_estado(("error", "❌ Error de IMAP: conexión rechazada")) == 0
+    assert ttl_por_estado(("sin_resultado", None)) == 0
+
+
+def test_sin_correo_reciente_se_guarda_en_cache():
+    cache = CacheResultados()
+    llamadas = []
+
+    def resolver():
+        llamadas.append(1)
+        return "error", MENSAJE_SIN_CORREO
+
+    for _ in range(3):
+        resultado, _ = cache.obtener_o_calcular(("a@x.com", "code"), resolver, ttl_por_estado)
+        assert resultado == ("error", MENSAJE_SIN_CORREO)
+    assert len(llamadas) == 1
+
+
+def test_errores_de_conexion_no_se_guardan():
+    cache = CacheResultados()
+    llamadas = []
+
+    def resolver():
+        llamadas.append(1)
+        return "error", "❌ Error de IMAP: conexión rechazada"
+
+    for _ in range(3):
+        cache.obtener_o_calcular(("a@x.com", "code"), resolver, ttl_por_estado)
+    assert len(llamadas) == 3
+
+
+def test_fallo_real_de_un_buzon_manda_sobre_sin_correo(monkeypatch):
+    import funciones
+
+    def buscar(usuario_imap, contrasena_imap, asunto, correo, es_hogar=False):
+        if usuario_imap == "roto@x.com":
+            return None, "❌ Error de IMAP: conexión rechazada"
+        return None, MENSAJE_SIN_CORREO
+
+    monkeypatch.setattr(funciones, "obtener_link_de_correo", buscar)
+    buzones = [("vacio@x.com", "p"), ("roto@x.com", "p")]
+    link, error = funciones.obtener_link_en_buzones(buzones, "Netflix", "a@x.com")
+    assert link is None
+    assert error == "❌ Error de IMAP: conexión rechazada"
+    assert ttl_por_estado(("error", error)) == 0
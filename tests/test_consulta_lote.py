@@ -0,0 +1,51 @@
+import threading
+
+import main
+from cache_resultados import CacheResultados
+from cola_trabajos import PoolTrabajos
+
+
+def test_lote_solo_busca_los_que_no_estan_en_cache(monkeypatch):
+    cache = CacheResultados()
+    cache.guardar(("a@x.com", "code"), ("ok", "1111"), lambda resultado: 60)
+    buscados = []
+
+    def resolver_lote(correos, buzon_por_defecto, accion="code"):
+        buscados.extend(correos)
+        for correo in correos:
+            yield correo, ("ok", "2222")
+
+    monkeypatch.setattr(main, "cache_resultados", cache)
+    monkeypatch.setattr(main, "resolver_lote", resolver_lote)
+
+    resultados = dict(main.resolver_lote_con_cache(["A@x.com", "b@x.com"], "web"))
+    assert buscados == ["b@x.com"]
+    assert resultados == {"a@x.com": ("ok", "1111"), "b@x.com": ("ok", "2222")}
+    # Lo resuelto en el lote queda en la caché para la siguiente consulta
+    assert cache.obtener(("b@x.com", "code")) == ("ok", "2222")
+
+
+def test_lote_web_pasa_por_el_pool(monkeypatch):
+    pool = PoolTrabajos(hilos=1, capacidad=1)
+    hilos = []
+
+    def resolver_lote_con_cache(correos, canal):
+        hilos.append(threading.current_thread().name)
+        for correo in correos:
+            yield correo, ("ok", "1234")
+
+    monkeypatch.setattr(main, "pool_trabajos", pool)
+    monkeypatch.setattr(main, "resolver_lote_con_cache", resolver_lote_con_cache)
+    try:
+        assert list(main.resolver_lote_web(["a@x.com"])) == [("a@x.com", ("ok", "1234"))]
+        assert hilos == ["trabajador-1"]
+    finally:
+        pool.detener(timeout=5)
+
+
+def test_lote_web_con_la_cola_llena_responde_ocupado(monkeypatch):
+    pool = PoolTrabajos(hilos=1, capacidad=0)
+    monkeypatch.setattr(main, "pool_trabajos", pool)
+    monkeypatch.setattr(main, "es_correo_autorizado", lambda correo: True)
+    respuesta = main.app.test_client().post("/consultar_lote", data={"correos": "a@x.com"})
+    assert "muy ocupado" in respuesta.get_data(as_text=True)
@@ -0,0 +1,46 @@
+import multiprocessing
+import os
+
+from metricas import RegistroMetricas
+
+
+def _registro(directorio=""):
+    registro = RegistroMetricas(directorio=directorio)
+    contador = registro.contador("pruebas_total", "Prueba.", ("canal",))
+    histograma = registro.histograma("prueba_segundos", "Prueba.", buckets=(1,))
+    registro.medidor("prueba_cola", "Prueba.", lambda: 3)
+    return registro, contador, histograma
+
+
+def test_sin_directorio_solo_este_proceso():
+    registro, contador, histograma = _registro()
+    contador.inc(canal="web")
+    histograma.observar(0.5)
+    texto = registro.exportar()
+    assert 'pruebas_total{canal="web"} 1' in texto
+    assert "prueba_segundos_count 1" in texto
+    assert "prueba_cola 3" in texto
+
+
+def test_suma_los_contadores_de_todos_los_procesos(tmp_path):
+    registro, contador, histograma = _registro(str(tmp_path))
+
+    def en_otro_proceso():
+        contador.inc(2, canal="web")
+        histograma.observar(0.5)
+        registro.volcar()
+
+    otro = multiprocessing.get_context("fork").Process(target=en_otro_proceso)
+    otro.start()
+    otro.join()
+    assert otro.exitcode == 0
+
+    contador.inc(canal="web")
+    histograma.observar(2)
+    texto = registro.exportar()
+    assert 'pruebas_total{canal="web"} 3' in texto
+    assert 'prueba_segundos_bucket{le="1"} 1' in texto
+    assert "prueba_segundos_count 2" in texto
+    # Los medidores salen por proceso, y solo los de procesos vivos
+    assert f'prueba_cola{{proceso="{os.getpid()}"}} 3' in texto
+    assert f'proceso="{otro.pid}"' not in texto
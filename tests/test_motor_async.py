@@ -0,0 +1,32 @@
+import asyncio
+import time
+
+from estado_buzones import EstadoBuzon
+from motor_async import MotorAsync
+
+
+def test_el_lock_del_buzon_se_espera_sin_frenar_el_bucle():
+    motor = MotorAsync()
+    estado = EstadoBuzon("imap.test/a")
+    estado.agregar(1, "code", ["a@x.com"], None)
+    estado.guardar_link(1, "https://netflix.test/1")
+    try:
+        # Otro hilo (ej. una consulta en lote síncrona) está sincronizando el buzón
+        estado.lock.acquire()
+        futuro = asyncio.run_coroutine_threadsafe(motor._en_estado(estado, estado.link_de, 1), motor._asegurar_bucle())
+        time.sleep(0.1)
+        assert not futuro.done()
+        assert motor.ejecutar(asyncio.sleep(0, result="libre"), timeout=1) == "libre"
+        estado.lock.release()
+        assert futuro.result(2) == "https://netflix.test/1"
+
+        # Dentro del bloque, lo que toca el estado reentra en el RLock desde el hilo del buzón
+        async def sincronizar():
+            async with motor._bloquear(estado):
+                return await motor._en_buzon(estado, len, estado)
+        assert motor.ejecutar(sincronizar(), timeout=2) == 1
+        # Y al salir el RLock queda libre para los demás hilos
+        assert estado.lock.acquire(timeout=1)
+        estado.lock.release()
+    finally:
+        motor.detener()
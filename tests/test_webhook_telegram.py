@@ -0,0 +1,103 @@
+import json
+import threading
+import time
+
+import pytest
+
+import main
+from almacen_correos import AlmacenCorreos
+from cola_trabajos import PoolTrabajos
+from cola_telegram import cola_telegram
+
+
+def _update(update_id, chat_id, texto="/code a@x.com"):
+    return json.dumps({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Prueba"},
+            "text": texto,
+            "entities": [{"type": "bot_command", "offset": 0, "length": 5}],
+        },
+    })
+
+
+def _esperar(condicion, timeout=5):
+    limite = time.monotonic() + timeout
+    while not condicion():
+        assert time.monotonic() < limite, "la condición no se cumplió a tiempo"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def webhook(monkeypatch):
+    pool = PoolTrabajos(hilos=4, capacidad=1)
+    liberar = threading.Event()
+    en_curso = []
+    terminadas = []
+    enviados = []
+
+    def resolver(correo, accion, canal):
+        en_curso.append(correo)
+        liberar.wait(5)
+        terminadas.append(correo)
+        return ("ok", "1234"), True
+
+    monkeypatch.setattr(main, "pool_trabajos", pool)
+    monkeypatch.setattr(main, "es_correo_autorizado", lambda correo: True)
+    monkeypatch.setattr(main, "buzones_de", lambda correo: [("buzon@x.com", "clave")])
+    monkeypatch.setattr(main, "resolver_con_cache", resolver)
+    monkeypatch.setattr(cola_telegram, "responder", lambda message, texto, **opciones: enviados.append((message.chat.id, texto)))
+    monkeypatch.setattr(cola_telegram, "enviar", lambda chat_id, texto, **opciones: enviados.append((chat_id, texto)))
+
+    cliente = main.app.test_client()
+
+    def publicar(update_id, chat_id):
+        respuesta = cliente.post(f"/{main.BOT_TOKEN}", data=_update(update_id, chat_id), content_type="application/json")
+        assert respuesta.status_code == 200
+
+    yield publicar, liberar, en_curso, terminadas, enviados
+    liberar.set()
+    pool.detener(timeout=5)
+
+
+def test_el_bot_no_usa_hilos_propios():
+    assert main.bot.threaded is False
+
+
+def test_actualizaciones_del_mismo_chat_se_atienden_en_orden(webhook):
+    publicar, liberar, en_curso, terminadas, _ = webhook
+    publicar(1, 42)
+    _esperar(lambda: len(en_curso) == 1)
+    publicar(2, 42)
+    time.sleep(0.2)
+    # La segunda espera detrás de la primera: el manejador corre dentro del trabajo del pool
+    assert len(en_curso) == 1
+    liberar.set()
+    _esperar(lambda: len(terminadas) == 2)
+    assert len(en_curso) == 2
+
+
+def test_cola_llena_responde_ocupado(webhook):
+    publicar, liberar, en_curso, _, enviados = webhook
+    publicar(1, 42)
+    _esperar(lambda: len(en_curso) == 1)
+    publicar(2, 42)  # espera su turno detrás de la primera y ocupa el único lugar de la cola
+    publicar(3, 7)
+    assert any(chat_id == 7 and "muy ocupado" in texto for chat_id, texto in enviados)
+    liberar.set()
+
+
+def test_reintento_en_otro_proceso_no_se_procesa_dos_veces(webhook, monkeypatch, tmp_path):
+    publicar, liberar, en_curso, terminadas, _ = webhook
+    monkeypatch.setattr(main, "almacen_correos", AlmacenCorreos(ruta=str(tmp_path / "correos.db")))
+    liberar.set()
+    publicar(1, 42)
+    _esperar(lambda: len(terminadas) == 1)
+    # Otro worker del servidor: su pool no vio el update_id, pero el almacén compartido sí
+    monkeypatch.setattr(main, "pool_trabajos", PoolTrabajos(hilos=1))
+    publicar(1, 42)
+    time.sleep(0.2)
+    assert len(en_curso) == 1
@@ -0,0 +1,223 @@
+import os
+import time
+import select
+import imaplib
+import datetime
+import logging
+import threading
+
+from conexiones_imap import IMAP_HOST, abrir_conexion, _cerrar_silencioso
+from funciones import (
+    _fecha_imap, _fecha_de, _decodificar_asunto, _direcciones_destinatario,
+    _obtener_cabeceras_en_lote, _obtener_html_por_partes, extraer_link_con_token_o_confirmacion,
+)
+from indice_correos import indice_correos
+from reglas import clasificar, regla
+from aviso_proactivo import aviso_proactivo, AVISO_INTERVALO_SONDEO
+from metricas import contexto_consulta
+
+# Vigilante en segundo plano: mantiene una conexión IMAP en IDLE, clasifica cada correo nuevo de Netflix
+# y guarda su enlace en el índice, para que la web y el bot no tengan que recorrer el buzón.
+
+VIGILANTE_RENOVACION_IDLE = float(os.getenv("VIGILANTE_RENOVACION_IDLE", "240"))  # segundos por ciclo de IDLE (máx. 29 min por RFC 2177)
+VIGILANTE_MENSAJES_INICIALES = int(os.getenv("VIGILANTE_MENSAJES_INICIALES", "50"))
+VIGILANTE_ESPERA_REINTENTO = float(os.getenv("VIGILANTE_ESPERA_REINTENTO", "30"))
+
+
+def clasificar_asunto(asunto):
+    """
+    Retorna la acción ("code" u "hogar") a la que corresponde el asunto, o None si no es un correo que nos interese.
+    """
+    return clasificar(asunto)
+
+
+class VigilanteCorreos(threading.Thread):
+    """
+    Hilo que vigila el buzón con IMAP IDLE y alimenta el índice de correos.
+    Si el servidor no soporta IDLE, hace un sondeo con NOOP cada VIGILANTE_RENOVACION_IDLE segundos.
+    """
+
+    def __init__(self, usuario_imap, contrasena_imap, indice=indice_correos, host=IMAP_HOST, buzon="inbox"):
+        super().__init__(name="vigilante-imap", daemon=True)
+        self.usuario_imap = usuario_imap
+        self.contrasena_imap = contrasena_imap
+        self.indice = indice
+        self.host = host
+        self.buzon = buzon
+        self.ultimo_uid = 0
+        self.uidvalidity = 0
+        self._detener = threading.Event()
+        self._mail = None
+
+    def detener(self):
+        self._detener.set()
+        self.indice.detener()
+        mail = self._mail
+        if mail is not None:
+            # Cerrar el socket despierta al hilo si está esperando en IDLE
+            try:
+                mail.shutdown()
+            except Exception:
+                pass
+
+    def run(self):
+        logging.info(f"VIGILANTE: Iniciando vigilancia IMAP de {self.usuario_imap}.")
+        while not self._detener.is_set():
+            try:
+                self._conectar()
+                self._barrido_inicial()
+                while not self._detener.is_set():
+                    self.indice.latido()
+                    self._esperar_novedades()
+                    if self._detener.is_set():
+                        break
+                    self._procesar_nuevos()
+            except Exception as e:
+                if self._detener.is_set():
+                    break
+                logging.error(f"VIGILANTE: Error en la vigilancia IMAP ({e}). Reintentando en {VIGILANTE_ESPERA_REINTENTO} segundos.")
+                self.indice.detener()  # las consultas vuelven a la búsqueda normal mientras tanto
+            finally:
+                if self._mail is not None:
+                    _cerrar_silencioso(self._mail)
+                    self._mail = None
+            self._detener.wait(VIGILANTE_ESPERA_REINTENTO)
+        logging.info("VIGILANTE: Vigilancia IMAP detenida.")
+
+    def _conectar(self):
+        mail = abrir_conexion(self.host)
+        mail.login(self.usuario_imap, self.contrasena_imap)
+        mail.select(self.buzon)
+        _, uidvalidity = mail.response("UIDVALIDITY")
+        self.uidvalidity = int(uidvalidity[-1]) if uidvalidity and uidvalidity[-1] else 0
+        self._mail = mail
+
+    def _barrido_inicial(self):
+        """
+        Al conectar (o reconectar) clasifica los últimos correos para no empezar con el índice vacío.
+        """
+        desde = datetime.date.today() - datetime.timedelta(days=1)
+        estado, datos = self._mail.uid("SEARCH", "SINCE", _fecha_imap(desde))
+        uids = datos[0].split() if estado == "OK" and datos and datos[0] else []
+        uids = [uid.decode() for uid in uids[-VIGILANTE_MENSAJES_INICIALES:]]
+        if self.ultimo_uid:
+            uids = [uid for uid in uids if int(uid) > self.ultimo_uid]
+        # Al reconectar, lo que llegó mientras tanto es nuevo; al arrancar el proceso no se avisa lo anterior
+        self._clasificar(uids, avisar=bool(self.ultimo_uid))
+        if not self.ultimo_uid:
+            # Si no había correos recientes, arrancamos desde el UIDNEXT actual
+            _, uidnext = self._mail.response("UIDNEXT")
+            if uidnext and uidnext[0]:
+                self.ultimo_uid = max(self.ultimo_uid, int(uidnext[0]) - 1)
+        logging.info(f"VIGILANTE: Barrido inicial completo ({len(uids)} correos revisados, índice con {len(self.indice)} entradas).")
+
+    def _esperar_novedades(self):
+        """
+        Espera en IDLE hasta que llegue un EXISTS o venza el ciclo. imaplib no soporta IDLE, así que
+        se envía el comando a mano y se lee el socket con select para poder cortar por tiempo.
+        """
+        mail = self._mail
+        if "IDLE" not in mail.capabilities:
+            self._detener.wait(AVISO_INTERVALO_SONDEO if aviso_proactivo.activo else VIGILANTE_RENOVACION_IDLE)
+            mail.noop()
+            return
+
+        tag = mail._new_tag()
+        mail.send(tag + b" IDLE\r\n")
+        respuesta = mail.readline()
+        if not respuesta.startswith(b"+"):
+            raise imaplib.IMAP4.error(f"El servidor rechazó IDLE: {respuesta!r}")
+
+        limite = time.monotonic() + VIGILANTE_RENOVACION_IDLE
+        try:
+            while not self._detener.is_set():
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                pendiente = getattr(mail.sock, "pending", lambda: 0)()
+                if not pendiente:
+                    listos, _, _ = select.select([mail.sock], [], [], min(restante, 5))
+                    if not listos:
+                        continue
+                linea = mail.readline()
+                if not linea:
+                    raise imaplib.IMAP4.abort("Conexión cerrada por el servidor durante IDLE.")
+                if linea.rstrip().endswith(b"EXISTS"):
+                    break
+        finally:
+            if not self._detener.is_set():
+                mail.send(b"DONE\r\n")
+                while True:
+                    linea = mail.readline()
+                    if not linea:
+                        raise imaplib.IMAP4.abort("Conexión cerrada por el servidor al terminar IDLE.")
+                    if linea.startswith(tag):
+                        break
+
+    def _procesar_nuevos(self):
+        estado, datos = self._mail.uid("SEARCH", "UID", f"{self.ultimo_uid + 1}:*")
+        uids = datos[0].split() if estado == "OK" and datos and datos[0] else []
+        # "n:*" devuelve siempre el último mensaje aunque su UID sea menor que n
+        uids = [uid.decode() for uid in uids if int(uid) > self.ultimo_uid]
+        if uids:
+            logging.info(f"VIGILANTE: {len(uids)} correos nuevos.")
+            self._clasificar(uids, avisar=True)
+
+    def _clasificar(self, uids, avisar=False):
+        """
+        Lee las cabeceras de los UIDs en un solo FETCH, clasifica por asunto y, para el correo más
+        reciente de cada (destinatario, acción), extrae el enlace y lo guarda en el índice.
+        Con avisar, también se lo pasa al aviso proactivo (ver aviso_proactivo.py).
+        """
+        if not uids:
+            return
+        cabeceras = _obtener_cabeceras_en_lote(self._mail, uids)
+        ahora = datetime.datetime.now(datetime.timezone.utc)
+        elegidos = {}  # (correo, accion) -> uid más reciente
+        fechas = {}  # uid -> fecha de llegada (cabecera Date)
+        for uid in uids:
+            mensaje = cabeceras.get(uid)
+            if mensaje is None:
+                continue
+            accion = clasificar_asunto(_decodificar_asunto(mensaje))
+            fechas[uid] = _fecha_de(mensaje)
+            # Un correo más viejo que la vigencia de su regla trae un enlace que Netflix ya no acepta
+            if accion and regla(accion).vigente(fechas[uid], ahora):
+                for correo in _direcciones_destinatario(mensaje):
+                    elegidos[(correo, accion)] = uid
+
+        links_por_uid = {}
+        for (correo, accion), uid in elegidos.items():
+            if uid not in links_por_uid:
+                with contexto_consulta("vigilante", accion):
+                    html = _obtener_html_por_partes(self._mail, uid)
+                    links_por_uid[uid] = extraer_link_con_token_o_confirmacion(html, es_hogar=(accion == "hogar")) if html else None
+            if links_por_uid[uid]:
+                self.indice.guardar(correo, accion, links_por_uid[uid], uid=uid, fecha=fechas[uid])
+                if avisar:
+                    aviso_proactivo.correo_nuevo(f"{self.host}/{self.usuario_imap.lower()}", self.uidvalidity, uid,
+                                                 correo, accion, links_por_uid[uid], fechas[uid])
+
+        self.ultimo_uid = max([self.ultimo_uid] + [int(uid) for uid in uids])
+
+
+_vigilante = None
+
+
+def iniciar_vigilante(usuario_imap, contrasena_imap):
+    """
+    Arranca (una sola vez por proceso) el vigilante IMAP en segundo plano.
+    """
+    global _vigilante
+    if _vigilante is not None and _vigilante.is_alive():
+        return _vigilante
+    _vigilante = VigilanteCorreos(usuario_imap, contrasena_imap)
+    _vigilante.start()
+    return _vigilante
+
+
+def detener_vigilante():
+    global _vigilante
+    if _vigilante is not None:
+        _vigilante.detener()
+        _vigilante = None